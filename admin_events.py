@@ -0,0 +1,138 @@
+"""Події для живої адмінської панелі (Server-Sent Events).
+
+Зміни, цікаві панелі (нова новина, зміна модерації, видалення, новий користувач), публікуються через
+pg_notify на каналі ADMIN_EVENTS_CHANNEL у тій самій транзакції, що й сама зміна, тож доходять до всіх
+екземплярів бота лише після коміту. AdminEventHub тримає одне LISTEN-з'єднання на екземпляр і розсилає
+події підключеним панелям; поки панелей немає, з'єднання закрите. Лічильники (загальні кількості та
+активні користувачі зі stats_rollup) хаб надсилає раз на ADMIN_EVENTS_COUNTERS_INTERVAL секунд, лише
+якщо вони змінилися. Тож навантаження на БД залежить від частоти змін, а не від кількості оновлень панелі.
+
+Панель, що не встигає читати події, отримує "resync" і перезавантажує таблиці повністю; те саме після
+перепідключення LISTEN, коли частину подій могло бути пропущено.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+ADMIN_EVENTS_CHANNEL = "admin_events"
+ADMIN_EVENTS_COUNTERS_INTERVAL = float(os.getenv("ADMIN_EVENTS_COUNTERS_INTERVAL", "10")) # Як часто надсилати лічильники, секунд
+ADMIN_EVENTS_HEARTBEAT = 15 # Коментар-пінг, щоб проксі не закривали тихе з'єднання, секунд
+ADMIN_EVENTS_QUEUE_SIZE = 1000 # Скільки подій може чекати на одну панель, перш ніж вона отримає resync
+RECONNECT_DELAY = 5
+
+NEWS_FIELDS = ("id", "title", "moderation_status", "published_at", "source_id")
+USER_FIELDS = ("id", "username", "first_name", "is_admin", "last_active")
+MAX_TITLE_LENGTH = 200 # Корисне навантаження NOTIFY обмежене ~8 КБ
+
+def news_payload(news: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {field: news.get(field) for field in NEWS_FIELDS}
+    if payload["title"] and len(payload["title"]) > MAX_TITLE_LENGTH:
+        payload["title"] = payload["title"][:MAX_TITLE_LENGTH] + "…"
+    return payload
+
+def user_payload(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: user.get(field) for field in USER_FIELDS}
+
+async def notify(cur: psycopg.AsyncCursor, event: str, data: Dict[str, Any]):
+    """Публікує подію; доставляється слухачам лише після коміту транзакції cur."""
+    await cur.execute("SELECT pg_notify(%s, %s)", (ADMIN_EVENTS_CHANNEL, json.dumps({"event": event, "data": data}, default=str)))
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+class AdminEventHub:
+    def __init__(self, counters_interval: float):
+        self.counters_interval = counters_interval
+        self.conninfo: Optional[str] = None
+        self.get_counters: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._tasks: list = []
+        self._last_counters: Optional[Dict[str, Any]] = None
+
+    def publish(self, event: str, data: Any):
+        message = format_event(event, data)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Панель відстала: замість решти подій вона отримає одну команду перезавантажитися
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(format_event("resync", {}))
+
+    def _subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(ADMIN_EVENTS_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._send_counters())]
+        return queue
+
+    def _unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._last_counters = None
+
+    async def _listen(self):
+        first = True
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {ADMIN_EVENTS_CHANNEL}")
+                    if not first:
+                        # Поки з'єднання не було, події могли загубитися
+                        self.publish("resync", {})
+                    first = False
+                    async for notification in conn.notifies():
+                        try:
+                            message = json.loads(notification.payload)
+                            self.publish(message["event"], message["data"])
+                        except (ValueError, KeyError) as e:
+                            logger.warning(f"Некоректна подія адмінської панелі: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Втрачено з'єднання LISTEN для подій адмінської панелі: {e}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _send_counters(self):
+        while True:
+            await asyncio.sleep(self.counters_interval)
+            try:
+                counters = await self.get_counters()
+            except Exception as e:
+                logger.error(f"Не вдалося отримати лічильники для адмінської панелі: {e}")
+                continue
+            if counters != self._last_counters:
+                self._last_counters = counters
+                self.publish("counters", counters)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Потік SSE для однієї панелі: спершу поточні лічильники, далі події в міру їх появи."""
+        queue = self._subscribe()
+        try:
+            yield format_event("counters", await self.get_counters())
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), ADMIN_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            self._unsubscribe(queue)
+
+hub = AdminEventHub(ADMIN_EVENTS_COUNTERS_INTERVAL)
+
+def setup(conninfo: str, get_counters: Callable[[], Awaitable[Dict[str, Any]]]):
+    hub.conninfo = conninfo
+    hub.get_counters = get_counters
@@ -0,0 +1,116 @@
+"""Мікропакетування дрібних фонових запитів до AI (класифікація тем, фільтр цікавості).
+
+Такі запити короткі, тож більшу частину часу й токенів кожного з них займає фіксована частина: мережа,
+інструкція промпту. MicroBatcher збирає запити, що надходять протягом AI_BATCH_MAX_DELAY_MS (або доки їх
+не набереться AI_BATCH_MAX_ITEMS), і надсилає їх одним промптом, який просить JSON-масив результатів з id
+кожного елемента. Результати розсилаються тим, хто чекає. Елементи, для яких відповідь не дала результату
+(нерозбірливий JSON, пропущений id), виконуються окремими одиночними запитами. Якщо ж сам пакетний запит
+не вдався (send_batch кинув виняток — AI перевантажений або недоступний), виняток отримують усі, хто чекає:
+одиночні запити в цю мить лише додали б навантаження.
+
+Інтерактивні запити (ai_scheduler.INTERACTIVE) не чекають на пакет і йдуть одразу одиночним запитом.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+
+import ai_scheduler
+
+logger = logging.getLogger(__name__)
+
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "10")) # Скільки елементів об'єднувати в один запит (1 — без пакетування)
+AI_BATCH_MAX_DELAY_MS = float(os.getenv("AI_BATCH_MAX_DELAY_MS", "200")) # Скільки чекати на наступні елементи пакета, мілісекунд
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def extract_json_array(response: Optional[str]) -> Optional[List[Any]]:
+    """JSON-масив із відповіді моделі або None.
+
+    Модель часто обгортає JSON у ```json ... ```, тож беремо текст від першої "[" до останньої "]".
+    """
+    if not response:
+        return None
+    start, end = response.find("["), response.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        items = json.loads(response[start:end + 1])
+    except ValueError:
+        return None
+    return items if isinstance(items, list) else None
+
+def results_by_id(response: Optional[str], count: int, field: str) -> Dict[int, Any]:
+    """{id: item[field]} для елементів масиву з id у межах 0..count-1."""
+    results = {}
+    for item in extract_json_array(response) or []:
+        if not isinstance(item, dict) or field not in item:
+            continue
+        try:
+            index = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count:
+            results[index] = item[field]
+    return results
+
+class MicroBatcher(Generic[T, R]):
+    def __init__(self, name: str, send_batch: Callable[[List[T]], Awaitable[Dict[int, R]]],
+                 send_one: Callable[[T], Awaitable[R]], max_items: int, max_delay: float):
+        self.name = name
+        self.send_batch = send_batch # Повертає {позиція елемента в пакеті: результат}; відсутні позиції підуть одиночними запитами
+        self.send_one = send_one
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        if self.max_items <= 1 or ai_scheduler.current_lane() == ai_scheduler.INTERACTIVE:
+            return await self.send_one(item)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]):
+        results: Dict[int, Any] = {}
+        if len(batch) > 1:
+            try:
+                results = dict(await self.send_batch([item for item, _ in batch]))
+            except Exception as e:
+                logger.warning(f"Пакетний запит {self.name} ({len(batch)} елементів) не вдався: {e!r}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        missing = [index for index in range(len(batch)) if index not in results]
+        if missing and len(batch) > 1:
+            logger.warning(f"Пакетний запит {self.name}: немає результатів для {len(missing)} з {len(batch)} елементів, "
+                           f"виконуємо їх окремо.")
+        fallback = await asyncio.gather(*(self.send_one(batch[index][0]) for index in missing), return_exceptions=True)
+        results.update(zip(missing, fallback))
+        for index, (_, future) in enumerate(batch):
+            if future.done(): # Той, хто чекав, уже скасував запит
+                continue
+            if isinstance(results[index], BaseException):
+                future.set_exception(results[index])
+            else:
+                future.set_result(results[index])
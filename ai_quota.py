@@ -0,0 +1,258 @@
+"""Квоти на AI-функції для користувачів.
+
+Хендлер з прапорцем flags={"ai": "<функція>"} проходить через AIQuotaMiddleware: у ковзному вікні
+AI_QUOTA_WINDOW секунд користувач може зробити не більше N запитів до кожної функції і не більше M
+запитів загалом. Ліміти залежать від тарифу: звичайний, преміум (is_premium і premium_expires_at ще не
+минув), адміністратори квот не мають.
+
+Перевірка не звертається до БД: лічильники живуть у пам'яті, а AIQuota.sync_task раз на
+AI_QUOTA_SYNC_INTERVAL секунд одним запитом додає накопичені прирости до таблиці ai_usage, забирає звідти
+підсумки (так враховуються запити, оброблені іншими екземплярами бота) та оновлює список преміум-користувачів.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+AI_QUOTA_ENABLED = os.getenv("AI_QUOTA_ENABLED", "1").lower() not in ("0", "false", "no")
+AI_QUOTA_WINDOW = int(os.getenv("AI_QUOTA_WINDOW", "3600")) # Тривалість ковзного вікна, секунд
+AI_QUOTA_FREE_TOTAL = int(os.getenv("AI_QUOTA_FREE_TOTAL", "30")) # Усіх AI-запитів за вікно (звичайний тариф)
+AI_QUOTA_PREMIUM_TOTAL = int(os.getenv("AI_QUOTA_PREMIUM_TOTAL", "300")) # Усіх AI-запитів за вікно (преміум)
+AI_QUOTA_FREE_FEATURE = int(os.getenv("AI_QUOTA_FREE_FEATURE", "10")) # Запитів до однієї функції за вікно (звичайний тариф)
+AI_QUOTA_PREMIUM_FEATURE = int(os.getenv("AI_QUOTA_PREMIUM_FEATURE", "100")) # Запитів до однієї функції за вікно (преміум)
+AI_QUOTA_FEATURE_LIMITS = os.getenv("AI_QUOTA_FEATURE_LIMITS", "translate=5/50,ask=10/100") # Окремі ліміти: функція=звичайний/преміум
+AI_QUOTA_SYNC_INTERVAL = float(os.getenv("AI_QUOTA_SYNC_INTERVAL", "10")) # Як часто синхронізувати лічильники з БД, секунд
+
+FREE = "free"
+PREMIUM = "premium"
+ADMIN = "admin"
+TOTAL = "*" # Сумарний лічильник за всіма функціями
+
+CLEANUP_EVERY = 60 # Видаляти застарілі вікна з ai_usage раз на стільки синхронізацій
+
+def parse_feature_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        feature, _, values = item.partition("=")
+        free, _, premium = values.partition("/")
+        try:
+            limits[feature.strip()] = (int(free), int(premium or free))
+        except ValueError:
+            logger.warning(f"Некоректний ліміт AI_QUOTA_FEATURE_LIMITS: {item!r}")
+    return limits
+
+class SlidingWindowCounter:
+    """Наближене ковзне вікно за двома сусідніми фіксованими вікнами.
+
+    Оцінка = лічильник попереднього вікна, помножений на частку, що ще входить у ковзне вікно,
+    плюс лічильник поточного. Достатньо двох чисел на ключ, і їх легко зберігати в БД.
+    """
+    __slots__ = ("window", "current", "previous")
+
+    def __init__(self):
+        self.window = 0
+        self.current = 0
+        self.previous = 0
+
+    def _roll(self, window: int):
+        if window > self.window:
+            self.previous = self.current if window == self.window + 1 else 0
+            self.current = 0
+            self.window = window
+
+    def estimate(self, now: float, size: int) -> float:
+        self._roll(int(now // size))
+        return self.previous * (1 - (now % size) / size) + self.current
+
+    def seconds_until_below(self, limit: int, now: float, size: int) -> float:
+        elapsed = (now % size) / size
+        if self.current + 1 <= limit:
+            # Чекаємо, доки внесок попереднього вікна зменшиться настільки, щоб звільнився запит
+            return max(0.0, 1 - (limit - self.current - 1) / self.previous - elapsed) * size if self.previous else 0.0
+        # Поточне вікно вичерпано: після його завершення воно стане попереднім
+        return (1 - elapsed) * size + max(0.0, 1 - (limit - 1) / self.current) * size
+
+    def merge(self, window: int, count: int):
+        self._roll(window)
+        if window == self.window:
+            self.current = max(self.current, count)
+        elif window == self.window - 1:
+            self.previous = max(self.previous, count)
+
+class AIQuota:
+    def __init__(self, window: int, free_total: int, premium_total: int, free_feature: int, premium_feature: int,
+                 feature_limits: Dict[str, Tuple[int, int]]):
+        self.window = window
+        self.total_limits = {FREE: free_total, PREMIUM: premium_total}
+        self.feature_limits = {FREE: free_feature, PREMIUM: premium_feature}
+        self.per_feature = feature_limits
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self._counters: Dict[Tuple[int, str], SlidingWindowCounter] = {}
+        self._pending: Dict[Tuple[int, str, int], int] = defaultdict(int)
+        self._tiers: Dict[int, str] = {}
+
+    def tier(self, user_id: int) -> str:
+        return self._tiers.get(user_id, FREE)
+
+    def limit(self, tier: str, feature: str) -> int:
+        if feature == TOTAL:
+            return self.total_limits[tier]
+        if feature in self.per_feature:
+            free, premium = self.per_feature[feature]
+            return premium if tier == PREMIUM else free
+        return self.feature_limits[tier]
+
+    def _counter(self, user_id: int, feature: str) -> SlidingWindowCounter:
+        counter = self._counters.get((user_id, feature))
+        if counter is None:
+            counter = self._counters[(user_id, feature)] = SlidingWindowCounter()
+        return counter
+
+    def consume(self, user_id: int, feature: str, now: Optional[float] = None) -> Optional[float]:
+        """Зараховує запит і повертає None, або повертає, через скільки секунд запит стане можливим."""
+        tier = self.tier(user_id)
+        if tier == ADMIN:
+            return None
+        now = time.time() if now is None else now
+        counters = [(self._counter(user_id, key), self.limit(tier, key), key) for key in (feature, TOTAL)]
+        waits = [counter.seconds_until_below(limit, now, self.window)
+                 for counter, limit, _ in counters if counter.estimate(now, self.window) + 1 > limit]
+        if waits:
+            return max(max(waits), 1.0)
+        for counter, _, key in counters:
+            counter.current += 1
+            self._pending[(user_id, key, counter.window)] += 1
+        return None
+
+    def _merge(self, rows):
+        for row in rows:
+            window = int(row["window_start"].timestamp() // self.window)
+            self._counter(row["user_id"], row["feature"]).merge(window, row["count"])
+
+    async def load(self):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("SELECT user_id, feature, window_start, count FROM ai_usage WHERE window_start >= now() - make_interval(secs => %s)",
+                                  (2 * self.window,))
+                self._merge(await cur.fetchall())
+
+    async def refresh_tiers(self):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("""
+                    SELECT id, is_admin FROM users
+                    WHERE is_admin OR (is_premium AND (premium_expires_at IS NULL OR premium_expires_at > now()))
+                """)
+                self._tiers = {row["id"]: ADMIN if row["is_admin"] else PREMIUM for row in await cur.fetchall()}
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(int)
+        user_ids, features, window_starts, counts = [], [], [], []
+        for (user_id, feature, window), count in pending.items():
+            user_ids.append(user_id)
+            features.append(feature)
+            window_starts.append(datetime.fromtimestamp(window * self.window, timezone.utc))
+            counts.append(count)
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    await cur.execute("""
+                        INSERT INTO ai_usage (user_id, feature, window_start, count)
+                        SELECT * FROM unnest(%s::bigint[], %s::text[], %s::timestamptz[], %s::int[])
+                        ON CONFLICT (user_id, feature, window_start) DO UPDATE SET count = ai_usage.count + EXCLUDED.count
+                        RETURNING user_id, feature, window_start, count
+                    """, (user_ids, features, window_starts, counts))
+                    self._merge(await cur.fetchall())
+        except Exception:
+            # Прирости не втрачаємо: повернемо їх у чергу до наступної синхронізації
+            for key, count in pending.items():
+                self._pending[key] += count
+            raise
+
+    def evict_stale(self, now: Optional[float] = None):
+        current = int((time.time() if now is None else now) // self.window)
+        stale = [key for key, counter in self._counters.items() if counter.window < current - 1]
+        for key in stale:
+            del self._counters[key]
+
+    async def cleanup(self):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            await conn.execute("DELETE FROM ai_usage WHERE window_start < now() - make_interval(secs => %s)", (2 * self.window,))
+
+    async def sync_task(self):
+        try:
+            await self.refresh_tiers()
+            await self.load()
+        except Exception as e:
+            logger.error(f"Не вдалося завантажити квоти AI з БД: {e}")
+        iteration = 0
+        while True:
+            await asyncio.sleep(AI_QUOTA_SYNC_INTERVAL)
+            iteration += 1
+            try:
+                await self.flush()
+                await self.refresh_tiers()
+                self.evict_stale()
+                if iteration % CLEANUP_EVERY == 0:
+                    await self.cleanup()
+            except Exception as e:
+                logger.error(f"Помилка синхронізації квот AI: {e}")
+
+quota = AIQuota(AI_QUOTA_WINDOW, AI_QUOTA_FREE_TOTAL, AI_QUOTA_PREMIUM_TOTAL, AI_QUOTA_FREE_FEATURE, AI_QUOTA_PREMIUM_FEATURE,
+                parse_feature_limits(AI_QUOTA_FEATURE_LIMITS))
+
+def limit_text(tier: str, retry_after: float) -> str:
+    text = f"⛔ Ліміт AI-запитів вичерпано. Спробуйте через {max(1, round(retry_after / 60))} хв."
+    if tier == FREE:
+        text += "\nПреміум-користувачі мають вищі ліміти."
+    return text
+
+class AIQuotaMiddleware(BaseMiddleware):
+    def __init__(self, ai_quota: AIQuota):
+        self.quota = ai_quota
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        feature = get_flag(data, "ai")
+        user = data.get("event_from_user")
+        if not feature or user is None:
+            return await handler(event, data)
+        retry_after = self.quota.consume(user.id, str(feature))
+        if retry_after is None:
+            return await handler(event, data)
+        metrics.count_ai_rejection("quota")
+        text = limit_text(self.quota.tier(user.id), retry_after)
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer(text)
+        return None
+
+def setup(router, get_pool: Callable[[], Awaitable[AsyncConnectionPool]]):
+    quota.get_pool = get_pool
+    if not AI_QUOTA_ENABLED:
+        return
+    # Реєструється після ai_scheduler: запит, відхилений як "ще виконується попередній", квоту не витрачає
+    middleware = AIQuotaMiddleware(quota)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
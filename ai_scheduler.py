@@ -0,0 +1,176 @@
+"""Планувальник запитів до AI (Gemini).
+
+Кожен запит до Gemini проходить через AIScheduler.slot(): одночасно виконується не більше
+AI_MAX_CONCURRENCY запитів, а фонові завдання (репост, збагачення новин) займають не більше
+AI_BACKGROUND_MAX_CONCURRENCY слотів. У черзі інтерактивні запити завжди йдуть перед фоновими,
+у межах однієї смуги — за порядком надходження.
+
+Смуга визначається contextvar: за замовчуванням запит фоновий, AIConcurrencyMiddleware позначає
+оновлення від користувачів як інтерактивні. Для хендлерів із прапорцем flags={"ai": "<функція>"}
+middleware також обмежує кількість одночасних AI-запитів одного користувача (AI_USER_MAX_IN_FLIGHT)
+і відповідає "зачекайте", замість того щоб ставити ще один запит у чергу.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+import metrics
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8")) # Скільки запитів до Gemini виконується одночасно
+AI_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("AI_BACKGROUND_MAX_CONCURRENCY", "2")) # Скільки з них можуть займати фонові завдання
+AI_USER_MAX_IN_FLIGHT = int(os.getenv("AI_USER_MAX_IN_FLIGHT", "1")) # Одночасних AI-запитів на одного користувача
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "30")) # Скільки секунд запит може чекати на слот
+
+INTERACTIVE = 0
+BACKGROUND = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+BUSY_TEXT = "⏳ Зачекайте, попередній AI-запит ще виконується."
+
+_lane: contextvars.ContextVar[int] = contextvars.ContextVar("ai_lane", default=BACKGROUND)
+
+class AIQueueTimeout(Exception):
+    pass
+
+class _Waiter:
+    __slots__ = ("lane", "future")
+
+    def __init__(self, lane: int, future: asyncio.Future):
+        self.lane = lane
+        self.future = future
+
+class AIScheduler:
+    def __init__(self, max_concurrency: int, background_max_concurrency: int, user_max_in_flight: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.background_max_concurrency = min(background_max_concurrency, max_concurrency)
+        self.user_max_in_flight = user_max_in_flight
+        self.queue_timeout = queue_timeout
+        self._active = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._queued = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._heap: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._user_in_flight: Dict[int, int] = defaultdict(int)
+
+    def _has_capacity(self, lane: int) -> bool:
+        if self._active[INTERACTIVE] + self._active[BACKGROUND] >= self.max_concurrency:
+            return False
+        return lane == INTERACTIVE or self._active[BACKGROUND] < self.background_max_concurrency
+
+    def _wake(self):
+        # Купа впорядкована за (смуга, номер), тож інтерактивні запити завжди на вершині
+        while self._heap:
+            lane, _, waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            if not self._has_capacity(lane):
+                break
+            heapq.heappop(self._heap)
+            self._queued[lane] -= 1
+            self._active[lane] += 1
+            waiter.future.set_result(None)
+
+    async def acquire(self, lane: int):
+        waiting_ahead = self._queued[INTERACTIVE] + (self._queued[BACKGROUND] if lane == BACKGROUND else 0)
+        if not waiting_ahead and self._has_capacity(lane):
+            self._active[lane] += 1
+            metrics.observe_ai_queue(LANE_NAMES[lane], 0.0)
+            return
+
+        waiter = _Waiter(lane, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (lane, next(self._seq), waiter))
+        self._queued[lane] += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Слот видали одночасно з тайм-аутом або скасуванням — повертаємо його наступному
+                self.release(lane)
+            else:
+                waiter.future.cancel()
+                self._queued[lane] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.count_ai_rejection("queue_timeout")
+                raise AIQueueTimeout(f"Немає вільного слоту AI протягом {self.queue_timeout:g} с") from None
+            raise
+        finally:
+            metrics.observe_ai_queue(LANE_NAMES[lane], time.perf_counter() - started)
+
+    def release(self, lane: int):
+        self._active[lane] -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        lane = _lane.get()
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def try_begin_user(self, user_id: int) -> bool:
+        if self._user_in_flight[user_id] >= self.user_max_in_flight:
+            return False
+        self._user_in_flight[user_id] += 1
+        return True
+
+    def end_user(self, user_id: int):
+        self._user_in_flight[user_id] -= 1
+        if self._user_in_flight[user_id] <= 0:
+            del self._user_in_flight[user_id]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "active": {LANE_NAMES[lane]: count for lane, count in self._active.items()},
+            "queued": {LANE_NAMES[lane]: count for lane, count in self._queued.items()},
+        }
+
+scheduler = AIScheduler(AI_MAX_CONCURRENCY, AI_BACKGROUND_MAX_CONCURRENCY, AI_USER_MAX_IN_FLIGHT, AI_QUEUE_TIMEOUT)
+
+@contextmanager
+def lane(value: int):
+    token = _lane.set(value)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane() -> int:
+    return _lane.get()
+
+class AIConcurrencyMiddleware(BaseMiddleware):
+    def __init__(self, ai_scheduler: AIScheduler):
+        self.scheduler = ai_scheduler
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        with lane(INTERACTIVE):
+            user = data.get("event_from_user")
+            if not get_flag(data, "ai") or user is None:
+                return await handler(event, data)
+            if not self.scheduler.try_begin_user(user.id):
+                metrics.count_ai_rejection("user_in_flight")
+                if isinstance(event, (CallbackQuery, Message)):
+                    await event.answer(BUSY_TEXT)
+                return None
+            try:
+                return await handler(event, data)
+            finally:
+                self.scheduler.end_user(user.id)
+
+def setup(router):
+    middleware = AIConcurrencyMiddleware(scheduler)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+    metrics.register_stats(metrics.AISchedulerStatsCollector(scheduler.stats))
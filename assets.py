@@ -0,0 +1,150 @@
+"""Кешована віддача адмінських HTML-сторінок і файлів з каталогу static.
+
+Файл читається з диска один раз (у потоці, щоб не блокувати цикл подій), і разом з ним одразу
+готуються стиснуті варіанти: gzip і, якщо встановлено пакет brotli, br. Кожен варіант має сильний
+ETag на основі хешу вмісту, тож повторний запит з If-None-Match отримує 304 без тіла. З ASSETS_RELOAD
+кеш перевіряє час зміни файлу на кожному запиті й перечитує змінений файл (режим розробки); інакше
+файли вважаються незмінними до перезапуску.
+
+HTML-сторінки щоразу перевіряються браузером (no-cache + ETag). Файли static, запитані з ?v=<версія>
+(див. url()), незмінні за цією адресою й кешуються на рік; без версії — як сторінки.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError: # Без пакета brotli віддаємо лише gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSETS_RELOAD = os.getenv("ASSETS_RELOAD", "").lower() in ("1", "true", "yes") # Перечитувати змінені файли без перезапуску (розробка)
+ASSETS_MIN_COMPRESS_SIZE = 1024 # Менші файли не стискаємо: виграш не перекриває накладні витрати
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+class Asset:
+    def __init__(self, path: Path, content: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type in ("application/javascript", "application/json"):
+            self.media_type += "; charset=utf-8"
+        self.version = hashlib.sha256(content).hexdigest()[:16]
+        # Кодування -> (тіло, ETag); у кожного представлення власний сильний ETag
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (content, f'"{self.version}"')}
+        if len(content) >= ASSETS_MIN_COMPRESS_SIZE:
+            compressed = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli:
+                compressed["br"] = brotli.compress(content, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) < len(content):
+                    self.variants[encoding] = (body, f'"{self.version}-{encoding}"')
+
+    def etags(self):
+        return {etag for _, etag in self.variants.values()}
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+def choose_encoding(asset: Asset, accept_encoding: str) -> str:
+    accepted = _accepted_encodings(accept_encoding)
+    quality = lambda encoding: accepted.get(encoding, accepted.get("*", 0))
+    # br стискає HTML помітно краще за gzip, тож за рівної якості має перевагу (max бере перший)
+    candidates = [encoding for encoding in ("br", "gzip") if encoding in asset.variants and quality(encoding) > 0]
+    if not candidates:
+        return "identity"
+    return max(candidates, key=quality)
+
+def _not_modified(asset: Asset, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match порівнюється слабко, тож приймаємо й ETag з префіксом W/
+    requested = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    return bool(requested & asset.etags())
+
+class AssetCache:
+    def __init__(self, reload: bool):
+        self.reload = reload
+        self.assets: Dict[Path, Asset] = {}
+
+    def _load(self, path: Path) -> Asset:
+        asset = Asset(path, path.read_bytes(), path.stat().st_mtime)
+        logger.info(f"Завантажено {path.name}: {', '.join(f'{e} {len(b)} Б' for e, (b, _) in asset.variants.items())}.")
+        return asset
+
+    def preload(self, *paths: Path):
+        for path in paths:
+            self.assets[path] = self._load(path)
+
+    async def get(self, path: Path) -> Asset:
+        asset = self.assets.get(path)
+        if asset and self.reload:
+            try:
+                if (await asyncio.to_thread(path.stat)).st_mtime != asset.mtime:
+                    asset = None
+            except FileNotFoundError:
+                asset = None
+        if asset is None:
+            try:
+                asset = await asyncio.to_thread(self._load, path)
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                self.assets.pop(path, None)
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Файл не знайдено.")
+            self.assets[path] = asset
+        return asset
+
+    async def respond(self, request: Request, path: Path, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+        asset = await self.get(path)
+        encoding = choose_encoding(asset, request.headers.get("accept-encoding", ""))
+        body, etag = asset.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if _not_modified(asset, request.headers.get("if-none-match")):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+cache = AssetCache(ASSETS_RELOAD)
+
+def static_path(static_dir: Path, name: str) -> Path:
+    """Шлях до файлу всередині static_dir; спроби вийти за його межі (../) дають 404."""
+    path = (static_dir / name).resolve()
+    if not path.is_relative_to(static_dir.resolve()):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Файл не знайдено.")
+    return path
+
+async def url(static_dir: Path, name: str) -> str:
+    """Адреса файлу static з версією вмісту: її можна кешувати назавжди."""
+    asset = await cache.get(static_path(static_dir, name))
+    return f"/static/{name}?v={asset.version}"
+
+async def serve_static(request: Request, static_dir: Path, name: str) -> Response:
+    path = static_path(static_dir, name)
+    asset = await cache.get(path)
+    immutable = request.query_params.get("v") == asset.version
+    return await cache.respond(request, path, IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL)
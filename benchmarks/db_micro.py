@@ -0,0 +1,210 @@
+"""Мікробенчмарки функцій доступу до БД та повного проходу дайджесту на великих обсягах даних.
+
+Наповнює локальний Postgres заданою кількістю користувачів, новин і переглядів (генерація на
+боці сервера через generate_series, тож навіть десятки мільйонів рядків вставляються за хвилини),
+після чого послідовно вимірює функції бота та розсилку дайджестів усім користувачам з автосповіщеннями.
+Повторний запуск лише дозаповнює відсутні дані, тож наповнену базу можна використовувати між прогонами.
+Результати пишуться в JSON для порівняння між комітами.
+
+Запуск (з кореня репозиторію, DATABASE_URL вказує на окрему тестову базу):
+    python -m benchmarks.db_micro --output before.json
+    python -m benchmarks.db_micro --users 100000 --news 1000000 --views 50000000 --output large.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import psycopg
+
+from benchmarks.webhook_load import BENCH_BOT_TOKEN, BENCH_SOURCE_PREFIX, BENCH_USER_ID_BASE, cleanup, percentile
+from testsupport import LatencyDistribution, TelegramStub, start_stub
+
+SEED_BATCH_SIZE = 1_000_000
+NEW_USER_ID_OFFSET = 500_000_000 # id для сценарію створення нового користувача, поза діапазоном наповнених
+TOPICS = ["технології", "економіка", "політика", "наука", "спорт", "культура"]
+
+def log(message: str):
+    print(f"[{datetime.now():%H:%M:%S}] {message}", flush=True)
+
+# --- Наповнення ---
+
+async def seed_users(conn: psycopg.AsyncConnection, users: int, digest_users: int):
+    await conn.execute(
+        """INSERT INTO users (id, username, first_name, language, auto_notifications, digest_frequency)
+        SELECT %(base)s + g, 'bench' || g, 'Bench', 'uk', FALSE, 'daily' FROM generate_series(0, %(users)s - 1) g
+        ON CONFLICT (id) DO NOTHING""", {"base": BENCH_USER_ID_BASE, "users": users})
+    await conn.execute("UPDATE users SET auto_notifications = (id - %(base)s < %(digest)s) WHERE id >= %(base)s AND id < %(base)s + %(users)s",
+                       {"base": BENCH_USER_ID_BASE, "digest": digest_users, "users": users})
+
+async def seed_news(conn: psycopg.AsyncConnection, news: int, window_days: int):
+    cur = await conn.execute("SELECT COUNT(*) FROM news WHERE source_url LIKE %s", (BENCH_SOURCE_PREFIX + "%",))
+    existing = (await cur.fetchone())[0]
+    for start in range(existing, news, SEED_BATCH_SIZE):
+        end = min(news, start + SEED_BATCH_SIZE) - 1
+        await conn.execute(
+            """INSERT INTO news (title, content, source_url, published_at, lang, moderation_status, expires_at, ai_classified_topics)
+            SELECT 'Тестова новина ' || p.g, repeat('Зміст тестової новини. ', 40), %(prefix)s || p.g, p.ts, 'uk', 'approved',
+                   p.ts + INTERVAL '5 days', jsonb_build_array((%(topics)s::text[])[1 + p.g %% %(topic_count)s])
+            FROM (SELECT g, NOW() - random() * %(window)s * INTERVAL '1 day' AS ts FROM generate_series(%(start)s, %(end)s) g) p""",
+            {"prefix": BENCH_SOURCE_PREFIX, "topics": TOPICS, "topic_count": len(TOPICS), "window": window_days, "start": start, "end": end})
+        log(f"Новини: {end + 1}/{news}")
+
+async def seed_views(conn: psycopg.AsyncConnection, users: int, views: int):
+    cur = await conn.execute("SELECT COUNT(*) FROM user_news_views WHERE user_id >= %s", (BENCH_USER_ID_BASE,))
+    existing = (await cur.fetchone())[0]
+    cur = await conn.execute("SELECT MIN(id), MAX(id) FROM news WHERE source_url LIKE %s", (BENCH_SOURCE_PREFIX + "%",))
+    min_id, max_id = await cur.fetchone()
+    if min_id is None: return
+    for start in range(existing, views, SEED_BATCH_SIZE):
+        end = min(views, start + SEED_BATCH_SIZE) - 1
+        await conn.execute(
+            """INSERT INTO user_news_views (user_id, news_id, news_published_at)
+            SELECT v.user_id, n.id, n.published_at
+            FROM (SELECT %(base)s + (g %% %(users)s) AS user_id, %(min_id)s + floor(random() * %(span)s)::int AS news_id
+                  FROM generate_series(%(start)s, %(end)s) g) v
+            JOIN news n ON n.id = v.news_id
+            ON CONFLICT DO NOTHING""",
+            {"base": BENCH_USER_ID_BASE, "users": users, "min_id": min_id, "span": max_id - min_id + 1, "start": start, "end": end})
+        log(f"Перегляди: {end + 1}/{views}")
+
+async def seed(bot, database_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    async with await psycopg.AsyncConnection.connect(database_url, autocommit=True) as conn:
+        now = datetime.now(timezone.utc)
+        await bot.create_month_partitions(conn, now - timedelta(days=bot.NEWS_RETENTION_DAYS), now + timedelta(days=31))
+        await seed_users(conn, args.users, args.digest_users)
+        await seed_news(conn, args.news, min(args.news_window_days, bot.NEWS_RETENTION_DAYS))
+        await seed_views(conn, args.users, args.views)
+        log("ANALYZE...")
+        await conn.execute("ANALYZE users, news, user_news_views")
+        cur = await conn.execute("SELECT MIN(id), MAX(id) FROM news WHERE source_url LIKE %s", (BENCH_SOURCE_PREFIX + "%",))
+        min_id, max_id = await cur.fetchone()
+        cur = await conn.execute("SHOW server_version")
+        server_version = (await cur.fetchone())[0]
+    return {"users": args.users, "news": args.news, "views": args.views, "digest_users": args.digest_users,
+            "news_id_range": [min_id, max_id], "server_version": server_version}
+
+# --- Вимірювання ---
+
+async def measure(call: Callable[[], Awaitable[Any]], iterations: int, warmup: int) -> Dict[str, float]:
+    # Прогрів: з'єднання пулу відкриті, гарячі запити вже підготовлені на сервері
+    for _ in range(warmup): await call()
+    latencies: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "iterations": iterations,
+        "mean_ms": round(total / iterations * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "ops_per_s": round(iterations / total, 1) if total else 0.0,
+    }
+
+def build_benchmarks(bot, args: argparse.Namespace, news_id_range: List[int]) -> Dict[str, Callable[[], Awaitable[Any]]]:
+    from aiogram import types
+
+    min_id, max_id = news_id_range
+    random_user = lambda: BENCH_USER_ID_BASE + random.randrange(args.users)
+    random_news = lambda: random.randint(min_id, max_id)
+    new_user_ids = iter(range(BENCH_USER_ID_BASE + NEW_USER_ID_OFFSET, BENCH_USER_ID_BASE + 2 * NEW_USER_ID_OFFSET))
+
+    def tg_user(user_id: int) -> types.User:
+        return types.User(id=user_id, is_bot=False, first_name="Bench", username=f"bench{user_id}", language_code="uk")
+
+    return {
+        "get_user": lambda: bot.get_user(random_user()),
+        "create_or_update_user.existing": lambda: bot.create_or_update_user(tg_user(random_user())),
+        "create_or_update_user.new": lambda: bot.create_or_update_user(tg_user(next(new_user_ids))),
+        "mark_news_as_viewed": lambda: bot.mark_news_as_viewed(random_user(), random_news()),
+        "update_user_viewed_topics": lambda: bot.update_user_viewed_topics(random_user(), random.sample(TOPICS, 2)),
+        "get_feed_news_ids": lambda: bot.get_feed_news_ids([]),
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    telegram_server = await start_stub(TelegramStub(latency=args.telegram_latency).make_app())
+    # bot читає конфігурацію під час імпорту, тому змінні середовища задаються до нього
+    os.environ.update({"DATABASE_URL": args.database_url, "BOT_TOKEN": BENCH_BOT_TOKEN, "TELEGRAM_API_URL": telegram_server.url})
+    import bot
+
+    try:
+        await bot.apply_migrations(args.database_url)
+        dataset = await seed(bot, args.database_url, args)
+        await bot.get_db_pool()
+        results: Dict[str, Any] = {"revision": git_revision(), "started_at": datetime.now(timezone.utc).isoformat(),
+                                   "dataset": dataset, "functions": {}}
+        benchmarks = build_benchmarks(bot, args, dataset["news_id_range"])
+        selected = args.only or list(benchmarks)
+        unknown = set(selected) - set(benchmarks)
+        if unknown: raise SystemExit(f"Невідомі функції: {', '.join(sorted(unknown))}. Доступні: {', '.join(benchmarks)}")
+        for name in selected:
+            stats = await measure(benchmarks[name], args.iterations, args.warmup)
+            results["functions"][name] = stats
+            log(f"{name:<32} mean {stats['mean_ms']:>9} ms  p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms  p99 {stats['p99_ms']:>9} ms")
+
+        if not args.skip_digest:
+            async with await psycopg.AsyncConnection.connect(args.database_url, autocommit=True) as conn:
+                # Дайджест усім тестовим користувачам з автосповіщеннями стає "на зараз"
+                await conn.execute("UPDATE users SET digest_next_run = NOW() WHERE id >= %s AND auto_notifications", (BENCH_USER_ID_BASE,))
+            started = time.perf_counter()
+            while await bot.digest_scheduler.scheduler.run_due():
+                pass
+            # Дайджести надсилають воркери черги: чекаємо, доки вони розберуть усі завдання
+            await bot.jobs.queue.drain(["digest"])
+            elapsed = time.perf_counter() - started
+            results["digest"] = {"users": args.digest_users, "seconds": round(elapsed, 3),
+                                 "users_per_s": round(args.digest_users / elapsed, 1) if elapsed else 0.0}
+            log(f"Дайджести: {args.digest_users} користувачів за {elapsed:.2f} с")
+        return results
+    finally:
+        if bot.db_pool: await bot.db_pool.close()
+        await bot.bot.session.close()
+        if args.cleanup:
+            async with await psycopg.AsyncConnection.connect(args.database_url) as conn:
+                await cleanup(conn)
+        await telegram_server.close()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Мікробенчмарки доступу до БД.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Тестова база (за замовчуванням DATABASE_URL)")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--news", type=int, default=100_000)
+    parser.add_argument("--views", type=int, default=1_000_000)
+    parser.add_argument("--digest-users", type=int, default=500, help="Скільки користувачів отримують дайджест")
+    parser.add_argument("--news-window-days", type=int, default=30, help="За скільки днів розподілені дати публікації")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--only", type=lambda s: s.split(","), help="Лише вказані функції, через кому")
+    parser.add_argument("--skip-digest", action="store_true")
+    parser.add_argument("--telegram-latency", type=LatencyDistribution.parse, default="0", help="Розподіл затримки Bot API, мс")
+    parser.add_argument("--output", help="Записати результати в JSON-файл")
+    parser.add_argument("--cleanup", action="store_true", help="Видалити тестові дані після прогону")
+    args = parser.parse_args(argv)
+    if not args.database_url: parser.error("Потрібен --database-url або DATABASE_URL")
+    if args.digest_users > args.users: parser.error("--digest-users не може перевищувати --users")
+    return args
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Навантажувальний тест вебхука /telegram_webhook.
+
+Піднімає додаток у цьому ж процесі (uvicorn, без startup-подій і фонових завдань), заглушки
+Telegram Bot API та Gemini з пакета testsupport, наповнює локальний Postgres тестовими
+новинами й користувачами та відтворює синтетичні оновлення Telegram з заданою паралельністю.
+Для кожного сценарію виводить пропускну здатність, p50/p95/p99 затримки та кількість SQL-запитів
+на одне оновлення.
+
+Запуск (з кореня репозиторію, DATABASE_URL вказує на окрему тестову базу):
+    python -m benchmarks.webhook_load --requests 500 --concurrency 20
+    python -m benchmarks.webhook_load --scenarios start,my_news --output results.json
+    python -m benchmarks.webhook_load --gemini-latency lognormal:1500,0.6 --gemini-429-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import psycopg
+from aiohttp import ClientSession, TCPConnector
+
+from testsupport import LatencyDistribution, start_stub
+from testsupport.cli import add_stub_arguments, build_stubs
+
+SCENARIOS = ("start", "my_news", "next_news", "ai_summary", "translate")
+BENCH_USER_ID_BASE = 7_000_000_000 # Діапазон id тестових користувачів, щоб не перетинатися з реальними
+BENCH_SOURCE_PREFIX = "https://bench.local/news/"
+BENCH_BOT_TOKEN = "123456:bench-token"
+
+# Кількість SQL-запитів, виконаних курсорами пулу бота
+query_count = 0
+
+class CountingCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        global query_count
+        query_count += 1
+        return await super().execute(query, params, **kwargs)
+
+# --- Синтетичні оновлення ---
+
+class UpdateFactory:
+    def __init__(self):
+        self._next_id = 0
+
+    def _id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench", "last_name": str(user_id),
+                "username": f"bench{user_id}", "language_code": "uk"}
+
+    def command(self, user_id: int, text: str) -> Dict[str, Any]:
+        update_id = self._id()
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id), "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}}
+
+    def callback(self, user_id: int, data: str) -> Dict[str, Any]:
+        update_id = self._id()
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user(user_id), "chat_instance": "bench", "data": data,
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                        "from": {"id": 123456, "is_bot": True, "first_name": "Bench"}, "text": "Оберіть дію:"}}}
+
+def scenario_update(factory: UpdateFactory, scenario: str, user_id: int, news_id: int) -> Dict[str, Any]:
+    if scenario == "start": return factory.command(user_id, "/start")
+    if scenario == "my_news": return factory.callback(user_id, "my_news")
+    if scenario == "next_news": return factory.callback(user_id, "next_news")
+    if scenario == "ai_summary": return factory.callback(user_id, f"ai_summary_{news_id}")
+    if scenario == "translate": return factory.callback(user_id, f"translate_{news_id}")
+    raise ValueError(f"Невідомий сценарій: {scenario}")
+
+# --- Дані ---
+
+async def seed(conn: psycopg.AsyncConnection, users: int, news: int) -> List[int]:
+    user_ids = [BENCH_USER_ID_BASE + i for i in range(users)]
+    async with conn.cursor() as cur:
+        await cur.executemany(
+            "INSERT INTO users (id, username, first_name, language) VALUES (%s, %s, 'Bench', 'uk') ON CONFLICT (id) DO NOTHING",
+            [(uid, f"bench{uid}") for uid in user_ids])
+        await cur.execute("SELECT id FROM news WHERE source_url LIKE %s", (BENCH_SOURCE_PREFIX + "%",))
+        news_ids = [r[0] for r in await cur.fetchall()]
+        for i in range(len(news_ids), news):
+            await cur.execute(
+                """INSERT INTO news (title, content, source_url, published_at, lang, moderation_status, expires_at)
+                VALUES (%s, %s, %s, NOW() - %s * INTERVAL '1 minute', 'uk', 'approved', NOW() + INTERVAL '5 days') RETURNING id""",
+                (f"Тестова новина {i}", "Зміст тестової новини. " * 40, f"{BENCH_SOURCE_PREFIX}{i}", random.randint(0, 7 * 24 * 60)))
+            news_ids.append((await cur.fetchone())[0])
+    await conn.commit()
+    return news_ids
+
+async def cleanup(conn: psycopg.AsyncConnection):
+    user_filter = (BENCH_USER_ID_BASE,)
+    await conn.execute("DELETE FROM user_news_views WHERE user_id >= %s", user_filter)
+    await conn.execute("DELETE FROM user_stats WHERE user_id >= %s", user_filter)
+    await conn.execute("DELETE FROM custom_feeds WHERE user_id >= %s", user_filter)
+    await conn.execute("DELETE FROM users WHERE id >= %s", user_filter)
+    await conn.execute("DELETE FROM news WHERE source_url LIKE %s", (BENCH_SOURCE_PREFIX + "%",))
+    await conn.commit()
+
+# --- Прогін ---
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values: return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def replay(session: ClientSession, url: str, updates: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates: queue.put_nowait(update)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update) as response:
+                    body = await response.json()
+                    if response.status != 200 or not body.get("ok"): errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(updates),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    global query_count
+    telegram_stub, gemini_stub = build_stubs(args)
+    telegram_server = await start_stub(telegram_stub.make_app())
+    gemini_server = await start_stub(gemini_stub.make_app())
+
+    # bot читає конфігурацію під час імпорту, тому змінні середовища задаються до нього
+    os.environ.update({"DATABASE_URL": args.database_url, "BOT_TOKEN": BENCH_BOT_TOKEN, "GEMINI_API_KEY": "bench",
+                       "GEMINI_API_URL": f"{gemini_server.url}/v1beta/models/gemini-2.0-flash-lite:generateContent",
+                       "TELEGRAM_API_URL": telegram_server.url})
+    os.environ.pop("WEBHOOK_URL", None)
+    import bot
+    import uvicorn
+
+    await bot.apply_migrations(args.database_url)
+    connection_kwargs = {"prepare_threshold": bot.DB_PREPARE_THRESHOLD, "cursor_factory": CountingCursor}
+    if bot.DB_STATEMENT_TIMEOUT_MS:
+        connection_kwargs["options"] = f"-c statement_timeout={bot.DB_STATEMENT_TIMEOUT_MS}"
+    bot.db_pool = bot.GuardedConnectionPool(conninfo=args.database_url, min_size=bot.DB_POOL_MIN_SIZE, max_size=bot.DB_POOL_MAX_SIZE,
+                                            timeout=bot.DB_POOL_TIMEOUT, kwargs=connection_kwargs, open=False)
+    await bot.db_pool.open(wait=True)
+
+    async with await psycopg.AsyncConnection.connect(args.database_url) as conn:
+        news_ids = await seed(conn, args.users, args.news)
+
+    server = uvicorn.Server(uvicorn.Config(bot.app, host="127.0.0.1", port=args.port, lifespan="off", access_log=False, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started: await asyncio.sleep(0.05)
+    webhook_url = f"http://127.0.0.1:{args.port}/telegram_webhook"
+
+    factory = UpdateFactory()
+    user_ids = [BENCH_USER_ID_BASE + i for i in range(args.users)]
+    config = {k: str(v) if isinstance(v, LatencyDistribution) else v for k, v in vars(args).items() if k != "database_url"}
+    results: Dict[str, Any] = {"config": config, "scenarios": {}}
+    try:
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            for scenario in args.scenarios:
+                if scenario == "next_news":
+                    # next_news працює лише в стані перегляду, який встановлює my_news
+                    await replay(session, webhook_url, [scenario_update(factory, "my_news", uid, 0) for uid in user_ids], args.concurrency)
+                updates = [scenario_update(factory, scenario, random.choice(user_ids), random.choice(news_ids)) for _ in range(args.requests)]
+                query_count = 0
+                telegram_stub.calls.clear()
+                gemini_stub.calls.clear()
+                stats = await replay(session, webhook_url, updates, args.concurrency)
+                stats["db_queries_per_update"] = round(query_count / len(updates), 2)
+                stats["telegram_calls"] = dict(telegram_stub.calls)
+                stats["gemini_calls"] = sum(gemini_stub.calls.values())
+                results["scenarios"][scenario] = stats
+                print(f"{scenario:<12} {stats['throughput_rps']:>8} rps  p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+                      f"p99 {stats['p99_ms']:>8} ms  запитів БД/оновлення {stats['db_queries_per_update']:>6}  помилок {stats['errors']}")
+    finally:
+        server.should_exit = True
+        await server_task
+        await bot.db_pool.close()
+        await bot.bot.session.close()
+        if not args.keep_data:
+            async with await psycopg.AsyncConnection.connect(args.database_url) as conn:
+                await cleanup(conn)
+        await telegram_server.close()
+        await gemini_server.close()
+    return results
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Навантажувальний тест вебхука Telegram.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Тестова база (за замовчуванням DATABASE_URL)")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS), help=f"Через кому: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="Оновлень на сценарій")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--news", type=int, default=300)
+    parser.add_argument("--port", type=int, default=18080)
+    add_stub_arguments(parser)
+    parser.add_argument("--output", help="Записати результати в JSON-файл")
+    parser.add_argument("--keep-data", action="store_true", help="Не видаляти тестові дані після прогону")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown: parser.error(f"Невідомі сценарії: {', '.join(sorted(unknown))}")
+    if not args.database_url: parser.error("Потрібен --database-url або DATABASE_URL")
+    return args
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,63 @@
+import time
+_module_import_started = time.perf_counter() # Для профілю запуску (STARTUP_PROFILE)
+
 import asyncio
+import contextvars
 import logging
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
 import json
 import os
-from typing import List, Optional, Dict, Any, Union
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple, Union
 import random # Додано для випадкового вибору джерела
 
 from aiogram import Bot, Dispatcher, F, Router, types
 from aiogram.enums import ParseMode, ChatAction
-from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.markdown import hbold, hlink
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout
 import psycopg
+from psycopg import sql
+from psycopg.types.json import Jsonb
 from psycopg.rows import dict_row
 from psycopg_pool import AsyncConnectionPool
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, status, Depends, Request
 from fastapi.security import APIKeyHeader
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from gtts import gTTS # Для генерації аудіо
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST
+
+import admin_events
+import ai_batch
+import ai_quota
+import assets
+import ai_scheduler
+import data_export
+import digest_scheduler
+import jobs
+import leader
+import metrics
+import moderation
+import news_import
+import news_push
+import pagination
+import stats_rollup
+import topic_model
+from log_config import LOG_SAMPLE_RATE, setup_logging
+from migrate import apply_migrations
+
+# Важкі необов'язкові модулі (gTTS) імпортуються лише там, де вони потрібні
+startup_timings: Dict[str, float] = {"imports": round(time.perf_counter() - _module_import_started, 4)}
 
 load_dotenv()
 
@@ -39,17 +71,44 @@ ANOTHER_BOT_CHANNEL_LINK_SELL = "https://t.me/BigmoneycreateBot"
 ANOTHER_BOT_CHANNEL_LINK_BUY = "https://t.me/+eZEMW4FMEWQxMjYy"
 NEWS_CHANNEL_LINK = os.getenv("NEWS_CHANNEL_LINK", "https://t.me/newsone234") # Канал для публікації новин
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+NEWS_RETENTION_DAYS = int(os.getenv("NEWS_RETENTION_DAYS", "35")) # Скільки днів зберігати новини та перегляди
+NEWS_PARTITIONS_AHEAD = int(os.getenv("NEWS_PARTITIONS_AHEAD", "2")) # Скільки місячних партицій створювати наперед
+NEWS_ARCHIVE_SCHEMA = os.getenv("NEWS_ARCHIVE_SCHEMA") # Якщо задано, старі партиції переносяться в цю схему замість видалення
+# Обмеження за published_at дає планувальнику змогу відсікати старі партиції news
+HOT_NEWS_WINDOW_SQL = f"published_at >= NOW() - INTERVAL '{NEWS_RETENTION_DAYS} days'"
+HOT_VIEWS_WINDOW_SQL = f"news_published_at >= NOW() - INTERVAL '{NEWS_RETENTION_DAYS} days'"
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes") # Логувати тривалість фаз запуску
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static" # Лише цей каталог віддається через /static
+ADMIN_PAGES = {name: BASE_DIR / f"{name}.html" for name in ("dashboard", "users", "reports")}
+WEBHOOK_READY_TIMEOUT = int(os.getenv("WEBHOOK_READY_TIMEOUT", "60")) # Скільки секунд чекати готовності перед реєстрацією вебхука
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2")) # Скільки з'єднань пул тримає відкритими постійно
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10")) # Верхня межа з'єднань (узгоджується з max_connections сервера)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5")) # Скільки секунд чекати на вільне з'єднання, перш ніж повернути помилку
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000")) # statement_timeout для з'єднань пулу (0 — без обмеження)
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5")) # Після скількох виконань psycopg готує запит на сервері
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-lite:generateContent")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") # Альтернативний Bot API сервер (локальний або заглушка для навантажувальних тестів)
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Telegram AI News Bot API", version="1.0.0")
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=API_TOKEN, session=bot_session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
-app.mount("/static", StaticFiles(directory="."), name="static")
+app_ready = False # Встановлюється в кінці startup_event; на ньому базується /ready
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - started, 4)
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
@@ -60,18 +119,50 @@ async def get_api_key(api_key: str = Depends(api_key_header)):
 
 db_pool = None
 
+# Чи утримує поточне завдання з'єднання з пулу; перевіряється перед запитами до AI
+_db_connection_held: contextvars.ContextVar[bool] = contextvars.ContextVar("db_connection_held", default=False)
+
+class GuardedConnectionPool(metrics.InstrumentedConnectionPool if metrics.METRICS_ENABLED else AsyncConnectionPool):
+    @asynccontextmanager
+    async def connection(self, timeout: Optional[float] = None):
+        token = _db_connection_held.set(True)
+        try:
+            async with super().connection(timeout=timeout) as conn:
+                yield conn
+        finally:
+            _db_connection_held.reset(token)
+
 async def get_db_pool():
     global db_pool
     if db_pool is None:
         try:
-            db_pool = AsyncConnectionPool(conninfo=DATABASE_URL, min_size=1, max_size=10, open=psycopg.AsyncConnection.connect)
-            async with db_pool.connection() as conn: await conn.execute("SELECT 1")
-            logger.info("Пул БД ініціалізовано.")
+            connection_kwargs = {"prepare_threshold": DB_PREPARE_THRESHOLD}
+            if DB_STATEMENT_TIMEOUT_MS:
+                connection_kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+            pool = GuardedConnectionPool(conninfo=DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                                         timeout=DB_POOL_TIMEOUT, kwargs=connection_kwargs, open=False)
+            await pool.open(wait=True)
+            db_pool = pool
+            logger.info(f"Пул БД ініціалізовано (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
         except Exception as e:
             logger.error(f"Помилка пулу БД: {e}")
             raise
     return db_pool
 
+metrics.setup(router, bot, lambda: db_pool)
+ai_scheduler.setup(router)
+ai_quota.setup(router, get_db_pool)
+news_push.setup(bot, get_db_pool, DATABASE_URL)
+jobs.setup(get_db_pool)
+stats_rollup.setup(get_db_pool)
+data_export.setup(DATABASE_URL)
+
+async def admin_counters() -> Dict[str, Any]:
+    summary = await stats_rollup.rollup.summary()
+    return {"total_users": summary["users"], "total_news": summary["news"], "active_users_count": summary["active_users"]}
+
+admin_events.setup(DATABASE_URL, admin_counters)
+
 class User:
     def __init__(self, id: int, username: Optional[str] = None, first_name: Optional[str] = None,
                  last_name: Optional[str] = None, created_at: Optional[datetime] = None,
@@ -88,11 +179,16 @@ class User:
         self.auto_notifications = auto_notifications
         self.digest_frequency = digest_frequency
 
+# Колонки users, з яких будується User; SELECT * повертав би й ті, що User не приймає
+USER_COLUMNS = "id, username, first_name, last_name, created_at, is_admin, last_active, language, auto_notifications, digest_frequency"
+
 class News:
     def __init__(self, id: int, title: str, content: str, source_url: Optional[str],
                  image_url: Optional[str], published_at: datetime, lang: str,
                  ai_summary: Optional[str] = None, ai_classified_topics: Optional[List[str]] = None,
-                 moderation_status: str = 'approved', expires_at: Optional[datetime] = None):
+                 moderation_status: str = 'pending', expires_at: Optional[datetime] = None,
+                 source_id: Optional[int] = None, moderation_verdict: Optional[str] = None,
+                 moderation_reason: Optional[str] = None, topics_source: Optional[str] = None):
         self.id = id
         self.title = title
         self.content = content
@@ -104,6 +200,14 @@ class News:
         self.ai_classified_topics = ai_classified_topics
         self.moderation_status = moderation_status
         self.expires_at = expires_at if expires_at else published_at + timedelta(days=5)
+        self.source_id = source_id
+        self.moderation_verdict = moderation_verdict
+        self.moderation_reason = moderation_reason
+        self.topics_source = topics_source # Хто визначив теми: ai, local (topic_model), admin; None — імпорт
+
+# Колонки news, з яких будується News; SELECT * повертав би й службові (publish_to_channel)
+NEWS_COLUMNS = ("id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, "
+                "moderation_status, expires_at, source_id, moderation_verdict, moderation_reason, topics_source")
 
 class CustomFeed:
     def __init__(self, id: int, user_id: int, feed_name: str, filters: Dict[str, Any]):
@@ -141,224 +245,79 @@ class FilterSetup(StatesGroup):
 class LanguageSelection(StatesGroup):
     waiting_for_language = State()
 
-async def create_tables():
+# --- Партиціювання news та user_news_views за місяцем публікації ---
+# Таблиці переводяться на партиціювання міграцією migrations/0002_partition_news.sql;
+# тут лише створюються майбутні партиції та прибираються застарілі.
+PARTITIONED_TABLES = ("user_news_views", "news")
+
+def _month_floor(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month_index = dt.month - 1 + months
+    return _month_floor(dt).replace(year=dt.year + month_index // 12, month=month_index % 12 + 1)
+
+async def create_month_partitions(conn: psycopg.AsyncConnection, start: datetime, end: datetime):
+    month = _month_floor(start)
+    while month <= end:
+        next_month = _add_months(month, 1)
+        for table in PARTITIONED_TABLES:
+            partition_name = f"{table}_p{month:%Y_%m}"
+            try:
+                async with conn.transaction():
+                    await conn.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+                        sql.Identifier(partition_name), sql.Identifier(table), sql.Literal(month), sql.Literal(next_month)))
+            except psycopg.Error as e:
+                logger.error(f"Не вдалося створити партицію {partition_name}: {e}")
+        month = next_month
+
+async def drop_expired_partitions(conn: psycopg.AsyncConnection):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=NEWS_RETENTION_DAYS)
+    async with conn.cursor(row_factory=dict_row) as cur:
+        for table in PARTITIONED_TABLES:
+            await cur.execute("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass AND c.relname LIKE %s
+                ORDER BY c.relname
+            """, (table, f"{table}_p%"))
+            for rec in await cur.fetchall():
+                partition_name = rec['relname']
+                try:
+                    month = datetime.strptime(partition_name[len(table) + 2:], "%Y_%m").replace(tzinfo=timezone.utc)
+                except ValueError:
+                    continue
+                if _add_months(month, 1) > cutoff:
+                    continue
+                async with conn.transaction():
+                    if NEWS_ARCHIVE_SCHEMA:
+                        await cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(NEWS_ARCHIVE_SCHEMA)))
+                        await cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(table), sql.Identifier(partition_name)))
+                        await cur.execute(sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(sql.Identifier(partition_name), sql.Identifier(NEWS_ARCHIVE_SCHEMA)))
+                        logger.info(f"Партицію {partition_name} від'єднано та перенесено до архіву {NEWS_ARCHIVE_SCHEMA}.")
+                    else:
+                        await cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition_name)))
+                        logger.info(f"Партицію {partition_name} видалено.")
+        await cur.execute("DELETE FROM user_news_views_default WHERE news_published_at < %s", (cutoff,))
+        await cur.execute("DELETE FROM news_default WHERE published_at < %s", (cutoff,))
+
+@jobs.queue.handler("partition_maintenance", priority=150, every=6 * 60 * 60) # Перевіряємо партиції кожні 6 годин
+async def partition_maintenance_job(payload: Dict[str, Any]):
     pool = await get_db_pool()
     async with pool.connection() as conn:
-        # Оновлено CREATE TABLE users для включення всіх полів
-        # Змінено id на BIGINT
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id BIGINT PRIMARY KEY,
-                username VARCHAR(255),
-                first_name VARCHAR(255),
-                last_name VARCHAR(255),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                is_admin BOOLEAN DEFAULT FALSE,
-                last_active TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                language VARCHAR(10) DEFAULT 'uk',
-                auto_notifications BOOLEAN DEFAULT FALSE,
-                digest_frequency VARCHAR(50) DEFAULT 'daily',
-                safe_mode BOOLEAN DEFAULT FALSE,
-                current_feed_id INT,
-                is_premium BOOLEAN DEFAULT FALSE,
-                premium_expires_at TIMESTAMP,
-                level INT DEFAULT 1,
-                badges TEXT[] DEFAULT ARRAY[]::TEXT[],
-                inviter_id INT,
-                email TEXT UNIQUE,
-                view_mode TEXT DEFAULT 'manual',
-                telegram_id BIGINT
-            );
-        """)
-        # Додавання відсутніх стовпців до users, якщо вони не були додані раніше
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS username VARCHAR(255);")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS first_name VARCHAR(255);")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_name VARCHAR(255);")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT FALSE;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS language VARCHAR(10) DEFAULT 'uk';")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS auto_notifications BOOLEAN DEFAULT FALSE;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_frequency VARCHAR(50) DEFAULT 'daily';")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS safe_mode BOOLEAN DEFAULT FALSE;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS current_feed_id INT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_premium BOOLEAN DEFAULT FALSE;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS premium_expires_at TIMESTAMP;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS level INT DEFAULT 1;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS badges TEXT[] DEFAULT ARRAY[]::TEXT[];")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS inviter_id INT;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email TEXT UNIQUE;")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS view_mode TEXT DEFAULT 'manual';")
-        await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id BIGINT;")
-
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS news (
-                id SERIAL PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                source_url TEXT,
-                image_url TEXT,
-                published_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                lang VARCHAR(10) NOT NULL DEFAULT 'uk',
-                ai_summary TEXT,
-                ai_classified_topics JSONB,
-                moderation_status VARCHAR(50) DEFAULT 'approved',
-                expires_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days')
-            );
-        """)
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS source_url TEXT;")
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS image_url TEXT;")
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS ai_summary TEXT;")
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS ai_classified_topics JSONB;")
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS moderation_status VARCHAR(50) DEFAULT 'approved';")
-        await conn.execute("ALTER TABLE news ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days');")
-
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS custom_feeds (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(id),
-                feed_name TEXT NOT NULL,
-                filters JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, feed_name)
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS sources (
-                id SERIAL PRIMARY KEY,
-                name TEXT UNIQUE NOT NULL,
-                link TEXT UNIQUE NOT NULL,
-                type TEXT DEFAULT 'web',
-                status TEXT DEFAULT 'active'
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_news_views (
-                user_id BIGINT NOT NULL REFERENCES users(id),
-                news_id INTEGER NOT NULL REFERENCES news(id),
-                viewed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, news_id)
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_stats (
-                user_id BIGINT PRIMARY KEY REFERENCES users(id),
-                viewed_news_count INT DEFAULT 0,
-                last_active TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                viewed_topics JSONB DEFAULT '[]'::jsonb
-            );
-        """)
-        await conn.execute("ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS viewed_topics JSONB DEFAULT '[]'::jsonb;")
-
-        # Додавання інших таблиць, якщо їх немає
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS comments (
-                id SERIAL PRIMARY KEY,
-                news_id INT REFERENCES news(id),
-                user_id INT REFERENCES users(id),
-                comment_text TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS reports (
-                id SERIAL PRIMARY KEY,
-                user_id INT REFERENCES users(id),
-                report_type TEXT NOT NULL,
-                target_id INT,
-                details JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        await conn.execute("ALTER TABLE reports ADD COLUMN IF NOT EXISTS target_id INT;")
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                id SERIAL PRIMARY KEY,
-                user_id INT REFERENCES users(id),
-                feedback_text TEXT NOT NULL,
-                rating INT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS summaries (
-                id SERIAL PRIMARY KEY,
-                news_id INT REFERENCES news(id),
-                summary_text TEXT NOT NULL,
-                summary_type TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS blocks (
-                id SERIAL PRIMARY KEY,
-                user_id INT REFERENCES users(id),
-                block_type TEXT NOT NULL,
-                value TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, block_type, value)
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS bookmarks (
-                id SERIAL PRIMARY KEY,
-                user_id INT REFERENCES users(id),
-                news_id INT REFERENCES news(id),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, news_id)
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS invites (
-                id SERIAL PRIMARY KEY,
-                inviter_id INT REFERENCES users(id),
-                invite_code TEXT UNIQUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                accepted_at TIMESTAMP
-            );
-        """)
-        await conn.execute("ALTER TABLE invites ADD COLUMN IF NOT EXISTS inviter_id INT REFERENCES users(id);")
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS admin_actions (
-                id SERIAL PRIMARY KEY,
-                admin_user_id INT,
-                action_type TEXT NOT NULL,
-                target_id INT,
-                details JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS source_stats (
-                id SERIAL PRIMARY KEY,
-                source_id INT REFERENCES sources(id) UNIQUE,
-                publication_count INT DEFAULT 0,
-                avg_rating REAL DEFAULT 0.0,
-                report_count INT DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        # Створення або перестворення індексів
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_news_published_expires_moderation ON news (published_at DESC, expires_at, moderation_status);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_blocks_user_type_value ON blocks (user_id, block_type, value);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_bookmarks_user_id ON bookmarks (user_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_user_id ON user_stats (user_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_news_id ON comments (news_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_news_views_user_news_id ON user_news_views (user_id, news_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_user_id_target_id ON reports (user_id, target_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_user_id ON feedback (user_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_invites_inviter_id ON invites (inviter_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_admin_actions_admin_user_id ON admin_actions (admin_user_id);")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_source_stats_source_id ON source_stats (source_id);")
-
-        logger.info("Таблиці перевірено/створено.")
+        # DDL та очищення default-партицій можуть тривати довше за statement_timeout пулу
+        await conn.execute("SET LOCAL statement_timeout = 0")
+        now = datetime.now(timezone.utc)
+        await create_month_partitions(conn, now, _add_months(now, NEWS_PARTITIONS_AHEAD))
+        await drop_expired_partitions(conn)
+
+news_import.setup(get_db_pool, create_month_partitions, NEWS_RETENTION_DAYS)
 
 async def get_user(user_id: int) -> Optional[User]:
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+            await cur.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,), prepare=True)
             rec = await cur.fetchone()
             return User(**rec) if rec else None
 
@@ -366,9 +325,13 @@ async def create_or_update_user(tg_user: Any) -> User:
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            user = await get_user(tg_user.id)
+            # Читаємо користувача тим самим з'єднанням, а не через get_user (друге з'єднання з пулу)
+            await cur.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (tg_user.id,), prepare=True)
+            rec = await cur.fetchone()
+            user = User(**rec) if rec else None
+            stats_rollup.rollup.observe_unique(stats_rollup.ACTIVE_USERS, tg_user.id)
             if user:
-                await cur.execute("UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE id = %s", (tg_user.id,))
+                await cur.execute("UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE id = %s", (tg_user.id,), prepare=True)
                 user.last_active = datetime.now()
                 return user
             else:
@@ -385,8 +348,10 @@ async def create_or_update_user(tg_user: Any) -> User:
                     (tg_user.id, username, first_name, last_name, is_admin, language_code)
                 )
                 await cur.execute("INSERT INTO user_stats (user_id, last_active) VALUES (%s, CURRENT_TIMESTAMP) ON CONFLICT (user_id) DO NOTHING", (tg_user.id,))
+                stats_rollup.rollup.incr("new_users")
                 new_user = User(id=tg_user.id, username=username, first_name=first_name,
                                 last_name=last_name, is_admin=is_admin, language=language_code)
+                await admin_events.notify(cur, "user_created", admin_events.user_payload(new_user.__dict__))
                 logger.info(f"Новий користувач: {new_user.username or new_user.first_name} (ID: {new_user.id})")
                 return new_user
 
@@ -394,29 +359,61 @@ async def get_news(news_id: int) -> Optional[News]:
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT * FROM news WHERE id = %s", (news_id,))
+            await cur.execute(f"SELECT {NEWS_COLUMNS} FROM news WHERE id = %s", (news_id,))
             rec = await cur.fetchone()
             return News(**rec) if rec else None
 
-async def add_news(news: News) -> News:
+async def fetch_news_fields(news_id: int, columns: str) -> Optional[Dict[str, Any]]:
+    """Читає вказані колонки новини й одразу повертає з'єднання в пул (до будь-яких запитів до AI)."""
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(f"SELECT {columns} FROM news WHERE id = %s", (news_id,), prepare=True)
+            return await cur.fetchone()
+
+async def news_exists(source_url: Optional[str], title: str) -> bool:
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"SELECT 1 FROM news WHERE source_url = %s AND title = %s AND {HOT_NEWS_WINDOW_SQL} LIMIT 1",
+                              (source_url, title), prepare=True)
+            return await cur.fetchone() is not None
+
+async def add_news(news: News, publish_to_channel: bool = False) -> News:
+    """Зберігає новину; publish_to_channel — опублікувати її в канал, щойно вона буде схвалена."""
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """INSERT INTO news (title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, moderation_status, expires_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                """INSERT INTO news (title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, moderation_status, expires_at, source_id, topics_source, publish_to_channel)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
                 (news.title, news.content, news.source_url, news.image_url, news.published_at, news.lang,
-                news.ai_summary, news.ai_classified_topics, news.moderation_status, news.expires_at)
+                news.ai_summary, news.ai_classified_topics, news.moderation_status, news.expires_at, news.source_id, news.topics_source, publish_to_channel)
             )
             res = await cur.fetchone()
             news.id = res['id']
-            return news
+            if news.source_id:
+                await cur.execute(
+                    """INSERT INTO source_stats (source_id, publication_count, last_updated)
+                    VALUES (%s, 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source_id) DO UPDATE SET publication_count = source_stats.publication_count + 1, last_updated = CURRENT_TIMESTAMP""",
+                    (news.source_id,)
+                )
+            if news.moderation_status == 'approved':
+                # Доставляється слухачам лише після коміту транзакції
+                await news_push.notify_news_added(cur, news.id, news.source_id, news.ai_classified_topics)
+                if publish_to_channel:
+                    await jobs.queue.enqueue(moderation.CHANNEL_PUBLISH_JOB, {"news_id": news.id}, cur=cur,
+                                             dedupe_key=f"{moderation.CHANNEL_PUBLISH_JOB}:{news.id}")
+            await admin_events.notify(cur, "news_added", admin_events.news_payload(news.__dict__))
+    stats_rollup.rollup.incr("news", news.source_id)
+    return news
 
 async def get_user_filters(user_id: int) -> Dict[str, Any]:
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT filters FROM custom_feeds WHERE user_id = %s AND feed_name = 'default_feed'", (user_id,))
+            await cur.execute("SELECT filters FROM custom_feeds WHERE user_id = %s AND feed_name = 'default_feed'", (user_id,), prepare=True)
             feed = await cur.fetchone()
             return feed['filters'] if feed else {}
 
@@ -430,6 +427,7 @@ async def update_user_filters(user_id: int, filters: Dict[str, Any]):
                 ON CONFLICT (user_id, feed_name) DO UPDATE SET filters = EXCLUDED.filters""",
                 (user_id, json.dumps(filters)) # Використовуємо json.dumps для JSONB
             )
+            await news_push.notify_subscription_changed(cur, user_id)
 
 async def get_sources() -> List[Dict[str, Any]]:
     pool = await get_db_pool()
@@ -443,15 +441,18 @@ async def mark_news_as_viewed(user_id: int, news_id: int):
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute(
-                """INSERT INTO user_news_views (user_id, news_id) VALUES (%s, %s) ON CONFLICT (user_id, news_id) DO NOTHING""",
-                (user_id, news_id)
+                """INSERT INTO user_news_views (user_id, news_id, news_published_at)
+                SELECT %s, id, published_at FROM news WHERE id = %s
+                ON CONFLICT (user_id, news_id, news_published_at) DO NOTHING""",
+                (user_id, news_id), prepare=True
             )
             await cur.execute(
                 """INSERT INTO user_stats (user_id, viewed_news_count, last_active)
                 VALUES (%s, 1, CURRENT_TIMESTAMP)
                 ON CONFLICT (user_id) DO UPDATE SET viewed_news_count = user_stats.viewed_news_count + 1, last_active = CURRENT_TIMESTAMP""",
-                (user_id,)
+                (user_id,), prepare=True
             )
+    stats_rollup.rollup.incr("views")
 
 async def update_user_viewed_topics(user_id: int, topics: List[str]):
     pool = await get_db_pool()
@@ -463,68 +464,147 @@ async def update_user_viewed_topics(user_id: int, topics: List[str]):
             updated_topics = list(set(current_topics + topics))
             await cur.execute("UPDATE user_stats SET viewed_topics = %s::jsonb WHERE user_id = %s", (json.dumps(updated_topics), user_id))
 
+async def get_feed_news_ids(source_ids: List[int]) -> List[int]:
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            query = f"SELECT id FROM news WHERE moderation_status = 'approved' AND expires_at > NOW() AND {HOT_NEWS_WINDOW_SQL}"
+            params = []
+            if source_ids:
+                query += " AND source_id = ANY(%s)"
+                params.append(source_ids)
+
+            query += " ORDER BY published_at DESC"
+            await cur.execute(query, tuple(params))
+            return [r['id'] for r in await cur.fetchall()]
+
 async def update_user_language(user_id: int, lang_code: str):
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute("UPDATE users SET language = %s WHERE id = %s", (lang_code, user_id))
 
+# Початки текстів, які make_gemini_request_with_history повертає замість відповіді AI
+AI_ERROR_PREFIXES = ("Функції AI недоступні", "Не вдалося отримати відповідь AI", "Помилка AI", "Помилка зв'язку з AI", "AI зараз перевантажений")
+
+def is_ai_error(response: Optional[str]) -> bool:
+    return not response or response.startswith(AI_ERROR_PREFIXES)
+
+class AIRequestFailed(Exception):
+    """AI повернув текст помилки замість відповіді; завдання черги, що його отримало, буде повторено."""
+
+def require_ai_response(response: Optional[str]) -> str:
+    if is_ai_error(response):
+        raise AIRequestFailed(response or "порожня відповідь")
+    return response
+
 async def make_gemini_request_with_history(messages: List[Dict[str, Any]]) -> str:
     if not GEMINI_API_KEY: return "Функції AI недоступні. GEMINI_API_KEY не встановлено."
+    if _db_connection_held.get():
+        # Запит до AI триває секунди; з'єднання, утримане на цей час, недоступне іншим оновленням
+        logger.warning("Запит до Gemini виконується під час утримання з'єднання з пулу БД.", stack_info=True)
     headers = {"Content-Type": "application/json"}
     params = {"key": GEMINI_API_KEY}
     data = {"contents": messages}
-    async with ClientSession() as session:
-        try:
-            async with session.post("https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-lite:generateContent", params=params, headers=headers, json=data) as response:
-                if response.status == 200:
-                    res_json = await response.json()
-                    if 'candidates' in res_json and res_json['candidates']:
-                        first_candidate = res_json['candidates'][0]
-                        if 'content' in first_candidate and 'parts' in first_candidate['content']:
-                            for part in first_candidate['content']['parts']:
-                                if 'text' in part: return part['text']
-                    logger.warning(f"Відповідь Gemini відсутня: {res_json}")
-                    return "Не вдалося отримати відповідь AI."
-                else:
-                    err_text = await response.text()
-                    logger.error(f"Помилка API Gemini: {response.status} - {err_text}")
-                    return f"Помилка AI: {response.status}. Спробуйте пізніше."
-        except Exception as e:
-            logger.error(f"Помилка мережі під час запиту Gemini: {e}")
-            return "Помилка зв'язку з AI. Спробуйте пізніше."
-
+    status_label = "error"
+    stats_rollup.rollup.incr("ai_calls", metrics.current_ai_function())
+    try:
+        # Слот планувальника обмежує одночасні запити до Gemini і пропускає інтерактивні запити вперед фонових
+        async with ai_scheduler.scheduler.slot(), ClientSession() as session:
+            started = time.perf_counter()
+            try:
+                async with session.post(GEMINI_API_URL, params=params, headers=headers, json=data) as response:
+                    status_label = str(response.status)
+                    if response.status == 200:
+                        res_json = await response.json()
+                        if 'candidates' in res_json and res_json['candidates']:
+                            first_candidate = res_json['candidates'][0]
+                            if 'content' in first_candidate and 'parts' in first_candidate['content']:
+                                for part in first_candidate['content']['parts']:
+                                    if 'text' in part: return part['text']
+                        status_label = "empty"
+                        logger.warning(f"Відповідь Gemini відсутня: {res_json}")
+                        return "Не вдалося отримати відповідь AI."
+                    else:
+                        err_text = await response.text()
+                        logger.error(f"Помилка API Gemini: {response.status} - {err_text}")
+                        return f"Помилка AI: {response.status}. Спробуйте пізніше."
+            except Exception as e:
+                logger.error(f"Помилка мережі під час запиту Gemini: {e}")
+                return "Помилка зв'язку з AI. Спробуйте пізніше."
+            finally:
+                metrics.observe_gemini(status_label, time.perf_counter() - started)
+    except ai_scheduler.AIQueueTimeout as e:
+        logger.warning(f"Запит до Gemini відхилено планувальником: {e}")
+        return "AI зараз перевантажений. Спробуйте за хвилину."
+
+@metrics.track_ai
 async def ai_summarize_news(title: str, content: str) -> Optional[str]:
     prompt = f"Зроби коротке резюме цієї новини (до 150 слів). Українською мовою.\n\nЗаголовок: {title}\n\nЗміст: {content[:2000]}..."
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_translate_news(text: str, target_lang: str) -> Optional[str]:
     prompt = f"Переклади текст на {target_lang}. Збережи стилістику та сенс. Текст:\n{text}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_answer_news_question(news_item: News, question: str, chat_history: List[Dict[str, Any]]) -> Optional[str]:
     history_for_gemini = chat_history + [{"role": "user", "parts": [{"text": f"Новина: {news_item.title}\n{news_item.content[:2000]}...\n\nМій запит: {question}"}]}]
     return await make_gemini_request_with_history(history_for_gemini)
 
+@metrics.track_ai
 async def ai_explain_term(term: str, news_content: str) -> Optional[str]:
     prompt = f"Поясни термін '{term}' у контексті наступної новини. Дай коротке та зрозуміле пояснення (до 100 слів) українською мовою.\n\nНовина: {news_content[:2000]}..."
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_fact_check(fact_to_check: str, news_content: str) -> Optional[str]:
     prompt = f"Перевір факт: '{fact_to_check}'. Використай новину як контекст. Відповідь до 150 слів, українською.\n\nКонтекст новини: {news_content[:2000]}..."
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_extract_entities(news_content: str) -> Optional[str]:
     prompt = f"Виділи ключові особи, організації, сутності з новини. Перерахуй списком (до 10) з коротким поясненням. Українською.\n\nНовина: {news_content[:2000]}..."
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
-async def ai_classify_topics(news_content: str) -> Optional[List[str]]:
+async def _classify_topics_single(news_content: str) -> Optional[List[str]]:
     prompt = f"Класифікуй новину за 3-5 основними темами/категоріями. Перерахуй теми через кому, українською.\n\nНовина: {news_content[:2000]}..."
     response = await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
-    if response:
+    # Текст помилки не повинен стати "темами": за ними навчається topic_model
+    if not is_ai_error(response):
         return [t.strip() for t in response.split(',') if t.strip()]
     return None
 
+@metrics.track_ai
+async def ai_classify_topics_batch(contents: List[str]) -> Dict[int, List[str]]:
+    items_text = "\n\n".join(f"--- Новина id={i} ---\n{content[:2000]}..." for i, content in enumerate(contents))
+    prompt = (f"Класифікуй кожну з новин за 3-5 основними темами/категоріями українською. Відповідай лише JSON-масивом без "
+              f"додаткового тексту: [{{\"id\": <id новини>, \"topics\": [\"тема\", ...]}}]\n\n{items_text}")
+    # Помилка AI (перевантаження, 429/5xx) — виняток для всіх, хто чекає, а не одиночні запити на кожну новину
+    response = require_ai_response(await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}]))
+    results = {}
+    for index, topics in ai_batch.results_by_id(response, len(contents), "topics").items():
+        if isinstance(topics, list) and topics:
+            results[index] = [str(t).strip() for t in topics if str(t).strip()]
+    return results
+
+classify_batcher = ai_batch.MicroBatcher("classify_topics", ai_classify_topics_batch, _classify_topics_single,
+                                         ai_batch.AI_BATCH_MAX_ITEMS, ai_batch.AI_BATCH_MAX_DELAY_MS / 1000)
+
+@metrics.track_ai
+async def ai_classify_topics(news_content: str) -> Optional[List[str]]:
+    # Фонові виклики (збагачення, імпорт) об'єднуються в пакетні запити; інтерактивні йдуть одразу
+    return await classify_batcher.submit(news_content)
+
+async def classify_news_topics(title: str, content: str) -> Tuple[Optional[List[str]], str]:
+    """Теми новини та їхнє джерело: впевнена відповідь локальної моделі (local) або Gemini (ai)."""
+    topics = topic_model.service.classify(f"{title}\n{content}")
+    if topics:
+        return topics, "local"
+    return await ai_classify_topics(content), "ai"
+
+@metrics.track_ai
 async def ai_analyze_sentiment_trend(news_item: News, related_news_items: List[News]) -> Optional[str]:
     prompt_parts = [f"Проаналізуй новини та визнач, як змінювався настрій (позитивний, негативний, нейтральний) щодо теми. Сформулюй висновок про тренд настроїв. До 250 слів, українською.\n\n--- Основна Новина ---\nЗаголовок: {news_item.title}\nЗміст: {news_item.content[:1000]}..."]
     if news_item.ai_summary: prompt_parts.append(f"AI-резюме: {news_item.ai_summary}")
@@ -536,51 +616,88 @@ async def ai_analyze_sentiment_trend(news_item: News, related_news_items: List[N
             if rn.ai_summary: prompt_parts.append(f"  Резюме: {rn.ai_summary}")
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": "\n".join(prompt_parts)}]}])
 
+@metrics.track_ai
 async def ai_detect_bias_in_news(news_title: str, news_content: str, ai_summary: Optional[str]) -> Optional[str]:
     prompt = f"Проаналізуй новину на наявність упереджень. Виділи 1-3 потенційні упередження та поясни. Якщо немає, зазнач. До 250 слів, українською.\n\n--- Новина ---\nЗаголовок: {news_title}\nЗміст: {news_content[:2000]}..."
     if ai_summary: prompt += f"\nAI-резюме: {ai_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_summarize_for_audience(news_title: str, news_content: str, ai_summary: Optional[str], audience_type: str) -> Optional[str]:
     prompt = f"Узагальни новину для аудиторії: '{audience_type}'. Адаптуй мову та акценти. Резюме до 200 слів, українською.\n\n--- Новина ---\nЗаголовок: {news_title}\nЗміст: {news_content[:2000]}..."
     if ai_summary: prompt += f"\nAI-резюме: {ai_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_find_historical_analogues(news_title: str, news_content: str, ai_summary: Optional[str]) -> Optional[str]:
     prompt = f"Знайди 1-3 історичні події, схожі на новину. Опиши аналогію та схожість. До 300 слів, українською.\n\n--- Новина ---\nЗаголовок: {news_title}\nЗміст: {news_content[:2000]}..."
     if ai_summary: prompt += f"\nAI-резюме: {ai_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_analyze_impact(news_title: str, news_content: str, ai_summary: Optional[str]) -> Optional[str]:
     prompt = f"Оціни потенційний вплив новини. Розглянь короткострокові та довгострокові наслідки на різні сфери. До 300 слів, українською.\n\n--- Новина ---\nЗаголовок: {news_title}\nЗміст: {news_content[:2000]}..."
     if ai_summary: prompt += f"\nAI-резюме: {ai_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_generate_what_if_scenario(news_title: str, news_content: str, ai_summary: Optional[str], what_if_question: str) -> Optional[str]:
     prompt = f"Згенеруй гіпотетичний сценарій 'Що якби...' для новини, відповідаючи на питання: '{what_if_question}'. Розглянь наслідки. До 200 слів, українською.\n\n--- Новина ---\nЗаголовок: {news_title}\nЗміст: {news_content[:2000]}..."
     if ai_summary: prompt += f"\nAI-резюме: {ai_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_generate_news_from_youtube_interview(youtube_content_summary: str) -> Optional[str]:
     prompt = f"На основі змісту YouTube-інтерв'ю, створи коротку новинну статтю. Виділи 1-3 ключові тези/заяви. Новина об'єктивна, до 300 слів, українською. Оформи як новинну статтю з заголовком.\n\n--- Зміст YouTube-інтерв'ю ---\n{youtube_content_summary}"
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
+@metrics.track_ai
 async def ai_formulate_news_post(title: str, summary: str, source_url: Optional[str]) -> str:
     prompt = f"Сформуй короткий новинний пост для Telegram-каналу на основі заголовка та резюме. Додай емодзі, зроби його привабливим, але інформативним. Включи посилання на джерело, якщо воно є. Максимум 150 слів. Українською мовою.\n\nЗаголовок: {title}\nРезюме: {summary}"
     post = await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
     if source_url: post += f"\n\n🔗 {hlink('Читати джерело', source_url)}"
     return post
 
-async def ai_check_news_for_fakes(title: str, content: str) -> str:
-    prompt = f"Проаналізуй новину на предмет потенційних ознак дезінформації, фейків або маніпуляцій. Зверни увагу на джерела, тон, наявність емоційно забарвлених висловлювань, неперевірені факти. Надай короткий висновок: 'Ймовірно, фейк', 'Потребує перевірки', 'Схоже на правду'. Поясни своє рішення 1-2 реченнями. Українською мовою.\n\nЗаголовок: {title}\nЗміст: {content[:2000]}..."
+@metrics.track_ai
+async def ai_check_news_for_fakes(news_items: List[Dict[str, Any]]) -> str:
+    """Перевіряє пачку новин одним запитом; відповідь — JSON-масив вердиктів (розбирає moderation.parse_verdicts)."""
+    items_text = "\n\n".join(f"--- Новина id={item['id']} ---\nЗаголовок: {item['title']}\nЗміст: {item['content'][:1000]}..." for item in news_items)
+    prompt = (f"Проаналізуй кожну з новин на предмет потенційних ознак дезінформації, фейків або маніпуляцій. Зверни увагу на джерела, тон, "
+              f"наявність емоційно забарвлених висловлювань, неперевірені факти. Для кожної новини дай вердикт: \"fake\" (ймовірно, фейк), "
+              f"\"suspicious\" (потребує перевірки) або \"clean\" (схоже на правду), і поясни рішення одним реченням українською мовою.\n"
+              f"Відповідай лише JSON-масивом без додаткового тексту: [{{\"id\": <id новини>, \"verdict\": \"clean|suspicious|fake\", \"reason\": \"...\"}}]\n\n"
+              f"{items_text}")
     return await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
 
-async def ai_filter_interesting_news(news_title: str, news_content: str, user_interests: List[str]) -> bool:
-    interests_str = ", ".join(user_interests) if user_interests else "технологіями, економікою, політикою"
-    prompt = f"Новина: '{news_title}'. Зміст: '{news_content[:500]}...'\nЧи є ця новина 'цікавою' для користувача, який цікавиться {interests_str}? Відповідай лише 'Так' або 'Ні'."
+def _interests_text(user_interests: List[str]) -> str:
+    return ", ".join(user_interests) if user_interests else "технологіями, економікою, політикою"
+
+async def _filter_interesting_single(item: Tuple[str, str, List[str]]) -> bool:
+    news_title, news_content, user_interests = item
+    prompt = f"Новина: '{news_title}'. Зміст: '{news_content[:500]}...'\nЧи є ця новина 'цікавою' для користувача, який цікавиться {_interests_text(user_interests)}? Відповідай лише 'Так' або 'Ні'."
     response = await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}])
     return "Так" in response
 
+@metrics.track_ai
+async def ai_filter_interesting_news_batch(items: List[Tuple[str, str, List[str]]]) -> Dict[int, bool]:
+    items_text = "\n\n".join(f"--- Новина id={i} ---\nЗаголовок: {title}\nЗміст: {content[:500]}...\nІнтереси користувача: {_interests_text(interests)}"
+                             for i, (title, content, interests) in enumerate(items))
+    prompt = (f"Для кожної новини визнач, чи є вона 'цікавою' для користувача з указаними інтересами. Відповідай лише JSON-масивом "
+              f"без додаткового тексту: [{{\"id\": <id новини>, \"interesting\": true або false}}]\n\n{items_text}")
+    response = require_ai_response(await make_gemini_request_with_history([{"role": "user", "parts": [{"text": prompt}]}]))
+    return {index: value for index, value in ai_batch.results_by_id(response, len(items), "interesting").items() if isinstance(value, bool)}
+
+filter_batcher = ai_batch.MicroBatcher("filter_interesting_news", ai_filter_interesting_news_batch, _filter_interesting_single,
+                                       ai_batch.AI_BATCH_MAX_ITEMS, ai_batch.AI_BATCH_MAX_DELAY_MS / 1000)
+
+@metrics.track_ai
+async def ai_filter_interesting_news(news_title: str, news_content: str, user_interests: List[str]) -> bool:
+    # Якщо локальна модель упевнена щодо тем інтересів користувача, Gemini не потрібен
+    local = topic_model.service.is_interesting(f"{news_title}\n{news_content}", user_interests or [])
+    if local is not None:
+        return local
+    return await filter_batcher.submit((news_title, news_content, user_interests))
+
 def get_main_menu_keyboard():
     kb = InlineKeyboardBuilder()
     kb.add(InlineKeyboardButton(text="📰 Мої новини", callback_data="my_news"))
@@ -663,45 +780,41 @@ def get_news_keyboard(news_id: int, current_index: int, total_count: int):
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 async def send_news_to_user(chat_id: int, news_id: int, current_index: int, total_count: int):
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics FROM news WHERE id = %s", (news_id,))
-            news_record = await cur.fetchone()
-            if not news_record:
-                await bot.send_message(chat_id, "Новина не знайдена.")
-                return
+    news_record = await fetch_news_fields(news_id, "id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics")
+    if not news_record:
+        await bot.send_message(chat_id, "Новина не знайдена.")
+        return
 
-            news_obj = News(id=news_record['id'], title=news_record['title'], content=news_record['content'],
-                            source_url=news_record['source_url'], image_url=news_record['image_url'],
-                            published_at=news_record['published_at'], lang=news_record['lang'],
-                            ai_summary=news_record['ai_summary'], ai_classified_topics=news_record['ai_classified_topics'])
+    news_obj = News(id=news_record['id'], title=news_record['title'], content=news_record['content'],
+                    source_url=news_record['source_url'], image_url=news_record['image_url'],
+                    published_at=news_record['published_at'], lang=news_record['lang'],
+                    ai_summary=news_record['ai_summary'], ai_classified_topics=news_record['ai_classified_topics'])
 
-            message_text = (
-                f"<b>{news_obj.title}</b>\n\n"
-                f"{news_obj.content[:1000]}...\n\n"
-                f"<i>Опубліковано: {news_obj.published_at.strftime('%d.%m.%Y %H:%M')}</i>\n"
-                f"<i>Новина {current_index + 1} з {total_count}</i>"
-            )
-            
-            if news_obj.source_url: message_text += f"\n\n🔗 {hlink('Читати джерело', news_obj.source_url)}"
-            if news_obj.image_url: message_text += f"\n\n[Зображення новини]({news_obj.image_url})"
-
-            reply_markup = get_news_keyboard(news_obj.id, current_index, total_count) # Передаємо індекс та загальну кількість
-            
-            msg = await bot.send_message(chat_id, message_text, reply_markup=reply_markup, disable_web_page_preview=False)
-            
-            # Correct way to get FSM context outside of a handler
-            state_context = FSMContext(storage=dp.storage, key=types.Chat(id=chat_id).model_copy(deep=True), bot=bot)
-            await state_context.update_data(last_message_id=msg.message_id)
-            
-            await mark_news_as_viewed(chat_id, news_id)
-            if news_obj.ai_classified_topics: await update_user_viewed_topics(chat_id, news_obj.ai_classified_topics)
+    message_text = (
+        f"<b>{news_obj.title}</b>\n\n"
+        f"{news_obj.content[:1000]}...\n\n"
+        f"<i>Опубліковано: {news_obj.published_at.strftime('%d.%m.%Y %H:%M')}</i>\n"
+        f"<i>Новина {current_index + 1} з {total_count}</i>"
+    )
+    
+    if news_obj.source_url: message_text += f"\n\n🔗 {hlink('Читати джерело', news_obj.source_url)}"
+    if news_obj.image_url: message_text += f"\n\n[Зображення новини]({news_obj.image_url})"
+
+    reply_markup = get_news_keyboard(news_obj.id, current_index, total_count) # Передаємо індекс та загальну кількість
+    
+    msg = await bot.send_message(chat_id, message_text, reply_markup=reply_markup, disable_web_page_preview=False)
+    
+    # FSM-контекст поза хендлером; у приватному чаті chat_id збігається з user_id
+    state_context = dp.fsm.get_context(bot, chat_id=chat_id, user_id=chat_id)
+    await state_context.update_data(last_message_id=msg.message_id)
+    
+    await mark_news_as_viewed(chat_id, news_id)
+    if news_obj.ai_classified_topics: await update_user_viewed_topics(chat_id, news_obj.ai_classified_topics)
 
 @router.message(CommandStart())
 @router.message(Command("begin")) # Додано команду /begin
 async def command_begin_handler(message: Message, state: FSMContext) -> None:
-    logger.info(f"Команда /begin (або /start) отримана та обробляється для користувача: {message.from_user.id} ({message.from_user.full_name})")
+    logger.info("Команда /begin (або /start) від користувача %s", message.from_user.id, extra={"sample_rate": LOG_SAMPLE_RATE})
     await state.clear()
     await create_or_update_user(message.from_user)
     await message.answer(f"Привіт, {hbold(message.from_user.full_name)}! 👋\n\nЯ ваш особистий новинний помічник з AI-функціями. Оберіть дію:", reply_markup=get_main_menu_keyboard())
@@ -751,6 +864,60 @@ async def handle_my_profile_command(message: Message):
     )
     await message.answer(profile_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+DIGEST_USAGE_TEXT = (
+    "Налаштування розкладу дайджестів:\n"
+    "/digest — поточний розклад\n"
+    "/digest hourly | daily | weekly — щогодини, щодня або щотижня\n"
+    "/digest cron 0 8 * * 1-5 — власний розклад (cron-вираз)\n"
+    "/digest tz Europe/Kyiv — часовий пояс"
+)
+
+@router.message(Command("digest"))
+async def handle_digest_command(message: Message, command: CommandObject):
+    user_id = message.from_user.id
+    args = (command.args or "").split(maxsplit=1)
+    updates = {}
+    if args:
+        action, value = args[0].lower(), args[1].strip() if len(args) > 1 else ""
+        if action in ("hourly", "daily", "weekly"):
+            updates = {"digest_frequency": action, "digest_cron": None}
+        elif action == "cron" and value:
+            error = digest_scheduler.validate_cron(value)
+            if error:
+                await message.answer(error)
+                return
+            updates = {"digest_frequency": "custom", "digest_cron": value}
+        elif action == "tz" and value and digest_scheduler.is_valid_timezone(value):
+            updates = {"digest_timezone": value}
+        else:
+            await message.answer(DIGEST_USAGE_TEXT)
+            return
+
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(f"SELECT {digest_scheduler.SCHEDULE_COLUMNS}, auto_notifications, digest_next_run FROM users WHERE id = %s FOR UPDATE", (user_id,))
+            user = await cur.fetchone()
+            if user and updates:
+                user.update(updates)
+                user['digest_next_run'] = digest_scheduler.next_run(user, datetime.now(timezone.utc)) if user['auto_notifications'] else None
+                await cur.execute(
+                    "UPDATE users SET digest_frequency = %s, digest_cron = %s, digest_timezone = %s, digest_next_run = %s WHERE id = %s",
+                    (user['digest_frequency'], user['digest_cron'], user['digest_timezone'], user['digest_next_run'], user_id)
+                )
+    if not user:
+        await message.answer("Ваш профіль не знайдено. Спробуйте /begin.")
+        return
+
+    tz = digest_scheduler.resolve_timezone(user['digest_timezone'])
+    schedule = user['digest_cron'] if user['digest_frequency'] == 'custom' else user['digest_frequency']
+    text = f"📅 Розклад дайджестів: <code>{schedule}</code>\nЧасовий пояс: {tz.key}\n"
+    if not user['auto_notifications']:
+        text += "Автосповіщення вимкнено — увімкніть їх у налаштуваннях, щоб отримувати дайджести."
+    elif user['digest_next_run']:
+        text += f"Наступний дайджест: {user['digest_next_run'].astimezone(tz).strftime('%d.%m.%Y %H:%M')}"
+    await message.answer(text, parse_mode=ParseMode.HTML)
+
 @router.callback_query(F.data == "main_menu")
 async def process_main_menu_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
@@ -808,27 +975,28 @@ async def toggle_auto_notifications(callback: CallbackQuery):
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT auto_notifications FROM users WHERE id = %s", (user_id,))
+            # digest_next_run = NULL: планувальник дайджестів розрахує розклад заново
+            await cur.execute("UPDATE users SET auto_notifications = NOT auto_notifications, digest_next_run = NULL WHERE id = %s RETURNING auto_notifications", (user_id,))
             user_record = await cur.fetchone()
-            if not user_record:
-                await callback.message.answer("Користувача не знайдено.")
-                await callback.answer()
-                return
-            new_status = not user_record['auto_notifications']
-            await cur.execute("UPDATE users SET auto_notifications = %s WHERE id = %s", (new_status, user_id))
-            
-            status_text = "увімкнено" if new_status else "вимкнено"
-            await callback.message.answer(f"🔔 Автоматичні сповіщення про новини {status_text}.")
-            
-            user = await get_user(user_id)
-            toggle_btn_text = "🔔 Вимкнути автосповіщення" if user.auto_notifications else "🔕 Увімкнути автосповіщення"
-            kb = InlineKeyboardBuilder()
-            kb.add(InlineKeyboardButton(text="🔍 Фільтри новин", callback_data="news_filters_menu"))
-            kb.add(InlineKeyboardButton(text=toggle_btn_text, callback_data="toggle_auto_notifications"))
-            kb.add(InlineKeyboardButton(text="🌐 Мова", callback_data="language_selection_menu"))
-            kb.add(InlineKeyboardButton(text="⬅️ Назад до головного", callback_data="main_menu"))
-            kb.adjust(1)
-            await callback.message.edit_reply_markup(reply_markup=kb.as_markup())
+            if user_record:
+                await news_push.notify_subscription_changed(cur, user_id)
+    if not user_record:
+        await callback.message.answer("Користувача не знайдено.")
+        await callback.answer()
+        return
+    new_status = user_record['auto_notifications']
+
+    status_text = "увімкнено" if new_status else "вимкнено"
+    await callback.message.answer(f"🔔 Автоматичні сповіщення про новини {status_text}.")
+
+    toggle_btn_text = "🔔 Вимкнути автосповіщення" if new_status else "🔕 Увімкнути автосповіщення"
+    kb = InlineKeyboardBuilder()
+    kb.add(InlineKeyboardButton(text="🔍 Фільтри новин", callback_data="news_filters_menu"))
+    kb.add(InlineKeyboardButton(text=toggle_btn_text, callback_data="toggle_auto_notifications"))
+    kb.add(InlineKeyboardButton(text="🌐 Мова", callback_data="language_selection_menu"))
+    kb.add(InlineKeyboardButton(text="⬅️ Назад до головного", callback_data="main_menu"))
+    kb.adjust(1)
+    await callback.message.edit_reply_markup(reply_markup=kb.as_markup())
     await callback.answer()
 
 @router.callback_query(F.data == "set_news_sources_filter")
@@ -916,7 +1084,7 @@ async def handle_news_from_youtube_interview(callback: CallbackQuery, state: FSM
     await callback.message.edit_text("🗞️ Надішліть посилання на YouTube-відео. (AI імітуватиме аналіз)", parse_mode=ParseMode.MARKDOWN)
     await callback.answer()
 
-@router.message(AIAssistant.waiting_for_youtube_interview_url, F.text.regexp(r"(https?://)?(www\.)?(youtube|youtu|m\.youtube)\.(com|be)/(watch\?v=|embed/|v/|)([\w-]{11})(?:\S+)?"))
+@router.message(AIAssistant.waiting_for_youtube_interview_url, F.text.regexp(r"(https?://)?(www\.)?(youtube|youtu|m\.youtube)\.(com|be)/(watch\?v=|embed/|v/|)([\w-]{11})(?:\S+)?"), flags={"ai": "youtube_interview"})
 async def process_youtube_interview_url(message: Message, state: FSMContext):
     youtube_url = message.text
     await message.answer("⏳ Аналізую інтерв'ю та генерую новину...")
@@ -939,59 +1107,54 @@ async def process_youtube_interview_url(message: Message, state: FSMContext):
 async def process_youtube_interview_url_invalid(message: Message):
     await message.answer("Будь ласка, надішліть дійсне посилання на YouTube-відео, або введіть /cancel.")
 
-@router.callback_query(F.data.startswith("ai_summary_"))
+@router.callback_query(F.data.startswith("ai_summary_"), flags={"ai": "summary"})
 async def handle_ai_summary_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину не знайдено.")
-                await callback.answer()
-                return
-            await callback.message.answer("⏳ Генерую резюме за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            summary = await ai_summarize_news(news_item['title'], news_item['content'])
-            if summary:
-                await cur.execute("UPDATE news SET ai_summary = %s WHERE id = %s", (summary, news_id))
-                await callback.message.answer(f"📝 <b>AI-резюме новини (ID: {news_id}):</b>\n\n{summary}")
-            else:
-                await callback.message.answer("❌ Не вдалося згенерувати резюме.")
+    news_item = await fetch_news_fields(news_id, "title, content")
+    if not news_item:
+        await callback.message.answer("❌ Новину не знайдено.")
+        await callback.answer()
+        return
+    await callback.message.answer("⏳ Генерую резюме за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    summary = await ai_summarize_news(news_item['title'], news_item['content'])
+    if not is_ai_error(summary):
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            await conn.execute("UPDATE news SET ai_summary = %s WHERE id = %s", (summary, news_id))
+        await callback.message.answer(f"📝 <b>AI-резюме новини (ID: {news_id}):</b>\n\n{summary}")
+    else:
+        # Текст помилки (наприклад, про перевантаження AI) показуємо, але не зберігаємо як резюме
+        await callback.message.answer(f"❌ Не вдалося згенерувати резюме. {summary or ''}".strip())
     await callback.answer()
 
-@router.callback_query(F.data.startswith("translate_"))
+@router.callback_query(F.data.startswith("translate_"), flags={"ai": "translate"})
 async def handle_translate_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[1])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, lang FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину не знайдено.")
-                await callback.answer()
-                return
-            
-            user_lang_record = await get_user(callback.from_user.id)
-            user_target_lang = user_lang_record.language if user_lang_record else 'uk'
-
-            # Визначаємо мову перекладу: якщо мова новини співпадає з мовою користувача,
-            # перекладаємо на англійську, інакше - на мову користувача.
-            target_lang = 'en' if news_item['lang'] == user_target_lang else user_target_lang
-            
-            await callback.message.answer(f"⏳ Перекладаю новину на {target_lang.upper()} за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            translated_title = await ai_translate_news(news_item['title'], target_lang)
-            translated_content = await ai_translate_news(news_item['content'], target_lang)
-            if translated_title and translated_content:
-                await callback.message.answer(
-                    f"🌐 <b>Переклад новини (ID: {news_id}) на {target_lang.upper()}:</b>\n\n"
-                    f"<b>{translated_title}</b>\n\n{translated_content}"
-                )
-            else:
-                await callback.message.answer("❌ Не вдалося перекласти новину.")
+    news_item = await fetch_news_fields(news_id, "title, content, lang")
+    if not news_item:
+        await callback.message.answer("❌ Новину не знайдено.")
+        await callback.answer()
+        return
+
+    user_lang_record = await get_user(callback.from_user.id)
+    user_target_lang = user_lang_record.language if user_lang_record else 'uk'
+
+    # Визначаємо мову перекладу: якщо мова новини співпадає з мовою користувача,
+    # перекладаємо на англійську, інакше - на мову користувача.
+    target_lang = 'en' if news_item['lang'] == user_target_lang else user_target_lang
+
+    await callback.message.answer(f"⏳ Перекладаю новину на {target_lang.upper()} за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    translated_title = await ai_translate_news(news_item['title'], target_lang)
+    translated_content = await ai_translate_news(news_item['content'], target_lang)
+    if translated_title and translated_content:
+        await callback.message.answer(
+            f"🌐 <b>Переклад новини (ID: {news_id}) на {target_lang.upper()}:</b>\n\n"
+            f"<b>{translated_title}</b>\n\n{translated_content}"
+        )
+    else:
+        await callback.message.answer("❌ Не вдалося перекласти новину.")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("ask_news_ai_"))
@@ -1002,7 +1165,7 @@ async def handle_ask_news_ai_callback(callback: CallbackQuery, state: FSMContext
     await callback.message.answer("❓ Задайте ваше питання про новину.")
     await callback.answer()
 
-@router.message(AIAssistant.waiting_for_question, F.text)
+@router.message(AIAssistant.waiting_for_question, F.text, flags={"ai": "ask"})
 async def process_news_question(message: Message, state: FSMContext):
     data = await state.get_data()
     news_id = data.get('waiting_for_news_id_for_question')
@@ -1011,77 +1174,68 @@ async def process_news_question(message: Message, state: FSMContext):
         await message.answer("Контекст новини втрачено. Спробуйте ще раз через /my_news.")
         await state.clear()
         return
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, lang FROM news WHERE id = %s", (news_id,))
-            news_item_data = await cur.fetchone()
-            if not news_item_data:
-                await message.answer("Новину не знайдено.")
-                await state.clear()
-                return
-            news_item = News(id=news_id, title=news_item_data['title'], content=news_item_data['content'],
-                             lang=news_item_data['lang'], published_at=datetime.now())
-            chat_history = data.get('ask_news_ai_history', [])
-            chat_history.append({"role": "user", "parts": [{"text": question}]})
-            await message.answer("⏳ Обробляю ваше питання за допомогою AI...")
-            await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-            ai_response = await ai_answer_news_question(news_item, question, chat_history)
-            if ai_response:
-                await message.answer(f"<b>AI відповідає:</b>\n\n{ai_response}")
-                chat_history.append({"role": "model", "parts": [{"text": ai_response}]})
-                await state.update_data(ask_news_ai_history=chat_history)
-            else:
-                await message.answer("❌ Не вдалося відповісти на ваше питання.")
+    news_item_data = await fetch_news_fields(news_id, "title, content, lang")
+    if not news_item_data:
+        await message.answer("Новину не знайдено.")
+        await state.clear()
+        return
+    news_item = News(id=news_id, title=news_item_data['title'], content=news_item_data['content'],
+                     source_url=None, image_url=None, lang=news_item_data['lang'], published_at=datetime.now())
+    chat_history = data.get('ask_news_ai_history', [])
+    chat_history.append({"role": "user", "parts": [{"text": question}]})
+    await message.answer("⏳ Обробляю ваше питання за допомогою AI...")
+    await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
+    ai_response = await ai_answer_news_question(news_item, question, chat_history)
+    if ai_response:
+        await message.answer(f"<b>AI відповідає:</b>\n\n{ai_response}")
+        chat_history.append({"role": "model", "parts": [{"text": ai_response}]})
+        await state.update_data(ask_news_ai_history=chat_history)
+    else:
+        await message.answer("❌ Не вдалося відповісти на ваше питання.")
     await message.answer("Продовжуйте ставити питання або введіть /cancel для завершення діалогу.")
 
-@router.callback_query(F.data.startswith("extract_entities_"))
+@router.callback_query(F.data.startswith("extract_entities_"), flags={"ai": "entities"})
 async def handle_extract_entities_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT content FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину не знайдено.")
-                await callback.answer()
-                return
-            await callback.message.answer("⏳ Витягую ключові сутності за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            entities = await ai_extract_entities(news_item['content'])
-            if entities:
-                await callback.message.answer(f"🧑‍🤝‍🧑 <b>Ключові особи/сутності в новині (ID: {news_id}):</b>\n\n{entities}")
-            else:
-                await callback.message.answer("❌ Не вдалося витягнути сутності.")
+    news_item = await fetch_news_fields(news_id, "content")
+    if not news_item:
+        await callback.message.answer("❌ Новину не знайдено.")
+        await callback.answer()
+        return
+    await callback.message.answer("⏳ Витягую ключові сутності за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    entities = await ai_extract_entities(news_item['content'])
+    if entities:
+        await callback.message.answer(f"🧑‍🤝‍🧑 <b>Ключові особи/сутності в новині (ID: {news_id}):</b>\n\n{entities}")
+    else:
+        await callback.message.answer("❌ Не вдалося витягнути сутності.")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("classify_topics_"))
+@router.callback_query(F.data.startswith("classify_topics_"), flags={"ai": "classify"})
 async def handle_classify_topics_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT content, ai_classified_topics FROM news WHERE id = %s", (news_id,))
-            news_item_record = await cur.fetchone()
-            if not news_item_record:
-                await callback.message.answer("❌ Новину не знайдено.")
-                await callback.answer()
-                return
-            topics = news_item_record['ai_classified_topics']
-            if not topics:
-                await callback.message.answer("⏳ Класифікую новину за темами за допомогою AI...")
-                await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-                topics = await ai_classify_topics(news_item_record['content'])
-                if topics: 
-                    await cur.execute("UPDATE news SET ai_classified_topics = %s::jsonb WHERE id = %s", (json.dumps(topics), news_id))
-                else: 
-                    topics = ["Не вдалося визначити теми."]
-            if topics:
-                topics_str = ", ".join(topics)
-                await callback.message.answer(f"🏷️ <b>Класифікація за темами для новини (ID: {news_id}):</b>\n\n{topics_str}")
-            else:
-                await callback.message.answer("❌ Не вдалося класифікувати новину за темами.")
+    news_item_record = await fetch_news_fields(news_id, "title, content, ai_classified_topics")
+    if not news_item_record:
+        await callback.message.answer("❌ Новину не знайдено.")
+        await callback.answer()
+        return
+    topics = news_item_record['ai_classified_topics']
+    if not topics:
+        await callback.message.answer("⏳ Класифікую новину за темами за допомогою AI...")
+        await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+        topics, topics_source = await classify_news_topics(news_item_record['title'], news_item_record['content'])
+        if topics:
+            pool = await get_db_pool()
+            async with pool.connection() as conn:
+                await conn.execute("UPDATE news SET ai_classified_topics = %s::jsonb, topics_source = %s WHERE id = %s",
+                                   (json.dumps(topics), topics_source, news_id))
+        else:
+            topics = ["Не вдалося визначити теми."]
+    if topics:
+        topics_str = ", ".join(topics)
+        await callback.message.answer(f"🏷️ <b>Класифікація за темами для новини (ID: {news_id}):</b>\n\n{topics_str}")
+    else:
+        await callback.message.answer("❌ Не вдалося класифікувати новину за темами.")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("explain_term_"))
@@ -1092,7 +1246,7 @@ async def handle_explain_term_callback(callback: CallbackQuery, state: FSMContex
     await callback.message.answer("❓ Введіть термін, який ви хочете, щоб AI пояснив у контексті цієї новини.")
     await callback.answer()
 
-@router.message(AIAssistant.waiting_for_term_to_explain, F.text)
+@router.message(AIAssistant.waiting_for_term_to_explain, F.text, flags={"ai": "explain"})
 async def process_explain_term_query(message: Message, state: FSMContext):
     data = await state.get_data()
     news_id = data.get('waiting_for_news_id_for_question')
@@ -1101,22 +1255,18 @@ async def process_explain_term_query(message: Message, state: FSMContext):
         await message.answer("Контекст новини втрачено. Спробуйте ще раз через /my_news.")
         await state.clear()
         return
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT content FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await message.answer("Новину не знайдено.")
-                await state.clear()
-                return
-            await message.answer(f"⏳ Пояснюю термін '{term}' за допомогою AI...")
-            await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-            explanation = await ai_explain_term(term, news_item['content'])
-            if explanation:
-                await message.answer(f"❓ <b>Пояснення терміну '{term}' (Новина ID: {news_id}):</b>\n\n{explanation}")
-            else:
-                await message.answer("❌ Не вдалося пояснити термін.")
+    news_item = await fetch_news_fields(news_id, "content")
+    if not news_item:
+        await message.answer("Новину не знайдено.")
+        await state.clear()
+        return
+    await message.answer(f"⏳ Пояснюю термін '{term}' за допомогою AI...")
+    await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
+    explanation = await ai_explain_term(term, news_item['content'])
+    if explanation:
+        await message.answer(f"❓ <b>Пояснення терміну '{term}' (Новина ID: {news_id}):</b>\n\n{explanation}")
+    else:
+        await message.answer("❌ Не вдалося пояснити термін.")
     await state.clear()
 
 @router.callback_query(F.data.startswith("fact_check_news_"))
@@ -1127,7 +1277,7 @@ async def handle_fact_check_news_callback(callback: CallbackQuery, state: FSMCon
     await callback.message.answer("✅ Введіть факт, який ви хочете перевірити в контексті цієї новини.")
     await callback.answer()
 
-@router.message(AIAssistant.waiting_for_fact_to_check, F.text)
+@router.message(AIAssistant.waiting_for_fact_to_check, F.text, flags={"ai": "fact_check"})
 async def process_fact_to_check(message: Message, state: FSMContext):
     data = await state.get_data()
     news_id = data.get('fact_check_news_id')
@@ -1136,41 +1286,31 @@ async def process_fact_to_check(message: Message, state: FSMContext):
         await message.answer("Контекст новини втрачено. Спробуйте ще раз.")
         await state.clear()
         return
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT content FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await message.answer("Новину не знайдено.")
-                await state.clear()
-                return
-            await message.answer(f"⏳ Перевіряю факт: '{fact_to_check}' за допомогою AI...")
-            await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-            fact_check_result = await ai_fact_check(fact_to_check, news_item['content'])
-            if fact_check_result:
-                await message.answer(f"✅ <b>Перевірка факту для новини (ID: {news_id}):</b>\n\n{fact_check_result}")
-            else:
-                await message.answer("❌ Не вдалося перевірити факт.")
+    news_item = await fetch_news_fields(news_id, "content")
+    if not news_item:
+        await message.answer("Новину не знайдено.")
+        await state.clear()
+        return
+    await message.answer(f"⏳ Перевіряю факт: '{fact_to_check}' за допомогою AI...")
+    await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
+    fact_check_result = await ai_fact_check(fact_to_check, news_item['content'])
+    if fact_check_result:
+        await message.answer(f"✅ <b>Перевірка факту для новини (ID: {news_id}):</b>\n\n{fact_check_result}")
+    else:
+        await message.answer("❌ Не вдалося перевірити факт.")
     await state.clear()
 
-@router.callback_query(F.data.startswith("sentiment_trend_analysis_"))
+@router.callback_query(F.data.startswith("sentiment_trend_analysis_"), flags={"ai": "sentiment"})
 async def handle_sentiment_trend_analysis_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[3])
     pool = await get_db_pool()
+    # Основна та пов'язані новини читаються за одне коротке утримання з'єднання; AI-запит — уже після його повернення
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT id, title, content, ai_summary, ai_classified_topics, lang, published_at FROM news WHERE id = %s", (news_id,))
+            await cur.execute("SELECT id, title, content, ai_summary, ai_classified_topics, lang, published_at FROM news WHERE id = %s", (news_id,), prepare=True)
             main_news_record = await cur.fetchone()
-            if not main_news_record:
-                await callback.message.answer("❌ Новину для аналізу не знайдено.")
-                await callback.answer()
-                return
-            main_news_obj = News(id=main_news_record['id'], title=main_news_record['title'], content=main_news_record['content'], lang=main_news_record['lang'], published_at=main_news_record['published_at'], ai_summary=main_news_record['ai_summary'], ai_classified_topics=main_news_record['ai_classified_topics'])
-            await callback.message.answer("⏳ Аналізую тренд настроїв за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            related_news_items = []
-            if main_news_obj.ai_classified_topics:
+            related_news_records = []
+            if main_news_record and main_news_record['ai_classified_topics']:
                 await cur.execute(f"""
                     SELECT id, title, content, ai_summary, lang, published_at
                     FROM news
@@ -1180,29 +1320,32 @@ async def handle_sentiment_trend_analysis_callback(callback: CallbackQuery):
                     AND published_at >= NOW() - INTERVAL '30 days'
                     AND ai_classified_topics ?| %s
                     ORDER BY published_at ASC LIMIT 5
-                """, (news_id, main_news_obj.ai_classified_topics))
+                """, (news_id, main_news_record['ai_classified_topics']))
                 related_news_records = await cur.fetchall()
-                related_news_items = [News(id=r['id'], title=r['title'], content=r['content'], lang=r['lang'], published_at=r['published_at'], ai_summary=r['ai_summary']) for r in related_news_records]
-            ai_sentiment_trend = await ai_analyze_sentiment_trend(main_news_obj, related_news_items)
-            await callback.message.answer(f"📊 <b>Аналіз тренду настроїв для новини (ID: {news_id}):</b>\n\n{ai_sentiment_trend}", parse_mode=ParseMode.HTML)
+    if not main_news_record:
+        await callback.message.answer("❌ Новину для аналізу не знайдено.")
+        await callback.answer()
+        return
+    main_news_obj = News(id=main_news_record['id'], title=main_news_record['title'], content=main_news_record['content'], source_url=None, image_url=None, lang=main_news_record['lang'], published_at=main_news_record['published_at'], ai_summary=main_news_record['ai_summary'], ai_classified_topics=main_news_record['ai_classified_topics'])
+    related_news_items = [News(id=r['id'], title=r['title'], content=r['content'], source_url=None, image_url=None, lang=r['lang'], published_at=r['published_at'], ai_summary=r['ai_summary']) for r in related_news_records]
+    await callback.message.answer("⏳ Аналізую тренд настроїв за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    ai_sentiment_trend = await ai_analyze_sentiment_trend(main_news_obj, related_news_items)
+    await callback.message.answer(f"📊 <b>Аналіз тренду настроїв для новини (ID: {news_id}):</b>\n\n{ai_sentiment_trend}", parse_mode=ParseMode.HTML)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("bias_detection_"))
+@router.callback_query(F.data.startswith("bias_detection_"), flags={"ai": "bias"})
 async def handle_bias_detection_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, ai_summary FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину для аналізу не знайдено.")
-                await callback.answer()
-                return
-            await callback.message.answer("⏳ Аналізую новину на наявність упереджень за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            ai_bias_analysis = await ai_detect_bias_in_news(news_item['title'], news_item['content'], news_item['ai_summary'])
-            await callback.message.answer(f"🔍 <b>Аналіз на упередженість для новини (ID: {news_id}):</b>\n\n{ai_bias_analysis}", parse_mode=ParseMode.HTML)
+    news_item = await fetch_news_fields(news_id, "title, content, ai_summary")
+    if not news_item:
+        await callback.message.answer("❌ Новину для аналізу не знайдено.")
+        await callback.answer()
+        return
+    await callback.message.answer("⏳ Аналізую новину на наявність упереджень за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    ai_bias_analysis = await ai_detect_bias_in_news(news_item['title'], news_item['content'], news_item['ai_summary'])
+    await callback.message.answer(f"🔍 <b>Аналіз на упередженість для новини (ID: {news_id}):</b>\n\n{ai_bias_analysis}", parse_mode=ParseMode.HTML)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("audience_summary_"))
@@ -1218,7 +1361,7 @@ async def handle_audience_summary_callback(callback: CallbackQuery, state: FSMCo
     await callback.message.edit_text("📝 Для якої аудиторії ви хочете отримати резюме цієї новини?", reply_markup=keyboard)
     await callback.answer()
 
-@router.callback_query(AIAssistant.waiting_for_audience_summary_type, F.data.startswith("audience_type_"))
+@router.callback_query(AIAssistant.waiting_for_audience_summary_type, F.data.startswith("audience_type_"), flags={"ai": "audience"})
 async def process_audience_type_selection(callback: CallbackQuery, state: FSMContext):
     audience_type_key = callback.data.split('_')[2]
     audience_map = {'child': 'дитини', 'expert': 'експерта', 'politician': 'політика', 'technologist': 'технолога'}
@@ -1232,18 +1375,14 @@ async def process_audience_type_selection(callback: CallbackQuery, state: FSMCon
         return
     await callback.message.edit_text(f"⏳ Генерую резюме для аудиторії: <b>{selected_audience}</b>...", parse_mode=ParseMode.HTML)
     await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, ai_summary FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину для резюме не знайдено.")
-                await state.clear()
-                await callback.answer()
-                return
-            ai_summary_for_audience = await ai_summarize_for_audience(news_item['title'], news_item['content'], news_item['ai_summary'], selected_audience)
-            await callback.message.answer(f"📝 <b>Резюме для аудиторії: {selected_audience} (Новина ID: {news_id}):</b>\n\n{ai_summary_for_audience}", parse_mode=ParseMode.HTML)
+    news_item = await fetch_news_fields(news_id, "title, content, ai_summary")
+    if not news_item:
+        await callback.message.answer("❌ Новину для резюме не знайдено.")
+        await state.clear()
+        await callback.answer()
+        return
+    ai_summary_for_audience = await ai_summarize_for_audience(news_item['title'], news_item['content'], news_item['ai_summary'], selected_audience)
+    await callback.message.answer(f"📝 <b>Резюме для аудиторії: {selected_audience} (Новина ID: {news_id}):</b>\n\n{ai_summary_for_audience}", parse_mode=ParseMode.HTML)
     await state.clear()
     await callback.answer()
 
@@ -1253,40 +1392,32 @@ async def cancel_audience_summary_callback(callback: CallbackQuery, state: FSMCo
     await state.clear()
     await callback.answer()
 
-@router.callback_query(F.data.startswith("historical_analogues_"))
+@router.callback_query(F.data.startswith("historical_analogues_"), flags={"ai": "analogues"})
 async def handle_historical_analogues_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, ai_summary FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину для аналізу не знайдено.")
-                await callback.answer()
-                return
-            await callback.message.answer("⏳ Шукаю історичні аналоги за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            ai_historical_analogues = await ai_find_historical_analogues(news_item['title'], news_item['content'], news_item['ai_summary'])
-            await callback.message.answer(f"📜 <b>Історичні аналоги для новини (ID: {news_id}):</b>\n\n{ai_historical_analogues}", parse_mode=ParseMode.HTML)
+    news_item = await fetch_news_fields(news_id, "title, content, ai_summary")
+    if not news_item:
+        await callback.message.answer("❌ Новину для аналізу не знайдено.")
+        await callback.answer()
+        return
+    await callback.message.answer("⏳ Шукаю історичні аналоги за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    ai_historical_analogues = await ai_find_historical_analogues(news_item['title'], news_item['content'], news_item['ai_summary'])
+    await callback.message.answer(f"📜 <b>Історичні аналоги для новини (ID: {news_id}):</b>\n\n{ai_historical_analogues}", parse_mode=ParseMode.HTML)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("impact_analysis_"))
+@router.callback_query(F.data.startswith("impact_analysis_"), flags={"ai": "impact"})
 async def handle_impact_analysis_callback(callback: CallbackQuery):
     news_id = int(callback.data.split('_')[2])
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, ai_summary FROM news WHERE id = %s", (news_id,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await callback.message.answer("❌ Новину для аналізу впливу не знайдено.")
-                await callback.answer()
-                return
-            await callback.message.answer("⏳ Аналізую потенційний вплив новини за допомогою AI...")
-            await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
-            ai_impact_analysis = await ai_analyze_impact(news_item['title'], news_item['content'], news_item['ai_summary'])
-            await callback.message.answer(f"💥 <b>Аналіз впливу новини (ID: {news_id}):</b>\n\n{ai_impact_analysis}", parse_mode=ParseMode.HTML)
+    news_item = await fetch_news_fields(news_id, "title, content, ai_summary")
+    if not news_item:
+        await callback.message.answer("❌ Новину для аналізу впливу не знайдено.")
+        await callback.answer()
+        return
+    await callback.message.answer("⏳ Аналізую потенційний вплив новини за допомогою AI...")
+    await callback.bot.send_chat_action(chat_id=callback.message.chat.id, action=ChatAction.TYPING)
+    ai_impact_analysis = await ai_analyze_impact(news_item['title'], news_item['content'], news_item['ai_summary'])
+    await callback.message.answer(f"💥 <b>Аналіз впливу новини (ID: {news_id}):</b>\n\n{ai_impact_analysis}", parse_mode=ParseMode.HTML)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("what_if_scenario_"))
@@ -1298,7 +1429,7 @@ async def handle_what_if_scenario_callback(callback: CallbackQuery, state: FSMCo
     await callback.message.answer(f"🤔 Введіть ваше питання у форматі 'Що якби...' для новини (ID: {news_id}). Наприклад: 'Що якби зустріч завершилася без угоди?'")
     await callback.answer()
 
-@router.message(AIAssistant.waiting_for_what_if_query, F.text)
+@router.message(AIAssistant.waiting_for_what_if_query, F.text, flags={"ai": "what_if"})
 async def process_what_if_query(message: Message, state: FSMContext):
     what_if_question = message.text.strip()
     if not what_if_question:
@@ -1312,17 +1443,13 @@ async def process_what_if_query(message: Message, state: FSMContext):
         return
     await message.answer("⏳ Генерую сценарій 'Що якби...' за допомогою AI...")
     await message.bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT title, content, ai_summary FROM news WHERE id = %s", (news_id_for_context,))
-            news_item = await cur.fetchone()
-            if not news_item:
-                await message.answer("❌ Новину не знайдено. Спробуйте з іншою новиною.")
-                await state.clear()
-                return
-            ai_what_if_scenario = await ai_generate_what_if_scenario(news_item['title'], news_item['content'], news_item['ai_summary'], what_if_question)
-            await message.answer(f"🤔 <b>Сценарій 'Що якби...' для новини (ID: {news_id_for_context}):</b>\n\n{ai_what_if_scenario}", parse_mode=ParseMode.HTML)
+    news_item = await fetch_news_fields(news_id_for_context, "title, content, ai_summary")
+    if not news_item:
+        await message.answer("❌ Новину не знайдено. Спробуйте з іншою новиною.")
+        await state.clear()
+        return
+    ai_what_if_scenario = await ai_generate_what_if_scenario(news_item['title'], news_item['content'], news_item['ai_summary'], what_if_question)
+    await message.answer(f"🤔 <b>Сценарій 'Що якби...' для новини (ID: {news_id_for_context}):</b>\n\n{ai_what_if_scenario}", parse_mode=ParseMode.HTML)
     await state.clear()
 
 # --- New handlers for adding sources ---
@@ -1404,45 +1531,18 @@ async def process_source_type_invalid(message: Message):
 async def handle_my_news_command(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     user_filters = await get_user_filters(user_id)
-    source_ids = user_filters.get('source_ids', [])
-    
-    pool = await get_db_pool()
-    async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            query = "SELECT id FROM news WHERE moderation_status = 'approved' AND expires_at > NOW()"
-            params = []
-            if source_ids:
-                await cur.execute("SELECT link FROM sources WHERE id = ANY(%s)", (source_ids,))
-                source_links_data = await cur.fetchall()
-                source_links = [s['link'] for s in source_links_data]
-                if source_links:
-                    query += " AND source_url = ANY(%s)"
-                    params.append(source_links)
-                else:
-                    await callback.message.answer("Наразі немає доступних новин за вашими фільтрами. Спробуйте змінити фільтри або зайдіть пізніше.")
-                    await callback.answer()
-                    return
-
-            query += " ORDER BY published_at DESC"
-            
-            if params:
-                await cur.execute(query, (params[0],) if len(params) == 1 else tuple(params))
-            else:
-                await cur.execute(query)
+    news_ids = await get_feed_news_ids(user_filters.get('source_ids', []))
 
-            news_records = await cur.fetchall()
-
-            if not news_records:
-                await callback.message.answer("Наразі немає доступних новин за вашими фільтрами. Спробуйте змінити фільтри або зайдіть пізніше.")
-                await callback.answer()
-                return
-            news_ids = [r['id'] for r in news_records]
-            await state.update_data(news_ids=news_ids, news_index=0)
-            await state.set_state(NewsBrowse.Browse_news)
-            current_news_id = news_ids[0]
-            await callback.message.edit_text("Завантажую новину...")
-            await send_news_to_user(callback.message.chat.id, current_news_id, 0, len(news_ids))
-            await callback.answer()
+    if not news_ids:
+        await callback.message.answer("Наразі немає доступних новин за вашими фільтрами. Спробуйте змінити фільтри або зайдіть пізніше.")
+        await callback.answer()
+        return
+    await state.update_data(news_ids=news_ids, news_index=0)
+    await state.set_state(NewsBrowse.Browse_news)
+    current_news_id = news_ids[0]
+    await callback.message.edit_text("Завантажую новину...")
+    await send_news_to_user(callback.message.chat.id, current_news_id, 0, len(news_ids))
+    await callback.answer()
 
 @router.callback_query(NewsBrowse.Browse_news, F.data == "next_news")
 async def process_next_news(callback: CallbackQuery, state: FSMContext):
@@ -1495,184 +1595,258 @@ async def handle_help_menu(callback: CallbackQuery):
     await callback.message.edit_text(help_text, parse_mode=ParseMode.HTML, reply_markup=get_main_menu_keyboard())
     await callback.answer()
 
-async def news_repost_task():
-    repost_interval = 150 # Змінено інтервал до 150 секунд (2.5 хвилини)
-    while True:
-        try:
-            pool = await get_db_pool()
-            async with pool.connection() as conn:
-                async with conn.cursor(row_factory=dict_row) as cur:
-                    # Отримуємо всі активні джерела
-                    await cur.execute("SELECT id, name, link, type FROM sources WHERE status = 'active'")
-                    available_sources = await cur.fetchall()
-
-                    selected_source = None
-                    if available_sources:
-                        selected_source = random.choice(available_sources)
-                        mock_source_url = selected_source['link']
-                        mock_source_name = selected_source['name']
-                    else:
-                        mock_source_url = "https://example.com/ai-news"
-                        mock_source_name = "AI News (Default)"
-
-                    # Симуляція "топової" новини за допомогою AI
-                    # Генеруємо більш якісний та "топовий" контент
-                    top_news_prompt = (
-                        f"Створи заголовок та короткий, але захоплюючий зміст (до 300 слів) для 'топової' новини, "
-                        f"яка могла б з'явитися на джерелі '{mock_source_name}' ({mock_source_url}). "
-                        f"Новина має бути актуальною, цікавою для широкої аудиторії, "
-                        f"та стосуватися сфер технологій, науки, або значних суспільних подій. "
-                        f"Використовуй українську мову. Формат: Заголовок\\n\\nЗміст."
-                    )
-                    generated_content = await make_gemini_request_with_history([{"role": "user", "parts": [{"text": top_news_prompt}]}])
-
-                    if not generated_content or "Не вдалося отримати відповідь AI." in generated_content:
-                        logger.warning("Не вдалося згенерувати 'топову' новину, використовуючи стандартний мок-контент.")
-                        mock_title = f"Оновлення новин AI {datetime.now().strftime('%H:%M:%S')} від {mock_source_name}"
-                        mock_content = f"Це автоматично згенерована новина про останні події у світі AI та технологій. AI продовжує інтегруватися в повсякденне життя, змінюючи спосіб взаємодії людей з інформацією. Нові досягнення в машинному навчанні дозволяють створювати більш персоналізовані та адаптивні системи. Експерти прогнозують подальше зростання впливу AI на економіку та суспільство. Джерело: {mock_source_name}."
-                    else:
-                        # Розділяємо згенерований контент на заголовок та зміст
-                        parts = generated_content.split('\n\n', 1)
-                        if len(parts) >= 2:
-                            mock_title = parts[0].strip()
-                            mock_content = parts[1].strip()
-                        else:
-                            mock_title = generated_content.strip()[:100] + "..."
-                            mock_content = generated_content.strip()
-                        logger.info(f"Згенеровано 'топову' новину: {mock_title}")
-
-
-                    mock_image_url = "https://placehold.co/600x400/ADE8F4/000000?text=AI+News"
-                    mock_lang = 'uk'
-
-                    await cur.execute("SELECT viewed_topics FROM user_stats LIMIT 1")
-                    user_stats_rec = await cur.fetchone()
-                    user_interests = user_stats_rec['viewed_topics'] if user_stats_rec else []
-
-            is_interesting = await ai_filter_interesting_news(mock_title, mock_content, user_interests)
-
-            if is_interesting:
-                ai_summary = await ai_summarize_news(mock_title, mock_content)
-                ai_topics = await ai_classify_topics(mock_content)
-                new_news = News(id=0, title=mock_title, content=mock_content, source_url=mock_source_url,
-                                image_url=mock_image_url, published_at=datetime.now(), lang=mock_lang,
-                                ai_summary=ai_summary, ai_classified_topics=ai_topics, moderation_status='approved')
-                await add_news(new_news)
-                logger.info(f"Автоматично репостнуто та схвалено новину: {new_news.id} - '{new_news.title}'")
-                
-                # Спробуємо опублікувати новину в канал
-                if NEWS_CHANNEL_LINK:
-                    try:
-                        post_text = await ai_formulate_news_post(new_news.title, new_news.ai_summary or new_news.content, new_news.source_url)
-                        
-                        channel_identifier = NEWS_CHANNEL_LINK
-                        if channel_identifier.startswith("https://t.me/"):
-                            channel_identifier = "@" + channel_identifier.split('/')[-1]
-                        elif not channel_identifier.startswith("@"):
-                            channel_identifier = "@" + channel_identifier
-
-                        await bot.send_message(chat_id=channel_identifier, text=post_text, disable_web_page_preview=False)
-                        logger.info(f"Новину {new_news.id} опубліковано в канал {NEWS_CHANNEL_LINK}.")
-                    except Exception as e:
-                        logger.error(f"Помилка публікації новини в канал {NEWS_CHANNEL_LINK}: {e}")
-            else:
-                logger.info(f"Пропущено репост новини (нецікаво): '{mock_title}'")
-        except Exception as e:
-            logger.error(f"Помилка в завданні репосту новин: {e}")
-        await asyncio.sleep(repost_interval)
-
-async def news_digest_task():
-    while True:
-        now = datetime.now()
-        next_run_time = datetime(now.year, now.month, now.day, 9, 0, 0) # Щодня о 9 ранку
-        if now >= next_run_time: next_run_time += timedelta(days=1)
-        
-        sleep_seconds = (next_run_time - now).total_seconds()
-        if sleep_seconds < 0: sleep_seconds = 0 # Не повинно відбуватися, якщо логіка для наступного дня коректна
-        
-        logger.info(f"Наступний запуск дайджесту через {sleep_seconds:.0f} секунд.")
-        await asyncio.sleep(sleep_seconds)
+@jobs.queue.handler("repost", every=150) # Раз на 2.5 хвилини
+async def repost_job(payload: Dict[str, Any]):
+    """Генерує "топову" новину з випадкового активного джерела; цікаву передає на збагачення."""
+    pool = await get_db_pool()
+    # З'єднання з пулу тримається лише на час читання; генерація AI відбувається після його повернення
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            # Отримуємо всі активні джерела
+            await cur.execute("SELECT id, name, link, type FROM sources WHERE status = 'active'")
+            available_sources = await cur.fetchall()
+
+            await cur.execute("SELECT viewed_topics FROM user_stats LIMIT 1")
+            user_stats_rec = await cur.fetchone()
+            user_interests = user_stats_rec['viewed_topics'] if user_stats_rec else []
+
+    selected_source = None
+    mock_source_id = None
+    if available_sources:
+        selected_source = random.choice(available_sources)
+        mock_source_id = selected_source['id']
+        mock_source_url = selected_source['link']
+        mock_source_name = selected_source['name']
+    else:
+        mock_source_url = "https://example.com/ai-news"
+        mock_source_name = "AI News (Default)"
+
+    # Симуляція "топової" новини за допомогою AI
+    # Генеруємо більш якісний та "топовий" контент
+    top_news_prompt = (
+        f"Створи заголовок та короткий, але захоплюючий зміст (до 300 слів) для 'топової' новини, "
+        f"яка могла б з'явитися на джерелі '{mock_source_name}' ({mock_source_url}). "
+        f"Новина має бути актуальною, цікавою для широкої аудиторії, "
+        f"та стосуватися сфер технологій, науки, або значних суспільних подій. "
+        f"Використовуй українську мову. Формат: Заголовок\\n\\nЗміст."
+    )
+    generated_content = await make_gemini_request_with_history([{"role": "user", "parts": [{"text": top_news_prompt}]}])
 
+    if is_ai_error(generated_content):
+        logger.warning("Не вдалося згенерувати 'топову' новину, використовуючи стандартний мок-контент.")
+        mock_title = f"Оновлення новин AI {datetime.now().strftime('%H:%M:%S')} від {mock_source_name}"
+        mock_content = f"Це автоматично згенерована новина про останні події у світі AI та технологій. AI продовжує інтегруватися в повсякденне життя, змінюючи спосіб взаємодії людей з інформацією. Нові досягнення в машинному навчанні дозволяють створювати більш персоналізовані та адаптивні системи. Експерти прогнозують подальше зростання впливу AI на економіку та суспільство. Джерело: {mock_source_name}."
+    else:
+        # Розділяємо згенерований контент на заголовок та зміст
+        parts = generated_content.split('\n\n', 1)
+        if len(parts) >= 2:
+            mock_title = parts[0].strip()
+            mock_content = parts[1].strip()
+        else:
+            mock_title = generated_content.strip()[:100] + "..."
+            mock_content = generated_content.strip()
+        logger.info(f"Згенеровано 'топову' новину: {mock_title}")
+
+    is_interesting = await ai_filter_interesting_news(mock_title, mock_content, user_interests)
+    if not is_interesting:
+        logger.info(f"Пропущено репост новини (нецікаво): '{mock_title}'")
+        return
+    await jobs.queue.enqueue("enrich", {"title": mock_title, "content": mock_content, "source_url": mock_source_url,
+                                        "image_url": "https://placehold.co/600x400/ADE8F4/000000?text=AI+News",
+                                        "lang": 'uk', "source_id": mock_source_id})
+
+@jobs.queue.handler("enrich")
+async def enrich_job(payload: Dict[str, Any]):
+    """Додає AI-резюме й теми та зберігає новину на модерацію; після схвалення вона піде в канал."""
+    # Повтор завдання, чия новина вже збережена (не вдалося позначити його виконаним), не додає її вдруге.
+    # source_url у репостах — адреса джерела, тож новину визначає пара адреса й заголовок
+    if await news_exists(payload['source_url'], payload['title']):
+        logger.info(f"Новину '{payload['title']}' вже збережено, повторне завдання пропущено.")
+        return
+    # Помилка AI не повинна потрапити в резюме: виняток поверне завдання в чергу з відкладеним повтором
+    ai_summary = require_ai_response(await ai_summarize_news(payload['title'], payload['content']))
+    ai_topics, topics_source = await classify_news_topics(payload['title'], payload['content'])
+    new_news = News(id=0, title=payload['title'], content=payload['content'], source_url=payload['source_url'],
+                    image_url=payload['image_url'], published_at=datetime.now(), lang=payload['lang'],
+                    ai_summary=ai_summary, ai_classified_topics=ai_topics, moderation_status='pending',
+                    source_id=payload['source_id'], topics_source=topics_source)
+    await add_news(new_news, publish_to_channel=bool(NEWS_CHANNEL_LINK))
+    logger.info(f"Автоматично репостнуто новину (очікує модерації): {new_news.id} - '{new_news.title}'")
+
+@jobs.queue.handler(news_import.ENRICH_JOB, priority=200)
+async def import_enrich_job(payload: Dict[str, Any]):
+    """Доповнює імпортовану новину AI-резюме й темами, яких не було у файлі імпорту."""
+    news_record = await fetch_news_fields(payload['news_id'], "id, title, content, ai_summary, ai_classified_topics")
+    if not news_record:
+        return
+    ai_summary = news_record['ai_summary'] or require_ai_response(await ai_summarize_news(news_record['title'], news_record['content']))
+    ai_topics, topics_source = news_record['ai_classified_topics'], None
+    if not ai_topics:
+        ai_topics, topics_source = await classify_news_topics(news_record['title'], news_record['content'])
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        await conn.execute("UPDATE news SET ai_summary = %s, ai_classified_topics = %s, topics_source = COALESCE(%s, topics_source) WHERE id = %s",
+                           (ai_summary, Jsonb(ai_topics) if ai_topics else None, topics_source, news_record['id']))
+
+@jobs.queue.handler(moderation.CHANNEL_PUBLISH_JOB)
+async def channel_publish_job(payload: Dict[str, Any]):
+    news_record = await fetch_news_fields(payload['news_id'], "id, title, content, source_url, ai_summary")
+    if not news_record or not NEWS_CHANNEL_LINK:
+        return
+    post_text = require_ai_response(await ai_formulate_news_post(news_record['title'], news_record['ai_summary'] or news_record['content'], news_record['source_url']))
+
+    channel_identifier = NEWS_CHANNEL_LINK
+    if channel_identifier.startswith("https://t.me/"):
+        channel_identifier = "@" + channel_identifier.split('/')[-1]
+    elif not channel_identifier.startswith("@"):
+        channel_identifier = "@" + channel_identifier
+
+    # Помилка Telegram (зокрема TelegramRetryAfter) призводить до повторної спроби завдання
+    await bot.send_message(chat_id=channel_identifier, text=post_text, disable_web_page_preview=False)
+    logger.info(f"Новину {news_record['id']} опубліковано в канал {NEWS_CHANNEL_LINK}.")
+
+DIGEST_TITLES = {"hourly": "Ваш щогодинний дайджест новин", "daily": "Ваш щоденний дайджест новин", "weekly": "Ваш щотижневий дайджест новин"}
+
+async def send_user_digest(user: Dict[str, Any]):
+    """Дайджест одному користувачу; викликається завданням digest, яке digest_scheduler ставить у чергу."""
+    user_id = user['id']
+    user_filters = await get_user_filters(user_id)
+    source_ids = user_filters.get('source_ids', [])
+
+    query = f"SELECT id, title, content, source_url, image_url, published_at, ai_summary FROM news WHERE moderation_status = 'approved' AND expires_at > NOW() AND {HOT_NEWS_WINDOW_SQL}"
+    params = []
+    if source_ids:
+        query += " AND source_id = ANY(%s)"
+        params.append(source_ids)
+
+    query += f" AND id NOT IN (SELECT news_id FROM user_news_views WHERE user_id = %s AND {HOT_VIEWS_WINDOW_SQL}) ORDER BY published_at DESC LIMIT 5"
+    params.append(user_id)
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, tuple(params))
+            news_items_data = await cur.fetchall()
+    if not news_items_data:
+        return
+
+    local_now = datetime.now(digest_scheduler.resolve_timezone(user['digest_timezone']))
+    title = DIGEST_TITLES.get(user['digest_frequency'], "Ваш дайджест новин")
+    digest_text = f"📰 <b>{title} ({local_now.strftime('%d.%m.%Y')}):</b>\n\n"
+    for news_rec in news_items_data:
+        news_obj = News(id=news_rec['id'], title=news_rec['title'], content=news_rec['content'],
+                        source_url=news_rec['source_url'], image_url=news_rec['image_url'],
+                        published_at=news_rec['published_at'], lang=user['language'], ai_summary=news_rec['ai_summary'])
+
+        summary_to_use = news_obj.ai_summary or news_obj.content[:200] + "..."
+        digest_text += f"• <b>{news_obj.title}</b>\n{summary_to_use}\n"
+        if news_obj.source_url: digest_text += f"🔗 {hlink('Читати', news_obj.source_url)}\n\n"
+
+    await bot.send_message(user_id, digest_text, disable_web_page_preview=True)
+    # Переглянутими позначаємо лише після відправки, щоб повтор завдання не надіслав порожній дайджест
+    for news_rec in news_items_data:
+        await mark_news_as_viewed(user_id, news_rec['id'])
+    logger.info("Дайджест надіслано користувачу %s.", user_id, extra={"sample_rate": LOG_SAMPLE_RATE})
+
+@jobs.queue.handler("digest", priority=50)
+async def digest_job(payload: Dict[str, Any]):
+    pool = await get_db_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(f"SELECT {digest_scheduler.SCHEDULE_COLUMNS}, auto_notifications FROM users WHERE id = %s", (payload['user_id'],))
+            user = await cur.fetchone()
+    # Користувач міг вимкнути сповіщення, поки завдання чекало в черзі
+    if user and user['auto_notifications']:
+        await send_user_digest(user)
+
+digest_scheduler.setup(get_db_pool)
+moderation.setup(get_db_pool, ai_check_news_for_fakes, HOT_NEWS_WINDOW_SQL)
+topic_model.setup(get_db_pool, HOT_NEWS_WINDOW_SQL)
+
+async def register_webhook():
+    webhook_full_url = f"{WEBHOOK_URL.rstrip('/')}/telegram_webhook"
+    ready_url = f"{WEBHOOK_URL.rstrip('/')}/ready"
+    # Реєструємо вебхук лише тоді, коли сервіс реально приймає запити ззовні,
+    # щоб Telegram не отримував помилок і не повторював оновлення під час холодного старту.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WEBHOOK_READY_TIMEOUT
+    delay = 0.5
+    async with ClientSession(timeout=ClientTimeout(total=5)) as session:
+        while True:
+            try:
+                async with session.get(ready_url) as response:
+                    if response.status == 200: break
+            except Exception:
+                pass
+            if loop.time() >= deadline:
+                logger.warning(f"{ready_url} не відповів за {WEBHOOK_READY_TIMEOUT} с, вебхук буде встановлено без підтвердження готовності.")
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+    for attempt in range(1, 6):
         try:
-            pool = await get_db_pool()
-            async with pool.connection() as conn:
-                async with conn.cursor(row_factory=dict_row) as cur:
-                    await cur.execute("SELECT id, language, auto_notifications FROM users WHERE auto_notifications = TRUE AND digest_frequency = 'daily'")
-                    users = await cur.fetchall()
-                    for user_data in users:
-                        user_id = user_data['id']
-                        user_lang = user_data['language']
-                        user_filters = await get_user_filters(user_id)
-                        source_ids = user_filters.get('source_ids', [])
-                        
-                        query = "SELECT id, title, content, source_url, image_url, published_at, ai_summary FROM news WHERE moderation_status = 'approved' AND expires_at > NOW()"
-                        params = []
-                        if source_ids:
-                            await cur.execute("SELECT link FROM sources WHERE id = ANY(%s)", (source_ids,))
-                            source_links_data = await cur.fetchall()
-                            source_links = [s['link'] for s in source_links_data]
-                            if source_links:
-                                query += " AND source_url = ANY(%s)"
-                                params.append(source_links)
-                            else:
-                                continue
-                        
-                        query += f" AND id NOT IN (SELECT news_id FROM user_news_views WHERE user_id = {user_id}) ORDER BY published_at DESC LIMIT 5"
-                        
-                        if params:
-                            await cur.execute(query, (params[0],) if len(params) == 1 else tuple(params))
-                        else:
-                            await cur.execute(query)
-
-                        news_items_data = await cur.fetchall()
-                        
-                        if news_items_data:
-                            digest_text = f"📰 <b>Ваш щоденний дайджест новин ({now.strftime('%d.%m.%Y')}):</b>\n\n"
-                            for news_rec in news_items_data:
-                                news_obj = News(id=news_rec['id'], title=news_rec['title'], content=news_rec['content'],
-                                                source_url=news_rec['source_url'], image_url=news_rec['image_url'],
-                                                published_at=news_rec['published_at'], lang=user_lang, ai_summary=news_rec['ai_summary'])
-                                
-                                summary_to_use = news_obj.ai_summary or news_obj.content[:200] + "..."
-                                digest_text += f"• <b>{news_obj.title}</b>\n{summary_to_use}\n"
-                                if news_obj.source_url: digest_text += f"🔗 {hlink('Читати', news_obj.source_url)}\n\n"
-                                
-                                await mark_news_as_viewed(user_id, news_obj.id)
-                            
-                            try:
-                                await bot.send_message(user_id, digest_text, disable_web_page_preview=True)
-                                logger.info(f"Дайджест надіслано користувачу {user_id}.")
-                            except Exception as e:
-                                logger.error(f"Не вдалося надіслати дайджест користувачу {user_id}: {e}")
+            webhook_info = await bot.get_webhook_info()
+            if webhook_info.url != webhook_full_url:
+                await bot.set_webhook(url=webhook_full_url)
+            logger.info(f"Вебхук встановлено на {webhook_full_url}")
+            return
         except Exception as e:
-            logger.error(f"Помилка в завданні дайджесту новин: {e}")
+            logger.error(f"Не вдалося встановити вебхук (спроба {attempt}): {e}")
+            await asyncio.sleep(2 ** attempt)
 
 @app.on_event("startup")
 async def startup_event():
-    await get_db_pool()
-    await create_tables()
-    
+    global app_ready
+    with startup_phase("migrations"):
+        await apply_migrations(DATABASE_URL)
+    with startup_phase("db_pool"):
+        await get_db_pool()
+    with startup_phase("assets"):
+        # Сторінки читаються й стискаються один раз, до першого запиту
+        await asyncio.to_thread(assets.cache.preload, *ADMIN_PAGES.values())
+
     if WEBHOOK_URL and API_TOKEN:
-        webhook_full_url = f"{WEBHOOK_URL.rstrip('/')}/telegram_webhook"
-        logger.info(f"Спроба встановити вебхук на: {webhook_full_url}")
-        try:
-            await asyncio.sleep(5)
-            await bot.set_webhook(url=webhook_full_url)
-            logger.info(f"Вебхук успішно встановлено на {webhook_full_url}")
-        except Exception as e:
-            logger.error(f"Не вдалося встановити вебхук: {e}")
-            raise
+        asyncio.create_task(register_webhook())
     else:
         logger.warning("WEBHOOK_URL або BOT_TOKEN не встановлено. Вебхук не буде налаштовано.")
 
-    asyncio.create_task(news_repost_task())
-    asyncio.create_task(news_digest_task())
+    # Слухач сповіщень має працювати лише на одному екземплярі, тож його запускає обраний лідер
+    elector = leader.setup(DATABASE_URL)
+    if news_push.PUSH_NOTIFICATIONS_ENABLED:
+        elector.register("news_push", news_push.run)
+    elector.start()
+    # Черга завдань і дайджести розбираються через SKIP LOCKED, а лічильники квот локальні,
+    # тож ці цикли працюють на кожному екземплярі
+    asyncio.create_task(jobs.queue.run())
+    asyncio.create_task(digest_scheduler.scheduler.run())
+    if ai_quota.AI_QUOTA_ENABLED:
+        asyncio.create_task(ai_quota.quota.sync_task())
+    asyncio.create_task(stats_rollup.rollup.sync_task())
+    if topic_model.service.enabled:
+        asyncio.create_task(topic_model.service.train_task())
+    app_ready = True
+    if STARTUP_PROFILE:
+        startup_timings["total"] = round(time.perf_counter() - _module_import_started, 4)
+        logger.info(f"Профіль запуску (секунди): {json.dumps(startup_timings)}")
     logger.info("Додаток FastAPI запущено.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     global db_pool
-    if db_pool: await db_pool.close()
+    if leader.elector:
+        await leader.elector.stop()
+    admin_events.hub.stop()
+    topic_model.service.stop()
+    if db_pool:
+        try:
+            await ai_quota.quota.flush() # Зберігаємо лічильники квот, ще не записані в БД
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти лічильники квот AI: {e}")
+        try:
+            await stats_rollup.rollup.flush() # Зберігаємо зведення статистики, ще не записані в БД
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти зведення статистики: {e}")
+        await db_pool.close()
     if API_TOKEN:
         try:
             await bot.delete_webhook()
@@ -1683,88 +1857,201 @@ async def shutdown_event():
 
 @app.get("/health")
 async def health_check():
-    logger.info("Виклик ендпоінту перевірки стану.")
+    # Перевірка життєздатності процесу: без звернень до БД та без логування
     return {"status": "OK"}
 
+@app.get("/ready")
+async def readiness_check():
+    if not app_ready or db_pool is None:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "starting"})
+    try:
+        async with db_pool.connection(timeout=2) as conn: await conn.execute("SELECT 1")
+    except Exception as e:
+        logger.warning(f"Перевірка готовності не пройшла: {e}")
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "db_unavailable"})
+    return {"status": "ready"}
+
 @app.post("/telegram_webhook")
 async def telegram_webhook(request: Request):
-    logger.info("Отримано запит на /telegram_webhook")
+    received = time.perf_counter()
     try:
         update = await request.json()
-        logger.info(f"Отримано оновлення Telegram: {update}")
+        # Повний вміст оновлення логується лише на рівні DEBUG
+        if logger.isEnabledFor(logging.DEBUG): logger.debug("Оновлення Telegram: %s", update)
+        metrics.observe_webhook_parse(time.perf_counter() - received)
         await dp.feed_update(bot, types.Update.model_validate(update, context={"bot": bot}))
-        logger.info("Успішно оброблено оновлення Telegram.")
+        logger.info("Оброблено оновлення Telegram %s.", update.get("update_id"), extra={"sample_rate": LOG_SAMPLE_RATE})
     except Exception as e:
         logger.error(f"Помилка обробки вебхука Telegram: {e}", exc_info=True)
         return {"ok": False, "error": str(e)}
     return {"ok": True}
 
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    if not metrics.METRICS_ENABLED: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Метрики вимкнено.")
+    if not metrics.authorized(request.client.host if request.client else None, request.headers.get("authorization")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Доступ до метрик заборонено.")
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/dashboard", response_class=HTMLResponse, dependencies=[Depends(get_api_key)])
-async def get_dashboard():
-    with open("dashboard.html", "r", encoding="utf-8") as f: return HTMLResponse(content=f.read())
+async def get_dashboard(request: Request):
+    return await assets.cache.respond(request, ADMIN_PAGES["dashboard"])
 
 @app.get("/users", response_class=HTMLResponse, dependencies=[Depends(get_api_key)])
-async def get_users_page():
-    with open("users.html", "r", encoding="utf-8") as f: return HTMLResponse(content=f.read())
+async def get_users_page(request: Request):
+    return await assets.cache.respond(request, ADMIN_PAGES["users"])
 
 @app.get("/reports", response_class=HTMLResponse, dependencies=[Depends(get_api_key)])
-async def get_reports_page():
-    with open("reports.html", "r", encoding="utf-8") as f: return HTMLResponse(content=f.read())
+async def get_reports_page(request: Request):
+    return await assets.cache.respond(request, ADMIN_PAGES["reports"])
+
+@app.get("/static/{name:path}")
+async def get_static_file(name: str, request: Request):
+    return await assets.serve_static(request, STATIC_DIR, name)
 
 @app.get("/api/admin/stats")
-async def get_admin_stats_api(api_key: str = Depends(get_api_key)):
+async def get_admin_stats_api(exact: bool = False, api_key: str = Depends(get_api_key)):
+    total_products = 0 
+    total_transactions = 0
+    total_reviews = 0 
+    if not exact:
+        # Зведення stats_rollup: кілька рядків замість повних COUNT(*); активні — оцінка HyperLogLog
+        summary = await stats_rollup.rollup.summary()
+        return {
+            "total_users": summary["users"],
+            "total_news": summary["news"],
+            "total_products": total_products,
+            "total_transactions": total_transactions,
+            "total_reviews": total_reviews,
+            "active_users_count": summary["active_users"],
+            "counts_exact": False,
+            "reconciled_at": summary["reconciled_at"]
+        }
     pool = await get_db_pool()
     async with pool.connection() as conn:
+        users_count = await pagination.count_rows(conn, "users", exact)
+        news_count = await pagination.count_rows(conn, "news", exact)
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT COUNT(*) FROM users")
-            total_users = (await cur.fetchone())['count']
-            await cur.execute("SELECT COUNT(*) FROM news")
-            total_news = (await cur.fetchone())['count']
-            total_products = 0 
-            total_transactions = 0
-            total_reviews = 0 
-
-            await cur.execute("SELECT COUNT(DISTINCT id) FROM users WHERE last_active >= NOW() - INTERVAL '7 days'")
+            # id — первинний ключ, тож DISTINCT зайвий; умова йде індексом idx_users_last_active
+            await cur.execute("SELECT COUNT(*) FROM users WHERE last_active >= NOW() - INTERVAL '7 days'")
             active_users_count = (await cur.fetchone())['count']
             return {
-                "total_users": total_users,
-                "total_news": total_news,
+                "total_users": users_count["count"],
+                "total_news": news_count["count"],
                 "total_products": total_products,
                 "total_transactions": total_transactions,
                 "total_reviews": total_reviews,
-                "active_users_count": active_users_count
+                "active_users_count": active_users_count,
+                "counts_exact": True
             }
 
+@app.get("/api/admin/stats/series")
+async def get_admin_stats_series_api(metric: str, granularity: str = stats_rollup.DAY, days: int = 30, api_key: str = Depends(get_api_key)):
+    """Часовий ряд зведень: new_users, news (розріз — source_id), views, ai_calls (розріз — функція AI), active_users."""
+    if granularity not in stats_rollup.GRANULARITY_SECONDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="granularity має бути hour або day.")
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return {"metric": metric, "granularity": granularity, "points": await stats_rollup.rollup.series(metric, granularity, since)}
+
+@app.get("/api/admin/events")
+async def admin_events_api(api_key: str = Depends(get_api_key)):
+    """Потік SSE для адмінської панелі: counters, news_added, news_updated, news_deleted, user_created, resync."""
+    return StreamingResponse(admin_events.hub.stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/admin/jobs")
+async def get_admin_jobs_api(api_key: str = Depends(get_api_key)):
+    return await jobs.queue.stats()
+
+@app.post("/api/admin/jobs/{job_id}/retry")
+async def retry_admin_job_api(job_id: int, api_key: str = Depends(get_api_key)):
+    if not await jobs.queue.retry_dead(job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Завдання не знайдено або воно не має статусу dead.")
+    return {"status": "queued"}
+
+@app.get("/api/admin/export/{table}")
+async def export_admin_table_api(table: str, format: str = "csv", gzip: bool = False, since: Optional[datetime] = None,
+                                 api_key: str = Depends(get_api_key)):
+    """Повне вивантаження news, users або user_news_views; since обмежує рядки за часом (для інкрементальних дампів)."""
+    if table not in data_export.TABLES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Доступні таблиці: {', '.join(data_export.TABLES)}.")
+    if format not in data_export.FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format має бути csv або ndjson.")
+    slot = data_export.exporter.acquire()
+    if slot is None:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Забагато одночасних вивантажень. Спробуйте пізніше.")
+    filename = f"{table}.{format}" + (".gz" if gzip else "")
+    # Фонове завдання звільняє слот, якщо клієнт відключився до початку потоку і генератор так і не запустився
+    return StreamingResponse(data_export.exporter.stream(slot, table, format, gzip, since),
+                             media_type="application/gzip" if gzip else data_export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+                             background=BackgroundTask(slot.release))
+
 @app.get("/api/admin/users")
-async def get_admin_users_api(limit: int = 20, offset: int = 0, api_key: str = Depends(get_api_key)):
+async def get_admin_users_api(limit: int = 20, offset: int = 0, after: Optional[str] = None, exact: bool = False,
+                              api_key: str = Depends(get_api_key)):
+    """Сторінка користувачів; наступну запитують з after=next_cursor (offset лишено для сумісності)."""
+    try:
+        where, params = pagination.keyset_clause("created_at", after)
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT id, username, first_name, last_name, created_at, is_admin, last_active, language, auto_notifications, digest_frequency FROM users ORDER BY created_at DESC LIMIT %s OFFSET %s", (limit, offset))
+            await cur.execute(f"SELECT {USER_COLUMNS} FROM users WHERE {where} ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s",
+                              (*params, limit, 0 if after else offset))
             users_data = await cur.fetchall()
-            await cur.execute("SELECT COUNT(*) FROM users")
-            total_count = (await cur.fetchone())['count']
-            return {"users": [User(**u).__dict__ for u in users_data], "total_count": total_count}
+        total = await pagination.count_rows(conn, "users", exact)
+        return {"users": [User(**u).__dict__ for u in users_data], "total_count": total["count"], "total_count_exact": total["exact"],
+                "next_cursor": pagination.next_cursor(users_data, limit, "created_at")}
 
 @app.get("/api/admin/news")
-async def get_admin_news_api(limit: int = 20, offset: int = 0, api_key: str = Depends(get_api_key)):
+async def get_admin_news_api(limit: int = 20, offset: int = 0, after: Optional[str] = None, exact: bool = False,
+                             moderation_status: Optional[str] = None, api_key: str = Depends(get_api_key)):
+    """Сторінка новин; наступну запитують з after=next_cursor ("published_at,id" останньої новини)."""
+    try:
+        where, params = pagination.keyset_clause("published_at", after)
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if moderation_status:
+        # Наприклад, черга модерації: moderation_status=pending
+        where, params = f"{where} AND moderation_status = %s", (*params, moderation_status)
     pool = await get_db_pool()
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, moderation_status, expires_at FROM news ORDER BY published_at DESC LIMIT %s OFFSET %s", (limit, offset))
+            await cur.execute(f"SELECT {NEWS_COLUMNS} FROM news WHERE {where} ORDER BY published_at DESC, id DESC LIMIT %s OFFSET %s",
+                              (*params, limit, 0 if after else offset))
             news_data = await cur.fetchall()
-            await cur.execute("SELECT COUNT(*) FROM news")
-            total_count = (await cur.fetchone())['count']
-            return {"news": [News(**n).__dict__ for n in news_data], "total_count": total_count}
+        total = await pagination.count_rows(conn, "news", exact)
+        return {"news": [News(**n).__dict__ for n in news_data], "total_count": total["count"], "total_count_exact": total["exact"],
+                "next_cursor": pagination.next_cursor(news_data, limit, "published_at")}
+
+@app.get("/api/admin/news/{news_id}")
+async def get_admin_news_item_api(news_id: int, api_key: str = Depends(get_api_key)):
+    news_item = await get_news(news_id)
+    if not news_item: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Новину не знайдено.")
+    return news_item.__dict__
 
 @app.post("/api/admin/news")
 async def create_admin_news_api(news_data: Dict[str, Any], api_key: str = Depends(get_api_key)):
     news_obj = News(id=0, **news_data)
-    news_obj.ai_summary = await ai_summarize_news(news_obj.title, news_obj.content)
-    news_obj.ai_classified_topics = await ai_classify_topics(news_obj.content)
+    # Адміністратор чекає на відповідь, тож запити йдуть в інтерактивній смузі планувальника AI
+    with ai_scheduler.lane(ai_scheduler.INTERACTIVE):
+        ai_summary = await ai_summarize_news(news_obj.title, news_obj.content)
+        news_obj.ai_summary = None if is_ai_error(ai_summary) else ai_summary
+        news_obj.ai_classified_topics, news_obj.topics_source = await classify_news_topics(news_obj.title, news_obj.content)
     new_news = await add_news(news_obj)
     return new_news.__dict__
 
+@app.post("/api/admin/news/import")
+async def import_admin_news_api(request: Request, format: Optional[str] = None, enrich: bool = True, api_key: str = Depends(get_api_key)):
+    """Масовий імпорт новин з тіла запиту (NDJSON або CSV із заголовком); повертає звіт із помилковими рядками."""
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in news_import.FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format має бути ndjson або csv.")
+    # Звіт повертається після завершення: відповідь, що стрімиться під час читання тіла, конкурувала б з ним за receive ASGI
+    return await news_import.importer.run(request.stream(), fmt, enrich)
+
 @app.put("/api/admin/news/{news_id}")
 async def update_admin_news_api(news_id: int, news_data: Dict[str, Any], api_key: str = Depends(get_api_key)):
     pool = await get_db_pool()
@@ -1773,19 +2060,58 @@ async def update_admin_news_api(news_id: int, news_data: Dict[str, Any], api_key
             set_clauses = []
             params = []
             for k, v in news_data.items():
-                if k in ['title', 'content', 'source_url', 'image_url', 'lang', 'moderation_status', 'expires_at']:
+                if k in ['title', 'content', 'source_url', 'image_url', 'lang', 'expires_at', 'source_id']:
                     set_clauses.append(f"{k} = %s")
                     params.append(v)
                 elif k == 'ai_classified_topics':
-                    set_clauses.append(f"{k} = %s::jsonb")
+                    # Теми, виправлені адміністратором, — найкраща розмітка для topic_model
+                    set_clauses.append(f"{k} = %s::jsonb, topics_source = 'admin'")
                     params.append(json.dumps(v)) # Використовуємо json.dumps для JSONB
-            if not set_clauses: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Немає полів для оновлення.")
+            new_status = news_data.get('moderation_status')
+            if new_status is not None and new_status not in moderation.STATUSES:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"moderation_status має бути одним із: {', '.join(moderation.STATUSES)}.")
+            if not set_clauses and new_status is None: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Немає полів для оновлення.")
             params.append(news_id)
-            await cur.execute(f"UPDATE news SET {', '.join(set_clauses)} WHERE id = %s RETURNING *", tuple(params))
+            if set_clauses:
+                await cur.execute(f"UPDATE news SET {', '.join(set_clauses)} WHERE id = %s RETURNING {NEWS_COLUMNS}", tuple(params))
+            else:
+                await cur.execute(f"SELECT {NEWS_COLUMNS} FROM news WHERE id = %s", tuple(params))
             updated_rec = await cur.fetchone()
             if not updated_rec: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Новину не знайдено.")
+            # Зміна статусу йде через модерацію: схвалення сповіщає підписників і надсилає news_updated саме
+            if new_status is not None and await moderation.set_status(cur, [news_id], new_status):
+                await cur.execute(f"SELECT {NEWS_COLUMNS} FROM news WHERE id = %s", (news_id,))
+                updated_rec = await cur.fetchone()
+            else:
+                await admin_events.notify(cur, "news_updated", admin_events.news_payload(updated_rec))
             return News(**updated_rec).__dict__
 
+MODERATION_ACTIONS = {"approve": "approved", "reject": "rejected"}
+MODERATION_BULK_LIMIT = 1000 # Скільки новин можна схвалити чи відхилити одним запитом
+
+@app.post("/api/admin/news/{action}")
+async def bulk_moderate_news_api(action: str, body: Dict[str, Any], api_key: str = Depends(get_api_key)):
+    """Масове схвалення (approve) чи відхилення (reject): {"ids": [...]}; повертає id, статус яких змінився."""
+    if action not in MODERATION_ACTIONS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Невідома дія.")
+    ids = body.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(news_id, int) for news_id in ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids має бути списком цілих чисел.")
+    if len(ids) > MODERATION_BULK_LIMIT:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Не більше {MODERATION_BULK_LIMIT} новин за запит.")
+    changed = await moderation.moderator.review(ids, MODERATION_ACTIONS[action])
+    return {"updated": [row["id"] for row in changed], "moderation_status": MODERATION_ACTIONS[action]}
+
+@app.post("/api/admin/news/{news_id}/{action}")
+async def moderate_news_api(news_id: int, action: str, api_key: str = Depends(get_api_key)):
+    if action not in MODERATION_ACTIONS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Невідома дія.")
+    if not await moderation.moderator.review([news_id], MODERATION_ACTIONS[action]):
+        # Статус не змінився: або новини немає, або вона вже має цей статус
+        if not await fetch_news_fields(news_id, "id"):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Новину не знайдено.")
+    return {"id": news_id, "moderation_status": MODERATION_ACTIONS[action]}
+
 @app.delete("/api/admin/news/{news_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_admin_news_api(news_id: int, api_key: str = Depends(get_api_key)):
     pool = await get_db_pool()
@@ -1793,21 +2119,10 @@ async def delete_admin_news_api(news_id: int, api_key: str = Depends(get_api_key
         async with conn.cursor(row_factory=dict_row) as cur:
             await cur.execute("DELETE FROM news WHERE id = %s", (news_id,))
             if cur.rowcount == 0: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Новину не знайдено.")
+            stats_rollup.rollup.adjust_total("news", -cur.rowcount)
+            await admin_events.notify(cur, "news_deleted", {"id": news_id})
             return
 
-@app.post("/telegram_webhook")
-async def telegram_webhook(request: Request):
-    logger.info("Отримано запит на /telegram_webhook")
-    try:
-        update = await request.json()
-        logger.info(f"Отримано оновлення Telegram: {update}")
-        await dp.feed_update(bot, types.Update.model_validate(update, context={"bot": bot}))
-        logger.info("Успішно оброблено оновлення Telegram.")
-    except Exception as e:
-        logger.error(f"Помилка обробки вебхука Telegram: {e}", exc_info=True)
-        return {"ok": False, "error": str(e)}
-    return {"ok": True}
-
 @router.message()
 async def echo_handler(message: types.Message) -> None:
     await message.answer("Команду не зрозуміло. Скористайтеся /menu.")
@@ -0,0 +1,132 @@
+"""Потокове вивантаження таблиць для аналітики (CSV або NDJSON, за бажанням у gzip).
+
+Рядки читаються іменованим (серверним) курсором порціями по EXPORT_FETCH_SIZE і одразу віддаються
+клієнту через StreamingResponse, тож пам'ять не залежить від розміру таблиці. Вивантаження йде в
+окремому з'єднанні (не з пулу: довгий дамп не повинен забирати з'єднання в обробників оновлень) у
+транзакції REPEATABLE READ READ ONLY — увесь файл відповідає одному знімку бази. Кількість одночасних
+вивантажень обмежена EXPORT_MAX_CONCURRENT: слот бронюється в обробнику запиту (acquire) ще до відповіді,
+а звільняється, коли потік завершився або клієнт відключився, так і не почавши його читати.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import zlib
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000")) # Скільки рядків серверний курсор віддає за один FETCH
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2")) # Скільки вивантажень може йти одночасно
+EXPORT_FLUSH_BYTES = 64 * 1024 # Розмір частини відповіді, яку віддаємо клієнту
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+class ExportTable:
+    def __init__(self, name: str, columns: str, since_column: str, order_by: Optional[str] = None):
+        self.name = name
+        self.columns = columns
+        self.since_column = since_column
+        self.order_by = order_by
+
+    @property
+    def column_names(self):
+        return [name.strip() for name in self.columns.split(",")]
+
+# Фільтр since іде за ключем партиціювання, тож для news і user_news_views старі партиції відсікаються
+TABLES: Dict[str, ExportTable] = {table.name: table for table in (
+    ExportTable("news", "id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, "
+                "moderation_status, expires_at, source_id", "published_at", "published_at, id"),
+    ExportTable("users", "id, username, first_name, last_name, created_at, is_admin, last_active, language, auto_notifications, "
+                "digest_frequency, is_premium, premium_expires_at, level, inviter_id, telegram_id", "created_at", "id"),
+    # Порядок переглядів не потрібен, а сортування всієї таблиці затримало б перший рядок до кінця сортування
+    ExportTable("user_news_views", "user_id, news_id, news_published_at, viewed_at", "news_published_at"),
+)}
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+class ExportSlot:
+    def __init__(self, exporter: "Exporter"):
+        self._exporter = exporter
+        self._released = False
+
+    def release(self):
+        # Викликається і з потоку, і з фонового завдання відповіді; звільняє слот лише раз
+        if not self._released:
+            self._released = True
+            self._exporter.active -= 1
+
+class Exporter:
+    def __init__(self, fetch_size: int, max_concurrent: int):
+        self.fetch_size = fetch_size
+        self.max_concurrent = max_concurrent
+        self.conninfo: Optional[str] = None
+        self.active = 0
+
+    def acquire(self) -> Optional[ExportSlot]:
+        """Бронює слот вивантаження; None, якщо вже йде EXPORT_MAX_CONCURRENT вивантажень."""
+        if self.active >= self.max_concurrent:
+            return None
+        self.active += 1
+        return ExportSlot(self)
+
+    async def _rows(self, table: ExportTable, since: Optional[datetime]) -> AsyncIterator[tuple]:
+        async with await psycopg.AsyncConnection.connect(self.conninfo) as conn:
+            await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            # Дамп великої таблиці триває довше за звичайний statement_timeout
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            async with conn.cursor(name="data_export") as cur:
+                cur.itersize = self.fetch_size
+                where = f"WHERE {table.since_column} >= %s" if since else ""
+                order_by = f"ORDER BY {table.order_by}" if table.order_by else ""
+                await cur.execute(f"SELECT {table.columns} FROM {table.name} {where} {order_by}",
+                                  (since,) if since else None)
+                async for row in cur:
+                    yield row
+
+    async def stream(self, slot: ExportSlot, name: str, fmt: str, compress: bool, since: Optional[datetime] = None) -> AsyncIterator[bytes]:
+        table = TABLES[name]
+        compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31 — формат gzip
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        columns = table.column_names
+        if writer:
+            writer.writerow(columns)
+        rows = 0
+        try:
+            async for row in self._rows(table, since):
+                rows += 1
+                if writer:
+                    writer.writerow([_csv_value(value) for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default))
+                    buffer.write("\n")
+                if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                    chunk = buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                    yield compressor.compress(chunk) if compressor else chunk
+            chunk = buffer.getvalue().encode("utf-8")
+            yield compressor.compress(chunk) + compressor.flush() if compressor else chunk
+            logger.info(f"Вивантаження {name} ({fmt}{', gzip' if compress else ''}) завершено: {rows} рядків.")
+        finally:
+            slot.release()
+
+exporter = Exporter(EXPORT_FETCH_SIZE, EXPORT_MAX_CONCURRENT)
+
+def setup(conninfo: str):
+    exporter.conninfo = conninfo
@@ -0,0 +1,140 @@
+"""Індивідуальний розклад дайджестів новин.
+
+Для кожного користувача з увімкненими автосповіщеннями в users.digest_next_run зберігається час наступного
+дайджесту. DigestScheduler спить до найближчого з них, забирає користувачів, чий час настав, пачками через
+FOR UPDATE SKIP LOCKED (кілька екземплярів бота не візьмуть того самого користувача) і в тій самій транзакції
+переносить їм digest_next_run на наступний запуск та ставить у чергу jobs завдання "digest". Надсилають
+дайджести воркери черги, тож невдала відправка повторюється, а не губиться.
+
+Розклад будується з digest_frequency: hourly, daily, weekly або custom (cron-вираз з digest_cron), у
+часовому поясі користувача. Хвилина й секунда запуску залежать від id користувача, тож дайджести
+одного розкладу розподілені по годині, а не надсилаються всім в одну мить.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from croniter import croniter
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import jobs
+
+logger = logging.getLogger(__name__)
+
+DIGEST_DEFAULT_TIMEZONE = os.getenv("DIGEST_DEFAULT_TIMEZONE", "Europe/Kyiv") # Часовий пояс користувачів, які його не вказали
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "9")) # Година (місцевий час) щоденних і щотижневих дайджестів
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "100")) # Скільки користувачів забирати за один запит
+DIGEST_MAX_SLEEP = float(os.getenv("DIGEST_MAX_SLEEP", "60")) # Найдовший сон між перевірками, щоб помітити нові розклади
+DIGEST_MIN_INTERVAL = timedelta(hours=1) # Найменший дозволений інтервал між дайджестами для власного cron-виразу
+
+FREQUENCIES = ("hourly", "daily", "weekly", "custom")
+
+def resolve_timezone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DIGEST_DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DIGEST_DEFAULT_TIMEZONE)
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+def validate_cron(expression: str) -> Optional[str]:
+    """None, якщо вираз можна використати як розклад; інакше — текст помилки для користувача."""
+    if not croniter.is_valid(expression) or len(expression.split()) != 5:
+        return "Некоректний cron-вираз. Приклад: 0 8 * * 1-5 (о 8:00 у будні)."
+    runs = croniter(expression, datetime.now(timezone.utc))
+    first = runs.get_next(datetime)
+    if runs.get_next(datetime) - first < DIGEST_MIN_INTERVAL:
+        return "Дайджест можна надсилати не частіше ніж раз на годину."
+    return None
+
+def schedule_expression(user_id: int, frequency: Optional[str], cron: Optional[str]) -> str:
+    minute = user_id % 60 # Розподіляємо користувачів одного розкладу по хвилинах години
+    if frequency == "hourly":
+        return f"{minute} * * * *"
+    if frequency == "weekly":
+        return f"{minute} {DIGEST_HOUR} * * 1"
+    if frequency == "custom" and cron and croniter.is_valid(cron):
+        return cron
+    return f"{minute} {DIGEST_HOUR} * * *"
+
+def next_run(user: Dict[str, Any], after: datetime) -> datetime:
+    """Наступний запуск після after для рядка users (id, digest_frequency, digest_cron, digest_timezone)."""
+    tz = resolve_timezone(user.get("digest_timezone"))
+    expression = schedule_expression(user["id"], user.get("digest_frequency"), user.get("digest_cron"))
+    run_at = croniter(expression, after.astimezone(tz)).get_next(datetime)
+    # Секунду запуску теж розподіляємо за id; власний cron-вираз за хвилинами не зсувається
+    return run_at.astimezone(timezone.utc) + timedelta(seconds=(user["id"] // 60) % 60)
+
+SCHEDULE_COLUMNS = "id, language, digest_frequency, digest_cron, digest_timezone"
+
+class DigestScheduler:
+    def __init__(self, get_pool: Callable[[], Awaitable[AsyncConnectionPool]], batch_size: int):
+        self.get_pool = get_pool
+        self.batch_size = batch_size
+
+    async def _claim(self, where: str, enqueue: bool) -> List[Dict[str, Any]]:
+        """Забирає пачку користувачів і в тій самій транзакції переносить їм digest_next_run на наступний запуск."""
+        now = datetime.now(timezone.utc)
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(f"""
+                    SELECT {SCHEDULE_COLUMNS} FROM users
+                    WHERE auto_notifications AND {where}
+                    ORDER BY digest_next_run NULLS FIRST LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                """, (self.batch_size,))
+                users = await cur.fetchall()
+                if users:
+                    await cur.execute("""
+                        UPDATE users u SET digest_next_run = v.next_run
+                        FROM unnest(%s::bigint[], %s::timestamptz[]) AS v(id, next_run) WHERE u.id = v.id
+                    """, ([u["id"] for u in users], [next_run(u, now) for u in users]))
+                    if enqueue:
+                        await jobs.queue.enqueue_many(cur, "digest", [{"user_id": u["id"]} for u in users],
+                                                      dedupe_key=lambda payload: f"digest:{payload['user_id']}")
+        return users
+
+    async def schedule_missing(self) -> int:
+        """Розраховує розклад користувачам, які щойно ввімкнули сповіщення або змінили частоту."""
+        return len(await self._claim("digest_next_run IS NULL", enqueue=False))
+
+    async def run_due(self) -> int:
+        """Ставить у чергу дайджести для пачки користувачів, чий час настав; повертає їх кількість."""
+        return len(await self._claim("digest_next_run <= now()", enqueue=True))
+
+    async def seconds_until_next(self) -> float:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("SELECT EXTRACT(EPOCH FROM MIN(digest_next_run) - now()) FROM users WHERE auto_notifications")
+            seconds = (await cur.fetchone())[0]
+        return DIGEST_MAX_SLEEP if seconds is None else min(max(float(seconds), 0.0), DIGEST_MAX_SLEEP)
+
+    async def run(self):
+        while True:
+            try:
+                while await self.schedule_missing() == self.batch_size:
+                    pass
+                # Повна пачка означає, що черга ще не розібрана, тож одразу беремо наступну
+                if await self.run_due() == self.batch_size:
+                    continue
+                delay = await self.seconds_until_next()
+            except Exception as e:
+                logger.error(f"Помилка в планувальнику дайджестів: {e}")
+                delay = DIGEST_MAX_SLEEP
+            await asyncio.sleep(delay)
+
+scheduler: Optional[DigestScheduler] = None
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]]):
+    global scheduler
+    scheduler = DigestScheduler(get_pool, DIGEST_BATCH_SIZE)
@@ -0,0 +1,274 @@
+"""Черга фонових завдань у таблиці jobs.
+
+Завдання ставляться в чергу через enqueue() (можна в чужій транзакції — тоді воно з'явиться лише після її
+коміту) і виконуються пулом воркерів JobQueue.run() на кожному екземплярі бота. Воркери забирають готові
+завдання через FOR UPDATE SKIP LOCKED у порядку пріоритету та run_at, тож одне завдання не виконається двічі.
+
+Обробник реєструється декоратором @queue.handler("вид"). Виняток в обробнику означає повторну спробу з
+експоненційною затримкою (або не раніше retry_after, якщо виняток його має, як TelegramRetryAfter); після
+max_attempts спроб завдання отримує статус dead і лишається в таблиці для розбору. Завдання, чий воркер
+зник, повертаються в чергу після закінчення оренди locked_until. Для періодичних завдань (every=секунд)
+наступний запуск ставиться в чергу тим самим воркером одразу після завершення попереднього.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4")) # Скільки завдань виконує один екземпляр одночасно
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1")) # Як часто перевіряти чергу, коли вона порожня, секунд
+JOBS_LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", "600")) # Найдовше виконання завдання; після цього воно вважається покинутим
+JOBS_RETRY_BASE = float(os.getenv("JOBS_RETRY_BASE", "10")) # Затримка першої повторної спроби, секунд (далі подвоюється)
+JOBS_RETRY_MAX = float(os.getenv("JOBS_RETRY_MAX", "3600")) # Найбільша затримка між спробами, секунд
+JOBS_RETENTION_HOURS = int(os.getenv("JOBS_RETENTION_HOURS", "24")) # Скільки зберігати виконані завдання (dead — у 7 разів довше)
+
+DEFAULT_PRIORITY = 100
+REAP_INTERVAL = 30 # Як часто повертати в чергу завдання з простроченою орендою, секунд
+
+JOB_INSERT_SQL = """
+    INSERT INTO jobs (kind, payload, priority, run_at, max_attempts, dedupe_key)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running') DO NOTHING
+"""
+
+class JobHandler:
+    def __init__(self, kind: str, func: Callable[[Dict[str, Any]], Awaitable[None]], priority: int, max_attempts: int,
+                 every: Optional[float]):
+        self.kind = kind
+        self.func = func
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+
+class JobQueue:
+    def __init__(self, concurrency: int, poll_interval: float, lease_seconds: int):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self.handlers: Dict[str, JobHandler] = {}
+        self._running: set = set()
+        self._slot_freed = asyncio.Event()
+        self._last_reap = 0.0
+
+    def handler(self, kind: str, priority: int = DEFAULT_PRIORITY, max_attempts: int = 5, every: Optional[float] = None):
+        def decorator(func: Callable[[Dict[str, Any]], Awaitable[None]]):
+            self.handlers[kind] = JobHandler(kind, func, priority, max_attempts, every)
+            return func
+        return decorator
+
+    def _row(self, kind: str, payload: Optional[Dict[str, Any]], priority: Optional[int], run_at: Optional[datetime],
+             dedupe_key: Optional[str]) -> tuple:
+        handler = self.handlers.get(kind)
+        if priority is None:
+            priority = handler.priority if handler else DEFAULT_PRIORITY
+        return (kind, Jsonb(payload or {}), priority, run_at or datetime.now(timezone.utc),
+                handler.max_attempts if handler else 5, dedupe_key)
+
+    async def enqueue(self, kind: str, payload: Optional[Dict[str, Any]] = None, *, priority: Optional[int] = None,
+                      run_at: Optional[datetime] = None, delay: float = 0, dedupe_key: Optional[str] = None,
+                      cur: Optional[psycopg.AsyncCursor] = None):
+        """Ставить завдання в чергу; з cur — у транзакції викликача, інакше окремим запитом."""
+        if delay:
+            run_at = (run_at or datetime.now(timezone.utc)) + timedelta(seconds=delay)
+        row = self._row(kind, payload, priority, run_at, dedupe_key)
+        if cur is not None:
+            await cur.execute(JOB_INSERT_SQL, row)
+            return
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(JOB_INSERT_SQL, row)
+
+    async def enqueue_many(self, cur: psycopg.AsyncCursor, kind: str, payloads: Iterable[Dict[str, Any]],
+                           dedupe_key: Optional[Callable[[Dict[str, Any]], str]] = None):
+        rows = [self._row(kind, payload, None, None, dedupe_key(payload) if dedupe_key else None) for payload in payloads]
+        if rows:
+            await cur.executemany(JOB_INSERT_SQL, rows)
+
+    async def ensure_periodic(self):
+        """Ставить у чергу перший запуск кожного періодичного завдання, якщо його там ще немає."""
+        for handler in self.handlers.values():
+            if handler.every:
+                await self.enqueue(handler.kind, dedupe_key=f"periodic:{handler.kind}")
+
+    async def _claim(self, limit: int, kinds: List[str]) -> List[Dict[str, Any]]:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                                    locked_until = now() + make_interval(secs => %s), started_at = now()
+                    WHERE id IN (
+                        SELECT id FROM jobs WHERE status = 'queued' AND run_at <= now() AND kind = ANY(%s)
+                        ORDER BY priority, run_at LIMIT %s FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, kind, payload, attempts, max_attempts, dedupe_key, EXTRACT(EPOCH FROM now() - run_at) AS latency
+                """, (self.worker_id, self.lease_seconds, kinds, limit))
+                return await cur.fetchall()
+
+    async def _reap(self):
+        """Повертає в чергу завдання, чий воркер зник, не завершивши їх до кінця оренди."""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                                last_error = 'Оренду прострочено (воркер зупинився?)', locked_by = NULL, locked_until = NULL,
+                                finished_at = CASE WHEN attempts >= max_attempts THEN now() END
+                WHERE status = 'running' AND locked_until < now()
+            """)
+            if cur.rowcount:
+                logger.warning(f"Повернуто в чергу завдань із простроченою орендою: {cur.rowcount}.")
+
+    @staticmethod
+    def retry_delay(error: BaseException, attempts: int) -> float:
+        backoff = min(JOBS_RETRY_BASE * 2 ** (attempts - 1), JOBS_RETRY_MAX)
+        backoff *= random.uniform(0.8, 1.2) # Розкид, щоб повтори не збігалися в часі
+        return max(backoff, float(getattr(error, "retry_after", 0) or 0))
+
+    async def _finish(self, job: Dict[str, Any], error: Optional[BaseException]):
+        handler = self.handlers[job["kind"]]
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                if error is None:
+                    await cur.execute("UPDATE jobs SET status = 'done', finished_at = now(), locked_until = NULL WHERE id = %s", (job["id"],))
+                elif job["attempts"] >= job["max_attempts"]:
+                    await cur.execute("UPDATE jobs SET status = 'dead', finished_at = now(), locked_until = NULL, last_error = %s WHERE id = %s",
+                                      (repr(error)[:2000], job["id"]))
+                else:
+                    await cur.execute("""
+                        UPDATE jobs SET status = 'queued', run_at = now() + make_interval(secs => %s), locked_by = NULL,
+                                        locked_until = NULL, last_error = %s
+                        WHERE id = %s
+                    """, (self.retry_delay(error, job["attempts"]), repr(error)[:2000], job["id"]))
+                    return
+                # Періодичне завдання: наступний запуск ставимо в тій самій транзакції, що й завершення поточного
+                if handler.every and job["dedupe_key"]:
+                    await self.enqueue(handler.kind, delay=handler.every, dedupe_key=job["dedupe_key"], cur=cur)
+
+    async def _execute(self, job: Dict[str, Any]):
+        handler = self.handlers[job["kind"]]
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            await asyncio.wait_for(handler.func(job["payload"]), self.lease_seconds)
+        except Exception as e:
+            error = e
+            level = logging.ERROR if job["attempts"] >= job["max_attempts"] else logging.WARNING
+            logger.log(level, f"Завдання {job['kind']} #{job['id']} (спроба {job['attempts']}/{job['max_attempts']}) завершилося помилкою: {e!r}")
+        result = "ok" if error is None else ("dead" if job["attempts"] >= job["max_attempts"] else "retry")
+        metrics.observe_job(job["kind"], result, time.perf_counter() - started, float(job["latency"] or 0))
+        try:
+            await self._finish(job, error)
+        except Exception as e:
+            # Не вдалося записати результат: після закінчення оренди завдання повернеться в чергу
+            logger.error(f"Не вдалося зберегти результат завдання #{job['id']}: {e}")
+
+    def _on_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._slot_freed.set()
+
+    async def run_once(self, kinds: Optional[Iterable[str]] = None) -> int:
+        """Забирає стільки готових завдань, скільки є вільних слотів, і запускає їх; повертає кількість."""
+        if time.monotonic() - self._last_reap >= REAP_INTERVAL:
+            self._last_reap = time.monotonic()
+            await self._reap()
+            # Періодичне завдання, яке стало dead через прострочену оренду, інакше більше не запуститься
+            await self.ensure_periodic()
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        claimed = await self._claim(free, list(kinds or self.handlers))
+        for job in claimed:
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._on_done)
+        return len(claimed)
+
+    async def run(self):
+        while True:
+            self._slot_freed.clear()
+            try:
+                if await self.run_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Помилка воркера черги завдань: {e}")
+            # Чекаємо, доки звільниться слот або мине інтервал опитування
+            try:
+                await asyncio.wait_for(self._slot_freed.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, kinds: Optional[Iterable[str]] = None):
+        """Виконує готові завдання вказаних видів до спорожніння черги (для бенчмарків і ручного запуску)."""
+        kinds = list(kinds or self.handlers)
+        while await self.run_once(kinds) or self._running:
+            if self._running:
+                await asyncio.wait(set(self._running), return_when=asyncio.FIRST_COMPLETED)
+
+    async def stats(self) -> Dict[str, Any]:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("""
+                    SELECT kind, status, COUNT(*) AS count,
+                           EXTRACT(EPOCH FROM now() - MIN(run_at)) FILTER (WHERE status = 'queued' AND run_at <= now()) AS oldest_ready_seconds
+                    FROM jobs WHERE status IN ('queued', 'running') OR (status = 'dead' AND finished_at > now() - INTERVAL '1 day')
+                    GROUP BY kind, status ORDER BY kind, status
+                """)
+                depth = await cur.fetchall()
+                await cur.execute("""
+                    SELECT kind, COUNT(*) AS done,
+                           AVG(EXTRACT(EPOCH FROM started_at - run_at)) AS avg_latency_seconds,
+                           PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM started_at - run_at)) AS p95_latency_seconds,
+                           AVG(EXTRACT(EPOCH FROM finished_at - started_at)) AS avg_duration_seconds
+                    FROM jobs WHERE status = 'done' AND finished_at > now() - INTERVAL '1 hour'
+                    GROUP BY kind ORDER BY kind
+                """)
+                latency = await cur.fetchall()
+                await cur.execute("""
+                    SELECT id, kind, payload, attempts, last_error, finished_at FROM jobs
+                    WHERE status = 'dead' ORDER BY finished_at DESC LIMIT 20
+                """)
+                dead = await cur.fetchall()
+        return {"worker_id": self.worker_id, "running_here": len(self._running), "depth": depth, "latency_last_hour": latency, "recent_dead": dead}
+
+    async def retry_dead(self, job_id: int) -> bool:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                UPDATE jobs SET status = 'queued', run_at = now(), attempts = 0, finished_at = NULL
+                WHERE id = %s AND status = 'dead'
+            """, (job_id,))
+            return cur.rowcount > 0
+
+    async def cleanup(self):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            await conn.execute("""
+                DELETE FROM jobs WHERE (status = 'done' AND finished_at < now() - make_interval(hours => %s))
+                                    OR (status = 'dead' AND finished_at < now() - make_interval(hours => %s))
+            """, (JOBS_RETENTION_HOURS, JOBS_RETENTION_HOURS * 7))
+
+queue = JobQueue(JOBS_CONCURRENCY, JOBS_POLL_INTERVAL, JOBS_LEASE_SECONDS)
+
+@queue.handler("jobs.cleanup", priority=200, every=3600)
+async def cleanup_jobs(payload: Dict[str, Any]):
+    await queue.cleanup()
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]]):
+    queue.get_pool = get_pool
@@ -0,0 +1,106 @@
+"""Вибір лідера для фонових завдань, які мають виконуватися лише на одному екземплярі бота.
+
+Кожне зареєстроване завдання захищене session-level advisory-lock на окремому з'єднанні LeaderElection.
+Екземпляр, який узяв лок, запускає завдання; інші раз на LEADER_CHECK_INTERVAL секунд пробують узяти
+лок і підхоплюють завдання, щойно лідер зникне: при падінні процесу Postgres звільняє локи разом із
+з'єднанням, а TCP keepalive обмежує час виявлення обриву мережі. Лідер так само регулярно перевіряє своє
+з'єднання і, втративши його, зупиняє свої завдання, перш ніж їх підхопить хтось інший.
+"""
+import asyncio
+import logging
+import os
+import zlib
+from typing import Awaitable, Callable, Dict, Optional
+
+import psycopg
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", "5")) # Як часто перевіряти з'єднання та пробувати взяти вільні локи, секунд
+LEADER_LOCK_NAMESPACE = 106_040 # Перший ключ advisory-lock; другий — контрольна сума назви завдання
+
+class LeaderElection:
+    def __init__(self, conninfo: str, check_interval: float):
+        self.conninfo = conninfo
+        self.check_interval = check_interval
+        self.jobs: Dict[str, Callable[[], Awaitable[None]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[asyncio.Task] = None
+
+    def register(self, name: str, job: Callable[[], Awaitable[None]]):
+        self.jobs[name] = job
+
+    def is_leader(self, name: str) -> bool:
+        return name in self._tasks
+
+    def stats(self) -> Dict[str, bool]:
+        return {name: self.is_leader(name) for name in self.jobs}
+
+    @staticmethod
+    def lock_key(name: str) -> int:
+        return zlib.crc32(name.encode("utf-8")) & 0x7FFFFFFF
+
+    async def _connect(self) -> psycopg.AsyncConnection:
+        # Keepalive: обрив мережі до БД виявляється за ~25 с, і лок лідера звільняється на боці сервера
+        return await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True, keepalives=1, keepalives_idle=10,
+                                                     keepalives_interval=5, keepalives_count=3)
+
+    async def _tick(self, conn: psycopg.AsyncConnection):
+        await asyncio.wait_for(conn.execute("SELECT 1"), self.check_interval)
+        for name, job in self.jobs.items():
+            task = self._tasks.get(name)
+            if task is not None:
+                if not task.done():
+                    continue
+                # Цикл завдання не повинен завершуватися; якщо це сталося, віддаємо лок іншим екземплярам
+                del self._tasks[name]
+                logger.error(f"Фонове завдання {name} несподівано завершилося: {task.exception() if not task.cancelled() else 'скасовано'}")
+                await conn.execute("SELECT pg_advisory_unlock(%s, %s)", (LEADER_LOCK_NAMESPACE, self.lock_key(name)))
+                continue
+            cur = await conn.execute("SELECT pg_try_advisory_lock(%s, %s)", (LEADER_LOCK_NAMESPACE, self.lock_key(name)))
+            if (await cur.fetchone())[0]:
+                logger.info(f"Цей екземпляр тепер виконує фонове завдання {name}.")
+                self._tasks[name] = asyncio.create_task(job(), name=f"leader:{name}")
+
+    def _stop_jobs(self):
+        for name, task in self._tasks.items():
+            task.cancel()
+            logger.warning(f"Фонове завдання {name} зупинено: цей екземпляр більше не лідер.")
+        self._tasks.clear()
+
+    async def run(self):
+        while True:
+            try:
+                async with await self._connect() as conn:
+                    while True:
+                        await self._tick(conn)
+                        await asyncio.sleep(self.check_interval)
+            except Exception as e:
+                logger.error(f"Втрачено з'єднання для вибору лідера: {e}")
+            finally:
+                self._stop_jobs()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        self._runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Зупиняє завдання й закриває з'єднання, щоб інший екземпляр підхопив їх без очікування."""
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+
+elector: Optional[LeaderElection] = None
+
+def setup(conninfo: str) -> LeaderElection:
+    global elector
+    elector = LeaderElection(conninfo, LEADER_CHECK_INTERVAL)
+    metrics.register_stats(metrics.LeaderStatsCollector(elector.stats))
+    return elector
@@ -0,0 +1,84 @@
+"""Налаштування логування.
+
+Записи з усіх логерів кладуться в чергу (QueueHandler), а форматування та запис у stdout
+виконує окремий потік (QueueListener), тож цикл подій не чекає на I/O.
+LOG_FORMAT=json вмикає структурований вивід (один JSON-об'єкт на рядок), LOG_LEVEL задає рівень.
+Для подій з великим потоком можна передати extra={"sample_rate": LOG_SAMPLE_RATE}:
+такий запис потрапить у лог лише з цією ймовірністю.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # text або json
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01")) # Частка записів, що логуються для подій з великим потоком
+# aiogram пише INFO-рядок на кожне оновлення; тривалість обробки вже є в метриках
+AIOGRAM_EVENT_LOG_LEVEL = os.getenv("AIOGRAM_EVENT_LOG_LEVEL", "WARNING").upper()
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Стандартні атрибути LogRecord; усе інше в записі — поля, передані через extra
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "sample_rate"}
+
+_listener: Optional[QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        return rate is None or random.random() < rate
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler, який не форматує запис у потоці, що логує.
+
+    Стандартний prepare() одразу підставляє аргументи в повідомлення; тут це робить потік QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("aiogram.event").setLevel(AIOGRAM_EVENT_LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
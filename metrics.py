@@ -0,0 +1,190 @@
+"""Метрики Prometheus для бота (ендпоінт /metrics).
+
+Інструментування підключається в одному місці: декоратор track_ai для ai_*-функцій,
+aiogram-middleware для хендлерів і запитів до Bot API, підклас пулу БД для часу очікування з'єднання.
+При METRICS_ENABLED=0 middleware не реєструються, а функції observe_* одразу повертаються — накладні
+витрати зводяться до перевірки прапорця. track_ai і тоді запам'ятовує назву функції: за нею рахує
+запити до AI статистика адмінської панелі (stats_rollup).
+
+Доступ до /metrics обмежують METRICS_TOKEN (заголовок Authorization: Bearer <токен>) та
+METRICS_ALLOWED_IPS (список адрес або мереж); без жодного з них ендпоінт відкритий, як і раніше.
+"""
+import contextvars
+import functools
+import hmac
+import ipaddress
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from psycopg_pool import AsyncConnectionPool
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # Якщо задано, /metrics вимагає Authorization: Bearer <токен>
+METRICS_ALLOWED_IPS = [ipaddress.ip_network(net.strip(), strict=False) for net in os.getenv("METRICS_ALLOWED_IPS", "").split(",") if net.strip()] # Адреси або мережі, яким дозволено /metrics
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry = CollectorRegistry()
+
+gemini_request_seconds = Histogram("gemini_request_seconds", "Тривалість запиту до Gemini", ["function"], buckets=LATENCY_BUCKETS, registry=registry)
+gemini_requests_total = Counter("gemini_requests_total", "Кількість запитів до Gemini за результатом", ["function", "status"], registry=registry)
+db_pool_wait_seconds = Histogram("db_pool_checkout_wait_seconds", "Час очікування з'єднання з пулу БД", buckets=LATENCY_BUCKETS, registry=registry)
+handler_seconds = Histogram("telegram_handler_seconds", "Тривалість обробки оновлення хендлером", ["handler"], buckets=LATENCY_BUCKETS, registry=registry)
+handler_errors_total = Counter("telegram_handler_errors_total", "Кількість винятків у хендлерах", ["handler"], registry=registry)
+webhook_parse_seconds = Histogram("webhook_parse_seconds", "Час читання й розбору тіла вебхука до передачі оновлення диспетчеру", buckets=LATENCY_BUCKETS, registry=registry)
+telegram_api_errors_total = Counter("telegram_api_errors_total", "Помилки запитів до Telegram Bot API", ["method", "error"], registry=registry)
+ai_queue_wait_seconds = Histogram("ai_queue_wait_seconds", "Час очікування слоту планувальника AI", ["lane"], buckets=LATENCY_BUCKETS, registry=registry)
+ai_rejections_total = Counter("ai_rejections_total", "AI-запити, відхилені планувальником", ["reason"], registry=registry)
+push_notifications_total = Counter("push_notifications_total", "Миттєві сповіщення про новини за результатом", ["result"], registry=registry)
+jobs_total = Counter("jobs_total", "Виконані завдання черги за результатом", ["kind", "result"], registry=registry)
+job_seconds = Histogram("job_seconds", "Тривалість виконання завдання черги", ["kind"], buckets=LATENCY_BUCKETS, registry=registry)
+job_queue_latency_seconds = Histogram("job_queue_latency_seconds", "Затримка від run_at до початку виконання завдання", ["kind"], buckets=LATENCY_BUCKETS, registry=registry)
+
+# Назва ai_*-функції, з якої зроблено поточний запит до Gemini
+_ai_function: contextvars.ContextVar[str] = contextvars.ContextVar("ai_function", default="other")
+
+def track_ai(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _ai_function.set(func.__name__)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _ai_function.reset(token)
+    return wrapper
+
+def current_ai_function() -> str:
+    return _ai_function.get()
+
+def observe_gemini(status: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    function = _ai_function.get()
+    gemini_request_seconds.labels(function).observe(seconds)
+    gemini_requests_total.labels(function, status).inc()
+
+def observe_webhook_parse(seconds: float):
+    if METRICS_ENABLED:
+        webhook_parse_seconds.observe(seconds)
+
+def observe_ai_queue(lane: str, seconds: float):
+    if METRICS_ENABLED:
+        ai_queue_wait_seconds.labels(lane).observe(seconds)
+
+def count_ai_rejection(reason: str):
+    if METRICS_ENABLED:
+        ai_rejections_total.labels(reason).inc()
+
+def count_push(result: str):
+    if METRICS_ENABLED:
+        push_notifications_total.labels(result).inc()
+
+def observe_job(kind: str, result: str, seconds: float, latency: float):
+    if not METRICS_ENABLED:
+        return
+    jobs_total.labels(kind, result).inc()
+    job_seconds.labels(kind).observe(seconds)
+    job_queue_latency_seconds.labels(kind).observe(latency)
+
+class InstrumentedConnectionPool(AsyncConnectionPool):
+    async def getconn(self, timeout: Optional[float] = None):
+        started = time.perf_counter()
+        try:
+            return await super().getconn(timeout=timeout)
+        finally:
+            db_pool_wait_seconds.observe(time.perf_counter() - started)
+
+class PoolStatsCollector:
+    """Знімає стан пулу лише під час запиту /metrics, не торкаючись гарячого шляху."""
+
+    def __init__(self, get_pool: Callable[[], Optional[AsyncConnectionPool]]):
+        self._get_pool = get_pool
+
+    def collect(self):
+        pool = self._get_pool()
+        if pool is None:
+            return
+        stats = pool.get_stats()
+        yield GaugeMetricFamily("db_pool_size", "Кількість з'єднань у пулі", value=stats.get("pool_size", 0))
+        yield GaugeMetricFamily("db_pool_available", "Вільні з'єднання в пулі", value=stats.get("pool_available", 0))
+        yield GaugeMetricFamily("db_pool_requests_waiting", "Запити, що чекають на з'єднання", value=stats.get("requests_waiting", 0))
+        yield GaugeMetricFamily("db_pool_in_use", "З'єднання, що зараз використовуються", value=stats.get("pool_size", 0) - stats.get("pool_available", 0))
+
+class AISchedulerStatsCollector:
+    """Кількість активних і запитів у черзі планувальника AI за смугами, на момент запиту /metrics."""
+
+    def __init__(self, get_stats: Callable[[], Dict[str, Dict[str, int]]]):
+        self._get_stats = get_stats
+
+    def collect(self):
+        stats = self._get_stats()
+        for name, help_text in (("active", "AI-запити, що виконуються"), ("queued", "AI-запити, що чекають на слот")):
+            family = GaugeMetricFamily(f"ai_scheduler_{name}", help_text, labels=["lane"])
+            for lane, value in stats[name].items():
+                family.add_metric([lane], value)
+            yield family
+
+class LeaderStatsCollector:
+    """1 для фонових завдань, які зараз виконує цей екземпляр (див. leader.py), 0 для решти."""
+
+    def __init__(self, get_stats: Callable[[], Dict[str, bool]]):
+        self._get_stats = get_stats
+
+    def collect(self):
+        family = GaugeMetricFamily("background_job_leader", "Чи виконує цей екземпляр фонове завдання", labels=["job"])
+        for job, leading in self._get_stats().items():
+            family.add_metric([job], 1 if leading else 0)
+        yield family
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors_total.labels(name).inc()
+            raise
+        finally:
+            handler_seconds.labels(name).observe(time.perf_counter() - started)
+
+class TelegramErrorsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_api_errors_total.labels(type(method).__name__, type(e).__name__).inc()
+            raise
+
+def setup(router, bot, get_pool: Callable[[], Optional[AsyncConnectionPool]]):
+    if not METRICS_ENABLED:
+        return
+    router.message.middleware(HandlerMetricsMiddleware())
+    router.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(TelegramErrorsMiddleware())
+    registry.register(PoolStatsCollector(get_pool))
+
+def register_stats(collector):
+    if METRICS_ENABLED:
+        registry.register(collector)
+
+def authorized(client_host: Optional[str], authorization: Optional[str]) -> bool:
+    """Чи можна віддати /metrics цьому клієнту згідно з METRICS_TOKEN і METRICS_ALLOWED_IPS."""
+    if METRICS_TOKEN and not hmac.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return False
+    if METRICS_ALLOWED_IPS:
+        try:
+            address = ipaddress.ip_address(client_host or "")
+        except ValueError:
+            return False
+        return any(address in network for network in METRICS_ALLOWED_IPS)
+    return True
+
+def render() -> bytes:
+    return generate_latest(registry)
@@ -0,0 +1,143 @@
+"""Версіоновані міграції схеми БД.
+
+Міграції лежать у каталозі migrations/ як файли NNNN_назва.sql і застосовуються по черзі.
+Застосовані версії та їх контрольні суми зберігаються в таблиці schema_migrations.
+Якщо схема вже актуальна, запуск обмежується одним SELECT без жодного DDL.
+
+Файл з рядком "-- migrate:no-transaction" виконується поза транзакцією, по одному оператору
+(потрібно для CREATE INDEX CONCURRENTLY); кожен оператор у такому файлі закінчується ";" в кінці рядка.
+
+Запуск вручну: python migrate.py
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List
+
+import psycopg
+from psycopg.rows import dict_row
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+MIGRATION_LOCK_ID = 106_028 # Ключ advisory lock, під яким застосовуються міграції
+LOCK_POLL_INTERVAL = 1.0
+
+class MigrationError(Exception):
+    pass
+
+class Migration:
+    def __init__(self, version: int, name: str, sql_text: str):
+        self.version = version
+        self.name = name
+        self.sql_text = sql_text
+        # Контрольна сума не залежить від закінчень рядків (CRLF/LF) у робочій копії
+        self.checksum = hashlib.sha256(sql_text.replace("\r\n", "\n").encode("utf-8")).hexdigest()
+        self.transactional = NO_TRANSACTION_MARKER not in sql_text
+
+    def statements(self) -> List[str]:
+        parts = re.split(r";[ \t]*\r?\n", self.sql_text.rstrip().rstrip(";") + ";\n")
+        statements = []
+        for part in parts:
+            code = "\n".join(line for line in part.splitlines() if not line.strip().startswith("--")).strip()
+            if code:
+                statements.append(code)
+        return statements
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for path in sorted(directory.glob("*.sql")):
+        match = MIGRATION_FILE_RE.match(path.name)
+        if not match:
+            raise MigrationError(f"Некоректна назва файлу міграції: {path.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path.read_text(encoding="utf-8")))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("Знайдено кілька міграцій з однаковою версією.")
+    return migrations
+
+async def get_applied_migrations(conn: psycopg.AsyncConnection) -> Dict[int, Dict]:
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute("SELECT to_regclass('public.schema_migrations') IS NOT NULL AS present")
+        if not (await cur.fetchone())['present']:
+            return {}
+        await cur.execute("SELECT version, name, checksum FROM schema_migrations")
+        return {r['version']: r for r in await cur.fetchall()}
+
+def verify_checksums(migrations: List[Migration], applied: Dict[int, Dict]):
+    for m in migrations:
+        rec = applied.get(m.version)
+        if rec and rec['checksum'] != m.checksum:
+            raise MigrationError(f"Міграцію {m.version}_{m.name} змінено після застосування (контрольна сума не збігається).")
+
+async def acquire_migration_lock(conn: psycopg.AsyncConnection):
+    # pg_try_advisory_lock у циклі замість блокуючого pg_advisory_lock: сесія, що чекає,
+    # не тримає знімок, на який інакше чекав би CREATE INDEX CONCURRENTLY власника блокування.
+    while True:
+        cur = await conn.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if (await cur.fetchone())[0]:
+            return
+        logger.info("Міграції застосовує інший процес, очікування...")
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+async def apply_migration(conn: psycopg.AsyncConnection, migration: Migration):
+    logger.info(f"Застосування міграції {migration.version}_{migration.name}...")
+    record_sql = "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)"
+    record_params = (migration.version, migration.name, migration.checksum)
+    if migration.transactional:
+        async with conn.transaction():
+            await conn.execute(migration.sql_text)
+            await conn.execute(record_sql, record_params)
+    else:
+        for statement in migration.statements():
+            try:
+                await conn.execute(statement)
+            except psycopg.Error as e:
+                raise MigrationError(f"Міграція {migration.version}_{migration.name} перервалася на: {statement[:200]} ({e}). "
+                                     f"Недобудовані (INVALID) індекси потрібно видалити перед повторним запуском.") from e
+        await conn.execute(record_sql, record_params)
+
+async def apply_migrations(conninfo: str) -> int:
+    """Застосовує всі незастосовані міграції та повертає їх кількість."""
+    migrations = load_migrations()
+    async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+        applied = await get_applied_migrations(conn)
+        verify_checksums(migrations, applied)
+        if all(m.version in applied for m in migrations):
+            logger.info("Схема БД актуальна, міграції не потрібні.")
+            return 0
+
+        await acquire_migration_lock(conn)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            # Поки ми чекали на блокування, частину міграцій міг застосувати інший процес
+            applied = await get_applied_migrations(conn)
+            verify_checksums(migrations, applied)
+            pending = [m for m in migrations if m.version not in applied]
+            for migration in pending:
+                await apply_migration(conn, migration)
+            logger.info(f"Застосовано міграцій: {len(pending)}.")
+            return len(pending)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from log_config import setup_logging
+
+    load_dotenv()
+    setup_logging()
+    asyncio.run(apply_migrations(os.environ["DATABASE_URL"]))
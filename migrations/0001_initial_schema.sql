@@ -1,17 +1,30 @@
--- patch_schema.sql - Скрипт для оновлення існуючої схеми бази даних, якщо schema.sql не був виконаний повністю.
-
--- Додавання/оновлення таблиці custom_feeds, якщо її немає або потрібно оновити
-CREATE TABLE IF NOT EXISTS custom_feeds (
-    id SERIAL PRIMARY KEY,
-    user_id BIGINT REFERENCES users(id),
-    feed_name TEXT NOT NULL,
-    filters JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE (user_id, feed_name)
+-- 0001: Базова схема бази даних (таблиці та стовпці, які раніше створював create_tables() при кожному запуску).
+-- Усі оператори ідемпотентні, тож міграція безпечно застосовується і до вже існуючої бази.
+
+-- Користувачі
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT PRIMARY KEY,
+    username VARCHAR(255),
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    is_admin BOOLEAN DEFAULT FALSE,
+    last_active TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    language VARCHAR(10) DEFAULT 'uk',
+    auto_notifications BOOLEAN DEFAULT FALSE,
+    digest_frequency VARCHAR(50) DEFAULT 'daily',
+    safe_mode BOOLEAN DEFAULT FALSE,
+    current_feed_id INT,
+    is_premium BOOLEAN DEFAULT FALSE,
+    premium_expires_at TIMESTAMP,
+    level INT DEFAULT 1,
+    badges TEXT[] DEFAULT ARRAY[]::TEXT[],
+    inviter_id INT,
+    email TEXT UNIQUE,
+    view_mode TEXT DEFAULT 'manual',
+    telegram_id BIGINT
 );
 
--- Додавання відсутніх стовпців до таблиці users
--- (Якщо ці стовпці вже існують, ALTER TABLE ADD COLUMN IF NOT EXISTS просто пропустить їх)
 ALTER TABLE users ADD COLUMN IF NOT EXISTS username VARCHAR(255);
 ALTER TABLE users ADD COLUMN IF NOT EXISTS first_name VARCHAR(255);
 ALTER TABLE users ADD COLUMN IF NOT EXISTS last_name VARCHAR(255);
@@ -22,17 +35,17 @@ ALTER TABLE users ADD COLUMN IF NOT EXISTS language VARCHAR(10) DEFAULT 'uk';
 ALTER TABLE users ADD COLUMN IF NOT EXISTS auto_notifications BOOLEAN DEFAULT FALSE;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_frequency VARCHAR(50) DEFAULT 'daily';
 ALTER TABLE users ADD COLUMN IF NOT EXISTS safe_mode BOOLEAN DEFAULT FALSE;
-ALTER TABLE users ADD COLUMN IF NOT EXISTS current_feed_id INT REFERENCES custom_feeds(id);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS current_feed_id INT;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS is_premium BOOLEAN DEFAULT FALSE;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS premium_expires_at TIMESTAMP;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS level INT DEFAULT 1;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS badges TEXT[] DEFAULT ARRAY[]::TEXT[];
-ALTER TABLE users ADD COLUMN IF NOT EXISTS inviter_id INT REFERENCES users(id);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS inviter_id INT;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS email TEXT UNIQUE;
 ALTER TABLE users ADD COLUMN IF NOT EXISTS view_mode TEXT DEFAULT 'manual';
-ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id BIGINT; -- Додаємо telegram_id для users.html
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id BIGINT;
 
--- Додавання/оновлення таблиці news, якщо її немає
+-- Новини
 CREATE TABLE IF NOT EXISTS news (
     id SERIAL PRIMARY KEY,
     title TEXT NOT NULL,
@@ -46,7 +59,7 @@ CREATE TABLE IF NOT EXISTS news (
     moderation_status VARCHAR(50) DEFAULT 'approved',
     expires_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days')
 );
--- Додавання відсутніх стовпців до news
+
 ALTER TABLE news ADD COLUMN IF NOT EXISTS source_url TEXT;
 ALTER TABLE news ADD COLUMN IF NOT EXISTS image_url TEXT;
 ALTER TABLE news ADD COLUMN IF NOT EXISTS ai_summary TEXT;
@@ -54,8 +67,17 @@ ALTER TABLE news ADD COLUMN IF NOT EXISTS ai_classified_topics JSONB;
 ALTER TABLE news ADD COLUMN IF NOT EXISTS moderation_status VARCHAR(50) DEFAULT 'approved';
 ALTER TABLE news ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days');
 
+-- Користувацькі стрічки (фільтри)
+CREATE TABLE IF NOT EXISTS custom_feeds (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT REFERENCES users(id),
+    feed_name TEXT NOT NULL,
+    filters JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, feed_name)
+);
 
--- Додавання/оновлення таблиці sources, якщо її немає
+-- Джерела новин
 CREATE TABLE IF NOT EXISTS sources (
     id SERIAL PRIMARY KEY,
     name TEXT UNIQUE NOT NULL,
@@ -64,7 +86,15 @@ CREATE TABLE IF NOT EXISTS sources (
     status TEXT DEFAULT 'active'
 );
 
--- Додавання/оновлення таблиці user_news_views
+-- Прив'язка новин до джерела за id (заповнюємо з наявних source_url)
+ALTER TABLE news ADD COLUMN IF NOT EXISTS source_id INT REFERENCES sources(id);
+
+UPDATE news n SET source_id = s.id
+FROM sources s
+WHERE n.source_id IS NULL
+AND (n.source_url = s.link OR n.source_url LIKE rtrim(s.link, '/') || '/%');
+
+-- Перегляди новин (партиціювання — у міграції 0002)
 CREATE TABLE IF NOT EXISTS user_news_views (
     user_id BIGINT NOT NULL REFERENCES users(id),
     news_id INTEGER NOT NULL REFERENCES news(id),
@@ -72,16 +102,17 @@ CREATE TABLE IF NOT EXISTS user_news_views (
     PRIMARY KEY (user_id, news_id)
 );
 
--- Додавання/оновлення таблиці user_stats
+-- Статистика користувачів
 CREATE TABLE IF NOT EXISTS user_stats (
     user_id BIGINT PRIMARY KEY REFERENCES users(id),
     viewed_news_count INT DEFAULT 0,
     last_active TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     viewed_topics JSONB DEFAULT '[]'::jsonb
 );
+
 ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS viewed_topics JSONB DEFAULT '[]'::jsonb;
 
--- Додавання/оновлення таблиці comments
+-- Інші таблиці
 CREATE TABLE IF NOT EXISTS comments (
     id SERIAL PRIMARY KEY,
     news_id INT REFERENCES news(id),
@@ -90,7 +121,6 @@ CREATE TABLE IF NOT EXISTS comments (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Додавання/оновлення таблиці reports
 CREATE TABLE IF NOT EXISTS reports (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id),
@@ -99,9 +129,9 @@ CREATE TABLE IF NOT EXISTS reports (
     details JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
 ALTER TABLE reports ADD COLUMN IF NOT EXISTS target_id INT;
 
--- Додавання/оновлення таблиці feedback
 CREATE TABLE IF NOT EXISTS feedback (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id),
@@ -110,7 +140,6 @@ CREATE TABLE IF NOT EXISTS feedback (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Додавання/оновлення таблиці summaries
 CREATE TABLE IF NOT EXISTS summaries (
     id SERIAL PRIMARY KEY,
     news_id INT REFERENCES news(id),
@@ -119,7 +148,6 @@ CREATE TABLE IF NOT EXISTS summaries (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Додавання/оновлення таблиці blocks
 CREATE TABLE IF NOT EXISTS blocks (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id),
@@ -129,7 +157,6 @@ CREATE TABLE IF NOT EXISTS blocks (
     UNIQUE (user_id, block_type, value)
 );
 
--- Додавання/оновлення таблиці bookmarks
 CREATE TABLE IF NOT EXISTS bookmarks (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id),
@@ -138,7 +165,6 @@ CREATE TABLE IF NOT EXISTS bookmarks (
     UNIQUE (user_id, news_id)
 );
 
--- Додавання/оновлення таблиці invites
 CREATE TABLE IF NOT EXISTS invites (
     id SERIAL PRIMARY KEY,
     inviter_id INT REFERENCES users(id),
@@ -146,9 +172,9 @@ CREATE TABLE IF NOT EXISTS invites (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     accepted_at TIMESTAMP
 );
+
 ALTER TABLE invites ADD COLUMN IF NOT EXISTS inviter_id INT REFERENCES users(id);
 
--- Додавання/оновлення таблиці admin_actions
 CREATE TABLE IF NOT EXISTS admin_actions (
     id SERIAL PRIMARY KEY,
     admin_user_id INT,
@@ -158,7 +184,6 @@ CREATE TABLE IF NOT EXISTS admin_actions (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Додавання/оновлення таблиці source_stats
 CREATE TABLE IF NOT EXISTS source_stats (
     id SERIAL PRIMARY KEY,
     source_id INT REFERENCES sources(id) UNIQUE,
@@ -167,17 +192,3 @@ CREATE TABLE IF NOT EXISTS source_stats (
     report_count INT DEFAULT 0,
     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
-
--- Створення або перестворення індексів. IF NOT EXISTS тут особливо корисний.
-CREATE INDEX IF NOT EXISTS idx_news_published_expires_moderation ON news (published_at DESC, expires_at, moderation_status);
--- CREATE INDEX IF NOT EXISTS idx_filters_user_id ON filters (user_id); -- filters table not defined
-CREATE INDEX IF NOT EXISTS idx_blocks_user_type_value ON blocks (user_id, block_type, value);
-CREATE INDEX IF NOT EXISTS idx_bookmarks_user_id ON bookmarks (user_id);
-CREATE INDEX IF NOT EXISTS idx_user_stats_user_id ON user_stats (user_id);
-CREATE INDEX IF NOT EXISTS idx_comments_news_id ON comments (news_id);
-CREATE INDEX IF NOT EXISTS idx_user_news_views_user_news_id ON user_news_views (user_id, news_id);
-CREATE INDEX IF NOT EXISTS idx_reports_user_id_target_id ON reports (user_id, target_id);
-CREATE INDEX IF NOT EXISTS idx_feedback_user_id ON feedback (user_id);
-CREATE INDEX IF NOT EXISTS idx_invites_inviter_id ON invites (inviter_id);
-CREATE INDEX IF NOT EXISTS idx_admin_actions_admin_user_id ON admin_actions (admin_user_id);
-CREATE INDEX IF NOT EXISTS idx_source_stats_source_id ON source_stats (source_id);
@@ -0,0 +1,92 @@
+-- 0002: Переведення news та user_news_views на партиціювання за місяцем публікації.
+-- Перегляди партиціюються за місяцем публікації переглянутої новини (news_published_at),
+-- тому унікальність (user_id, news_id) зберігається, а старі перегляди видаляються разом з новинами.
+-- Нові партиції та видалення застарілих виконує partition_maintenance_task у bot.py.
+SET LOCAL timezone = 'UTC';
+
+DO $$
+DECLARE
+    fk RECORD;
+    tbl TEXT;
+    convert_news BOOLEAN := (SELECT relkind FROM pg_class WHERE oid = 'news'::regclass) = 'r';
+    convert_views BOOLEAN := (SELECT relkind FROM pg_class WHERE oid = 'user_news_views'::regclass) = 'r';
+    month_start TIMESTAMPTZ;
+    last_month TIMESTAMPTZ := date_trunc('month', NOW()) + INTERVAL '2 months';
+BEGIN
+    IF NOT convert_news AND NOT convert_views THEN
+        RETURN;
+    END IF;
+
+    -- Зовнішні ключі на news(id) неможливі для партиційованої таблиці з ключем (id, published_at)
+    FOR fk IN SELECT conrelid::regclass::text AS tbl, conname FROM pg_constraint WHERE contype = 'f' AND confrelid = 'news'::regclass LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.tbl, fk.conname);
+    END LOOP;
+
+    IF convert_news THEN
+        ALTER TABLE news RENAME TO news_legacy;
+        ALTER TABLE news_legacy RENAME CONSTRAINT news_pkey TO news_legacy_pkey;
+        ALTER SEQUENCE news_id_seq OWNED BY NONE;
+        CREATE TABLE news (
+            id INTEGER NOT NULL DEFAULT nextval('news_id_seq'),
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            source_url TEXT,
+            image_url TEXT,
+            published_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            lang VARCHAR(10) NOT NULL DEFAULT 'uk',
+            ai_summary TEXT,
+            ai_classified_topics JSONB,
+            moderation_status VARCHAR(50) DEFAULT 'approved',
+            expires_at TIMESTAMP WITH TIME ZONE DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days'),
+            source_id INT REFERENCES sources(id),
+            PRIMARY KEY (id, published_at)
+        ) PARTITION BY RANGE (published_at);
+        ALTER SEQUENCE news_id_seq OWNED BY news.id;
+        CREATE TABLE IF NOT EXISTS news_default PARTITION OF news DEFAULT;
+    END IF;
+
+    IF convert_views THEN
+        ALTER TABLE user_news_views RENAME TO user_news_views_legacy;
+        ALTER TABLE user_news_views_legacy RENAME CONSTRAINT user_news_views_pkey TO user_news_views_legacy_pkey;
+        CREATE TABLE user_news_views (
+            user_id BIGINT NOT NULL REFERENCES users(id),
+            news_id INTEGER NOT NULL,
+            news_published_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            viewed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, news_id, news_published_at)
+        ) PARTITION BY RANGE (news_published_at);
+        CREATE TABLE IF NOT EXISTS user_news_views_default PARTITION OF user_news_views DEFAULT;
+    END IF;
+
+    -- Партиції під наявні дані створюються до копіювання, щоб рядки не осіли в DEFAULT
+    IF convert_news THEN
+        month_start := date_trunc('month', COALESCE((SELECT MIN(published_at) FROM news_legacy), NOW()));
+    ELSE
+        month_start := date_trunc('month', NOW());
+    END IF;
+    WHILE month_start <= last_month LOOP
+        FOREACH tbl IN ARRAY ARRAY['user_news_views', 'news'] LOOP
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           tbl || '_p' || to_char(month_start, 'YYYY_MM'), tbl, month_start, month_start + INTERVAL '1 month');
+        END LOOP;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+
+    IF convert_news THEN
+        INSERT INTO news (id, title, content, source_url, image_url, published_at, lang, ai_summary, ai_classified_topics, moderation_status, expires_at, source_id)
+        SELECT id, title, content, source_url, image_url, COALESCE(published_at, CURRENT_TIMESTAMP), lang, ai_summary, ai_classified_topics, moderation_status, expires_at, source_id
+        FROM news_legacy;
+        DROP TABLE news_legacy;
+    END IF;
+
+    IF convert_views THEN
+        INSERT INTO user_news_views (user_id, news_id, news_published_at, viewed_at)
+        SELECT v.user_id, v.news_id, n.published_at, v.viewed_at
+        FROM user_news_views_legacy v JOIN news n ON n.id = v.news_id;
+        DROP TABLE user_news_views_legacy;
+    END IF;
+END $$;
+
+-- Індекси на партиційованій таблиці створюються на батьківській і успадковуються партиціями
+CREATE INDEX IF NOT EXISTS idx_news_published_expires_moderation ON news (published_at DESC, expires_at, moderation_status);
+CREATE INDEX IF NOT EXISTS idx_news_source_published ON news (source_id, published_at DESC);
@@ -0,0 +1,12 @@
+-- migrate:no-transaction
+-- 0003: Допоміжні індекси. Будуються CONCURRENTLY, щоб не блокувати запис у робочі таблиці під час деплою.
+-- Кожен оператор виконується окремо (поза транзакцією), тому кожен має закінчуватися ";" в кінці рядка.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_blocks_user_type_value ON blocks (user_id, block_type, value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bookmarks_user_id ON bookmarks (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_stats_user_id ON user_stats (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comments_news_id ON comments (news_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_user_id_target_id ON reports (user_id, target_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_feedback_user_id ON feedback (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_invites_inviter_id ON invites (inviter_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_admin_actions_admin_user_id ON admin_actions (admin_user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_source_stats_source_id ON source_stats (source_id);
@@ -0,0 +1,12 @@
+-- 0004: Лічильники використання AI для квот (ai_quota.py).
+-- Рядок — кількість запитів користувача до функції AI у вікні, що почалося о window_start.
+-- feature = '*' — сумарний лічильник за всіма функціями. Застарілі вікна видаляє сам ai_quota.
+CREATE TABLE IF NOT EXISTS ai_usage (
+    user_id BIGINT NOT NULL,
+    feature TEXT NOT NULL,
+    window_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, feature, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_usage_window_start ON ai_usage (window_start);
@@ -0,0 +1,9 @@
+-- migrate:no-transaction
+-- 0005: Індивідуальний розклад дайджестів (digest_scheduler.py).
+-- digest_next_run — коли користувачу слід надіслати наступний дайджест; NULL означає, що розклад ще не
+-- розраховано (планувальник заповнить його сам). digest_timezone NULL — часовий пояс за замовчуванням,
+-- digest_cron використовується лише при digest_frequency = 'custom'.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_timezone TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_cron TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_next_run TIMESTAMP WITH TIME ZONE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_digest_next_run ON users (digest_next_run) WHERE auto_notifications;
@@ -0,0 +1,26 @@
+-- 0006: Черга фонових завдань (jobs.py).
+-- Завдання забираються воркерами через FOR UPDATE SKIP LOCKED у порядку (priority, run_at); менший priority — раніше.
+-- status: queued — чекає на run_at, running — виконується до locked_until, done — виконано, dead — вичерпано спроби.
+-- dedupe_key не дає поставити в чергу друге таке саме завдання, поки перше ще не виконано (періодичні завдання, дайджести).
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    priority SMALLINT NOT NULL DEFAULT 100,
+    status TEXT NOT NULL DEFAULT 'queued',
+    run_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    dedupe_key TEXT,
+    last_error TEXT,
+    locked_by TEXT,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (priority, run_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_running_lease ON jobs (locked_until) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at) WHERE status IN ('done', 'dead');
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe_key ON jobs (dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running');
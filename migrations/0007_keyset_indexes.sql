@@ -0,0 +1,6 @@
+-- migrate:no-transaction
+-- Індекси для курсорної пагінації адмінського API (ORDER BY ... DESC, id DESC) та лічильника активних користувачів
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_at_id ON users (created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_last_active ON users (last_active);
+-- Партиційована таблиця не підтримує CONCURRENTLY; індекс створюється на всіх партиціях одним оператором
+CREATE INDEX IF NOT EXISTS idx_news_published_id ON news (published_at DESC, id DESC);
@@ -0,0 +1,38 @@
+-- 0008: Зведення статистики для адмінської панелі (stats_rollup.py).
+-- stats_rollup — лічильники подій за годину/день (UTC), dimension — розріз (наприклад, source_id для news).
+-- stats_sketches — регістри HyperLogLog для унікальних значень за інтервал; об'єднуються поелементним максимумом.
+-- stats_totals — загальні кількості рядків; їх періодично точно перераховує завдання stats.reconcile.
+CREATE TABLE IF NOT EXISTS stats_rollup (
+    metric TEXT NOT NULL,
+    granularity TEXT NOT NULL CHECK (granularity IN ('hour', 'day')),
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    dimension TEXT NOT NULL DEFAULT '',
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, granularity, bucket, dimension)
+);
+
+CREATE TABLE IF NOT EXISTS stats_sketches (
+    metric TEXT NOT NULL,
+    granularity TEXT NOT NULL CHECK (granularity IN ('hour', 'day')),
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    registers SMALLINT[] NOT NULL,
+    PRIMARY KEY (metric, granularity, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS stats_totals (
+    metric TEXT PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0,
+    reconciled_at TIMESTAMP WITH TIME ZONE
+);
+
+INSERT INTO stats_totals (metric, value, reconciled_at) SELECT 'users', COUNT(*), now() FROM users ON CONFLICT (metric) DO NOTHING;
+INSERT INTO stats_totals (metric, value, reconciled_at) SELECT 'news', COUNT(*), now() FROM news ON CONFLICT (metric) DO NOTHING;
+INSERT INTO stats_totals (metric, value, reconciled_at) SELECT 'reports', COUNT(*), now() FROM reports ON CONFLICT (metric) DO NOTHING;
+
+-- Денна історія нових користувачів і новин за джерелами з наявних даних
+INSERT INTO stats_rollup (metric, granularity, bucket, dimension, value)
+SELECT 'new_users', 'day', date_trunc('day', created_at, 'UTC'), '', COUNT(*) FROM users WHERE created_at IS NOT NULL
+GROUP BY 3 ON CONFLICT DO NOTHING;
+INSERT INTO stats_rollup (metric, granularity, bucket, dimension, value)
+SELECT 'news', 'day', date_trunc('day', published_at, 'UTC'), COALESCE(source_id::text, ''), COUNT(*) FROM news WHERE published_at IS NOT NULL
+GROUP BY 3, 4 ON CONFLICT DO NOTHING;
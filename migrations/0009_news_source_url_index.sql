@@ -0,0 +1,3 @@
+-- 0009: Пошук дублікатів за source_url під час масового імпорту новин (news_import.py).
+-- Партиційована таблиця не підтримує CONCURRENTLY; індекс створюється на всіх партиціях одним оператором
+CREATE INDEX IF NOT EXISTS idx_news_source_url ON news (source_url);
@@ -0,0 +1,7 @@
+-- 0010: Пакетна AI-модерація (moderation.py): нові новини чекають на перевірку в 'pending'
+ALTER TABLE news ALTER COLUMN moderation_status SET DEFAULT 'pending';
+ALTER TABLE news ADD COLUMN IF NOT EXISTS moderation_verdict VARCHAR(20); -- clean / suspicious / fake / unknown; NULL — ще не перевірено
+ALTER TABLE news ADD COLUMN IF NOT EXISTS moderation_reason TEXT;
+ALTER TABLE news ADD COLUMN IF NOT EXISTS publish_to_channel BOOLEAN NOT NULL DEFAULT FALSE; -- Опублікувати в канал після схвалення
+-- Черга модерації: частковий індекс містить лише неперевірені новини, тож лишається малим
+CREATE INDEX IF NOT EXISTS idx_news_moderation_queue ON news (published_at) WHERE moderation_status = 'pending' AND moderation_verdict IS NULL;
@@ -0,0 +1,3 @@
+-- 0011: Джерело тем новини (topic_model.py): ai — Gemini, local — локальна модель, admin — виправлено вручну.
+-- NULL — теми з імпорту або з часу до появи колонки; разом з ai та admin вони є розміткою для навчання моделі
+ALTER TABLE news ADD COLUMN IF NOT EXISTS topics_source VARCHAR(10);
@@ -0,0 +1,169 @@
+"""Пакетна AI-модерація новин.
+
+Нові новини потрапляють у moderation_status = 'pending'. Періодичне завдання черги jobs (moderation.check)
+бере ще не перевірені новини пачками по MODERATION_BATCH_SIZE і перевіряє всю пачку одним запитом до
+Gemini, який повертає JSON-масив вердиктів {"id", "verdict", "reason"}. Новини з вердиктом clean
+схвалюються автоматично (MODERATION_AUTO_APPROVE), решта лишаються в 'pending' з вердиктом і поясненням
+для адміністратора. Новина, для якої модель кілька разів поспіль не повернула вердикт, отримує вердикт
+unknown і теж чекає на рішення адміністратора, а не блокує чергу.
+
+Будь-яка зміна статусу (автоматична чи через адмінський API) проходить через set_status: у тій самій
+транзакції вона сповіщає адмінську панель (news_updated), а для схвалених новин — підписників (news_push)
+і ставить публікацію в канал, якщо її було заплановано (publish_to_channel).
+"""
+import logging
+import os
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import admin_events
+import ai_batch
+import jobs
+import news_push
+import stats_rollup
+
+logger = logging.getLogger(__name__)
+
+MODERATION_BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", "10")) # Скільки новин перевіряти одним запитом до Gemini
+MODERATION_BATCHES_PER_RUN = int(os.getenv("MODERATION_BATCHES_PER_RUN", "5")) # Скільки пачок обробляє один запуск завдання
+MODERATION_INTERVAL = float(os.getenv("MODERATION_INTERVAL", "30")) # Як часто перевіряти чергу модерації, секунд
+MODERATION_AUTO_APPROVE = os.getenv("MODERATION_AUTO_APPROVE", "1").lower() not in ("0", "false", "no") # Схвалювати новини з вердиктом clean без адміністратора
+MODERATION_MAX_FAILURES = 3 # Після стількох відповідей без вердикту для новини вона отримує вердикт unknown
+
+STATUSES = ("approved", "pending", "rejected")
+VERDICTS = ("clean", "suspicious", "fake")
+UNKNOWN_VERDICT = "unknown"
+MAX_REASON_LENGTH = 500
+CHANNEL_PUBLISH_JOB = "channel_publish"
+CHECK_JOB = "moderation.check"
+
+def parse_verdicts(response: Optional[str], ids: Iterable[int]) -> Optional[Dict[int, Tuple[str, str]]]:
+    """Вердикти з відповіді моделі: {id: (verdict, reason)}; None, якщо JSON-масив не знайдено.
+
+    Записи з невідомим id або вердиктом пропускаються.
+    """
+    items = ai_batch.extract_json_array(response)
+    if items is None:
+        return None
+    expected = set(ids)
+    verdicts = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            news_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        verdict = str(item.get("verdict", "")).strip().lower()
+        if news_id in expected and verdict in VERDICTS:
+            verdicts[news_id] = (verdict, str(item.get("reason") or "")[:MAX_REASON_LENGTH])
+    return verdicts
+
+async def set_status(cur: psycopg.AsyncCursor, ids: List[int], status: str) -> List[Dict[str, Any]]:
+    """Змінює статус модерації в транзакції cur; повертає новини, статус яких справді змінився."""
+    if not ids:
+        return []
+    # Повернення в 'pending' скидає вердикт, щоб новину перевірили ще раз
+    reset_verdict = ", moderation_verdict = NULL, moderation_reason = NULL" if status == "pending" else ""
+    await cur.execute(f"""
+        UPDATE news SET moderation_status = %s{reset_verdict}
+        WHERE id = ANY(%s) AND moderation_status IS DISTINCT FROM %s
+        RETURNING id, title, moderation_status, published_at, source_id, ai_classified_topics, publish_to_channel
+    """, (status, ids, status))
+    changed = await cur.fetchall()
+    for row in changed:
+        if status == "approved":
+            await news_push.notify_news_added(cur, row["id"], row["source_id"], row["ai_classified_topics"])
+        await admin_events.notify(cur, "news_updated", admin_events.news_payload(row))
+    if status == "approved":
+        to_publish = [{"news_id": row["id"]} for row in changed if row["publish_to_channel"]]
+        await jobs.queue.enqueue_many(cur, CHANNEL_PUBLISH_JOB, to_publish,
+                                      dedupe_key=lambda payload: f"{CHANNEL_PUBLISH_JOB}:{payload['news_id']}")
+    return changed
+
+class Moderator:
+    def __init__(self, batch_size: int, batches_per_run: int, auto_approve: bool):
+        self.batch_size = batch_size
+        self.batches_per_run = batches_per_run
+        self.auto_approve = auto_approve
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self.check_batch: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Optional[str]]]] = None
+        self.window_sql = "TRUE"
+        self._failures: Counter = Counter() # id новини -> скільки відповідей поспіль не містили її вердикту
+
+    async def review(self, ids: List[int], status: str) -> List[Dict[str, Any]]:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                changed = await set_status(cur, ids, status)
+        logger.info(f"Модерація: {len(changed)} з {len(ids)} новин отримали статус {status}.")
+        return changed
+
+    async def _pending(self) -> List[Dict[str, Any]]:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                # Обмеження за published_at відсікає старі партиції; новини поза вікном однаково буде видалено
+                await cur.execute(f"""
+                    SELECT id, title, content FROM news
+                    WHERE moderation_status = 'pending' AND moderation_verdict IS NULL AND {self.window_sql}
+                    ORDER BY published_at LIMIT %s
+                """, (self.batch_size,))
+                return await cur.fetchall()
+
+    async def _apply(self, verdicts: Dict[int, Tuple[str, str]]):
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.executemany("UPDATE news SET moderation_verdict = %s, moderation_reason = %s WHERE id = %s AND moderation_status = 'pending'",
+                                      [(verdict, reason, news_id) for news_id, (verdict, reason) in verdicts.items()])
+                if self.auto_approve:
+                    await set_status(cur, [news_id for news_id, (verdict, _) in verdicts.items() if verdict == "clean"], "approved")
+        for verdict, count in Counter(verdict for verdict, _ in verdicts.values()).items():
+            stats_rollup.rollup.incr("moderation", verdict, count)
+
+    async def check_once(self) -> int:
+        """Перевіряє одну пачку; повертає кількість новин, що отримали вердикт."""
+        batch = await self._pending()
+        if not batch:
+            return 0
+        ids = [item["id"] for item in batch]
+        # З'єднання з пулу вже повернуто: запит до Gemini триває секунди
+        verdicts = parse_verdicts(await self.check_batch(batch), ids)
+        if verdicts is None:
+            # Помилка AI або відповідь без JSON: найчастіше тимчасова, тож пачка чекає наступного запуску
+            logger.warning(f"Не вдалося отримати вердикти модерації для новин {ids}.")
+            return 0
+        missing = [news_id for news_id in ids if news_id not in verdicts]
+        for news_id in missing:
+            self._failures[news_id] += 1
+            if self._failures[news_id] >= MODERATION_MAX_FAILURES:
+                verdicts[news_id] = (UNKNOWN_VERDICT, "AI не повернув вердикт; потрібне рішення адміністратора.")
+        for news_id in verdicts:
+            self._failures.pop(news_id, None)
+        if verdicts:
+            await self._apply(verdicts)
+        return len(verdicts)
+
+    async def run(self, payload: Dict[str, Any]):
+        checked = 0
+        for _ in range(self.batches_per_run):
+            done = await self.check_once()
+            checked += done
+            if done < self.batch_size:
+                break
+        if checked:
+            logger.info(f"Модерація: перевірено {checked} новин.")
+
+moderator = Moderator(MODERATION_BATCH_SIZE, MODERATION_BATCHES_PER_RUN, MODERATION_AUTO_APPROVE)
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]],
+          check_batch: Callable[[List[Dict[str, Any]]], Awaitable[Optional[str]]], window_sql: str):
+    moderator.get_pool = get_pool
+    moderator.check_batch = check_batch
+    moderator.window_sql = window_sql
+    jobs.queue.handler(CHECK_JOB, priority=120, every=MODERATION_INTERVAL)(moderator.run)
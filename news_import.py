@@ -0,0 +1,297 @@
+"""Потоковий масовий імпорт новин (NDJSON або CSV) через COPY.
+
+Тіло запиту читається частинами й розбирається по рядках, тож розмір імпорту не обмежений пам'яттю.
+Кожен рядок перевіряється окремо: некоректні потрапляють у звіт із номером рядка, решта накопичуються
+пачками по IMPORT_CHUNK_SIZE. Пачка копіюється COPY у тимчасову таблицю і одним INSERT ... SELECT
+переноситься в news без дублікатів: у межах пачки та з уже наявними новинами (за source_url, а без
+нього — за заголовком і часом публікації). AI-резюме й теми не генеруються під час імпорту: для новин
+без них у тій самій транзакції ставляться завдання черги jobs. Рядки без moderation_status потрапляють у
+'pending' і проходять модерацію (moderation.check); схвалені напряму рядки сповіщень не надсилають.
+
+Новини, старіші за NEWS_RETENTION_DAYS, відхиляються — обслуговування партицій однаково видалило б їх.
+Для місяців, яких ще немає, партиції створюються перед завантаженням, щоб архів не осідав у news_default.
+"""
+import codecs
+import csv
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+import admin_events
+import jobs
+import stats_rollup
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000")) # Скільки рядків завантажувати одним COPY
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "100")) # Скільки помилкових рядків повертати у звіті
+IMPORT_LOCK_ID = 106_044 # Ключ advisory lock: паралельні імпорти не вставлять ту саму новину двічі
+
+ENRICH_JOB = "import_enrich"
+FORMATS = ("ndjson", "csv")
+MODERATION_STATUSES = ("approved", "pending", "rejected")
+FIELDS = ("title", "content", "source_url", "image_url", "published_at", "lang", "ai_summary", "ai_classified_topics",
+          "moderation_status", "expires_at", "source_id")
+MAX_TITLE_LENGTH = 500
+
+class RowError(ValueError):
+    pass
+
+def _text(raw: Dict[str, Any], name: str, required: bool = False) -> Optional[str]:
+    value = raw.get(name)
+    if value is not None and not isinstance(value, str):
+        value = str(value)
+    value = value.strip() if value else None
+    if required and not value:
+        raise RowError(f"Поле {name} обов'язкове.")
+    return value
+
+def _timestamp(raw: Dict[str, Any], name: str) -> Optional[datetime]:
+    value = _text(raw, name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise RowError(f"Поле {name}: очікується дата у форматі ISO 8601, отримано {value!r}.") from None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def _topics(raw: Dict[str, Any]) -> Optional[List[str]]:
+    value = raw.get("ai_classified_topics")
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise RowError("Поле ai_classified_topics: некоректний JSON-масив.") from None
+        else:
+            # У CSV теми можна перелічити через кому
+            value = [topic.strip() for topic in value.split(",")]
+    if not value:
+        return None
+    if not isinstance(value, list):
+        raise RowError("Поле ai_classified_topics має бути масивом рядків.")
+    return [str(topic).strip() for topic in value if str(topic).strip()] or None
+
+def parse_row(raw: Dict[str, Any], now: datetime, oldest: datetime) -> tuple:
+    """Перевіряє рядок імпорту й повертає значення в порядку FIELDS."""
+    if not isinstance(raw, dict):
+        raise RowError("Рядок має бути JSON-об'єктом.")
+    title = _text(raw, "title", required=True)
+    if len(title) > MAX_TITLE_LENGTH:
+        raise RowError(f"Заголовок довший за {MAX_TITLE_LENGTH} символів.")
+    content = _text(raw, "content", required=True)
+    published_at = _timestamp(raw, "published_at") or now
+    if published_at < oldest:
+        raise RowError(f"Новина старіша за строк зберігання ({oldest:%Y-%m-%d}); збільште NEWS_RETENTION_DAYS, щоб імпортувати архів.")
+    # Без явного статусу новина проходить AI-модерацію, як і решта нових; довірений архів можна імпортувати з "approved"
+    moderation_status = _text(raw, "moderation_status") or "pending"
+    if moderation_status not in MODERATION_STATUSES:
+        raise RowError(f"Поле moderation_status має бути одним із: {', '.join(MODERATION_STATUSES)}.")
+    source_id = _text(raw, "source_id")
+    try:
+        source_id = int(source_id) if source_id else None
+    except ValueError:
+        raise RowError(f"Поле source_id має бути цілим числом, отримано {source_id!r}.") from None
+    topics = _topics(raw)
+    return (title, content, _text(raw, "source_url"), _text(raw, "image_url"), published_at, _text(raw, "lang") or "uk",
+            _text(raw, "ai_summary"), Jsonb(topics) if topics else None, moderation_status,
+            _timestamp(raw, "expires_at") or published_at + timedelta(days=5), source_id)
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Рядки тексту з потоку байтів (разом із символом кінця рядка); BOM на початку пропускається."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+async def iter_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f"Некоректний JSON: {e}")
+
+async def iter_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """Записи CSV із заголовком; поле в лапках може містити переведення рядка."""
+    header: Optional[List[str]] = None
+    record, start, line_no = "", 0, 0
+    async for line in lines:
+        line_no += 1
+        if not record:
+            start = line_no
+        record += line
+        # Лапки всередині поля подвоюються, тож непарна кількість означає, що поле ще не закрите
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as e:
+            yield start, RowError(f"Некоректний CSV: {e}")
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            unknown = set(header) - set(FIELDS)
+            if unknown:
+                logger.warning(f"Імпорт новин: невідомі колонки CSV ігноруються: {', '.join(sorted(unknown))}")
+            continue
+        if len(values) != len(header):
+            yield start, RowError(f"Очікується {len(header)} колонок, отримано {len(values)}.")
+            continue
+        yield start, dict(zip(header, values))
+    if record:
+        yield start, RowError("Незакрите поле в лапках наприкінці файлу.")
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.enrichment_jobs = 0
+        self.chunks = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, line: int, error: str):
+        self.invalid += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"rows": self.rows, "inserted": self.inserted, "duplicates": self.duplicates, "invalid": self.invalid,
+                "enrichment_jobs": self.enrichment_jobs, "chunks": self.chunks, "errors": self.errors,
+                "errors_truncated": self.invalid > len(self.errors)}
+
+STAGE_SQL = """
+    CREATE TEMP TABLE news_import_stage (
+        line_no INT, title TEXT, content TEXT, source_url TEXT, image_url TEXT, published_at TIMESTAMPTZ, lang TEXT,
+        ai_summary TEXT, ai_classified_topics JSONB, moderation_status TEXT, expires_at TIMESTAMPTZ, source_id INT
+    ) ON COMMIT DROP
+"""
+
+INSERT_SQL = f"""
+    INSERT INTO news ({', '.join(FIELDS)})
+    SELECT {', '.join(FIELDS)} FROM (
+        SELECT DISTINCT ON (COALESCE(source_url, title || '|' || published_at::text)) *
+        FROM news_import_stage ORDER BY COALESCE(source_url, title || '|' || published_at::text), line_no
+    ) s
+    WHERE CASE WHEN s.source_url IS NOT NULL
+               THEN NOT EXISTS (SELECT 1 FROM news n WHERE n.source_url = s.source_url)
+               ELSE NOT EXISTS (SELECT 1 FROM news n WHERE n.title = s.title AND n.published_at = s.published_at) END
+    RETURNING id, source_id, (ai_summary IS NULL OR ai_classified_topics IS NULL) AS needs_enrichment
+"""
+
+class NewsImporter:
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self.ensure_partitions: Optional[Callable[[psycopg.AsyncConnection, datetime, datetime], Awaitable[None]]] = None
+        self.retention_days = 0
+        self._months: Set[Tuple[int, int]] = set() # Місяці, партиції яких уже перевірено
+
+    async def run(self, chunks: AsyncIterator[bytes], fmt: str, enrich: bool) -> Dict[str, Any]:
+        report = ImportReport()
+        now = datetime.now(timezone.utc)
+        oldest = now - timedelta(days=self.retention_days)
+        records = iter_csv(iter_lines(chunks)) if fmt == "csv" else iter_ndjson(iter_lines(chunks))
+        batch: List[tuple] = []
+        async for line_no, raw in records:
+            report.rows += 1
+            try:
+                if isinstance(raw, RowError):
+                    raise raw
+                batch.append((line_no, *parse_row(raw, now, oldest)))
+            except RowError as e:
+                report.add_error(line_no, str(e))
+            if len(batch) >= self.chunk_size:
+                await self._load(batch, enrich, report)
+                batch = []
+        if batch:
+            await self._load(batch, enrich, report)
+        logger.info(f"Імпорт новин завершено: рядків {report.rows}, додано {report.inserted}, дублікатів {report.duplicates}, "
+                    f"помилок {report.invalid}, завдань збагачення {report.enrichment_jobs}.")
+        return report.as_dict()
+
+    @staticmethod
+    async def _drop_unknown_sources(cur: psycopg.AsyncCursor, batch: List[tuple], report: ImportReport) -> List[tuple]:
+        """Відкидає рядки з source_id, якого немає в sources: інакше зовнішній ключ зірве всю пачку."""
+        position = FIELDS.index("source_id") + 1
+        source_ids = list({row[position] for row in batch if row[position] is not None})
+        if not source_ids:
+            return batch
+        await cur.execute("SELECT id FROM sources WHERE id = ANY(%s)", (source_ids,))
+        known = {row["id"] for row in await cur.fetchall()}
+        kept = []
+        for row in batch:
+            if row[position] is None or row[position] in known:
+                kept.append(row)
+            else:
+                report.add_error(row[0], f"Джерела з source_id {row[position]} не існує.")
+        return kept
+
+    async def _load(self, batch: List[tuple], enrich: bool, report: ImportReport):
+        published = [row[FIELDS.index("published_at") + 1] for row in batch]
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            months = {(moment.year, moment.month) for moment in published}
+            if not months <= self._months:
+                # Поза транзакцією завантаження: DDL партицій не повинен тримати блокування на час COPY
+                await self.ensure_partitions(conn, min(published), max(published))
+                self._months |= months
+            async with conn.transaction():
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    # Очікування блокування за іншим імпортом і INSERT великої пачки тривають довше за statement_timeout пулу
+                    await cur.execute("SET LOCAL statement_timeout = 0")
+                    await cur.execute("SELECT pg_advisory_xact_lock(%s)", (IMPORT_LOCK_ID,))
+                    batch = await self._drop_unknown_sources(cur, batch, report)
+                    await cur.execute(STAGE_SQL, prepare=False)
+                    async with cur.copy(f"COPY news_import_stage (line_no, {', '.join(FIELDS)}) FROM STDIN") as copy:
+                        for row in batch:
+                            await copy.write_row(row)
+                    # Тимчасова таблиця щоразу нова, тож запити до неї не готуємо на сервері
+                    await cur.execute(INSERT_SQL, prepare=False)
+                    inserted = await cur.fetchall()
+                    to_enrich = [{"news_id": row["id"]} for row in inserted if row["needs_enrichment"]] if enrich else []
+                    if to_enrich:
+                        await jobs.queue.enqueue_many(cur, ENRICH_JOB, to_enrich, dedupe_key=lambda payload: f"{ENRICH_JOB}:{payload['news_id']}")
+                    if inserted:
+                        # Одна подія на пачку, а не на кожну новину: панель просто перечитає таблицю новин
+                        await admin_events.notify(cur, "news_imported", {"count": len(inserted)})
+        for source_id, count in Counter(row["source_id"] for row in inserted).items():
+            stats_rollup.rollup.incr("news", source_id, count)
+        report.chunks += 1
+        report.inserted += len(inserted)
+        report.duplicates += len(batch) - len(inserted)
+        report.enrichment_jobs += len(to_enrich)
+        logger.info(f"Імпорт новин: пачка {report.chunks}, оброблено {report.rows} рядків, додано {report.inserted}, "
+                    f"дублікатів {report.duplicates}, помилок {report.invalid}.")
+
+importer = NewsImporter(IMPORT_CHUNK_SIZE)
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]],
+          ensure_partitions: Callable[[psycopg.AsyncConnection, datetime, datetime], Awaitable[None]], retention_days: int):
+    importer.get_pool = get_pool
+    importer.ensure_partitions = ensure_partitions
+    importer.retention_days = retention_days
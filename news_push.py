@@ -0,0 +1,296 @@
+"""Миттєві сповіщення про нові новини через LISTEN/NOTIFY.
+
+add_news у тій самій транзакції робить NOTIFY news_added з id, джерелом і темами новини, а зміни
+автосповіщень або фільтрів користувача — NOTIFY news_subscriptions з його id. NewsListener тримає окреме
+з'єднання з LISTEN на обидва канали і в пам'яті — інвертований індекс джерело/тема -> підписники
+(SubscriptionIndex), тож пошук адресатів новини не звертається до БД і не залежить від опитування.
+Повідомлення надсилає PushSender: кілька воркерів зі спільним обмеженням частоти під ліміти Telegram.
+
+run() реєструється як завдання leader.py, тож слухач працює лише на одному екземплярі бота.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import psycopg
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.utils.markdown import hlink
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import metrics
+import stats_rollup
+
+logger = logging.getLogger(__name__)
+
+PUSH_NOTIFICATIONS_ENABLED = os.getenv("PUSH_NOTIFICATIONS_ENABLED", "1").lower() not in ("0", "false", "no")
+PUSH_RATE_PER_SECOND = float(os.getenv("PUSH_RATE_PER_SECOND", "25")) # Загальний ліміт надсилання (Telegram дозволяє ~30 повідомлень/с)
+PUSH_SENDER_WORKERS = int(os.getenv("PUSH_SENDER_WORKERS", "8")) # Скільки повідомлень може бути в дорозі одночасно
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "100000")) # Максимум повідомлень у черзі; далі слухач чекає
+
+NEWS_CHANNEL = "news_added"
+SUBSCRIPTION_CHANNEL = "news_subscriptions"
+VIEWS_BATCH_SIZE = 500
+
+async def notify_news_added(cur: psycopg.AsyncCursor, news_id: int, source_id: Optional[int], topics: Optional[Iterable[str]]):
+    payload = {"id": news_id, "source_id": source_id, "topics": list(topics or [])}
+    await cur.execute("SELECT pg_notify(%s, %s)", (NEWS_CHANNEL, json.dumps(payload, ensure_ascii=False)))
+
+async def notify_subscription_changed(cur: psycopg.AsyncCursor, user_id: int):
+    await cur.execute("SELECT pg_notify(%s, %s)", (SUBSCRIPTION_CHANNEL, str(user_id)))
+
+class SubscriptionIndex:
+    """Підписники з увімкненими автосповіщеннями, проіндексовані за джерелами та темами з їхніх фільтрів.
+
+    Користувач без фільтрів отримує всі новини. Користувач із фільтром джерел індексується лише за
+    джерелами (фільтр тем, якщо він є, перевіряється для кандидатів), з фільтром лише тем — за темами.
+    """
+
+    def __init__(self):
+        self.by_source: Dict[int, Set[int]] = defaultdict(set)
+        self.by_topic: Dict[str, Set[int]] = defaultdict(set)
+        self.unfiltered: Set[int] = set()
+        self._filters: Dict[int, Tuple[FrozenSet[int], FrozenSet[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def remove(self, user_id: int):
+        filters = self._filters.pop(user_id, None)
+        if filters is None:
+            return
+        sources, topics = filters
+        if sources:
+            self._discard(self.by_source, sources, user_id)
+        elif topics:
+            self._discard(self.by_topic, topics, user_id)
+        else:
+            self.unfiltered.discard(user_id)
+
+    @staticmethod
+    def _discard(index: Dict[Any, Set[int]], keys: Iterable[Any], user_id: int):
+        for key in keys:
+            users = index.get(key)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del index[key]
+
+    def set(self, user_id: int, filters: Optional[Dict[str, Any]]):
+        self.remove(user_id)
+        filters = filters or {}
+        sources = frozenset(int(s) for s in filters.get("source_ids") or [])
+        topics = frozenset(filters.get("topics") or [])
+        self._filters[user_id] = (sources, topics)
+        if sources:
+            for source_id in sources:
+                self.by_source[source_id].add(user_id)
+        elif topics:
+            for topic in topics:
+                self.by_topic[topic].add(user_id)
+        else:
+            self.unfiltered.add(user_id)
+
+    def match(self, source_id: Optional[int], topics: Iterable[str]) -> Set[int]:
+        topics = set(topics)
+        result = set(self.unfiltered)
+        candidates = set(self.by_source.get(source_id, ())) if source_id is not None else set()
+        for topic in topics:
+            candidates |= self.by_topic.get(topic, set())
+        for user_id in candidates:
+            user_sources, user_topics = self._filters[user_id]
+            if (not user_sources or source_id in user_sources) and (not user_topics or user_topics & topics):
+                result.add(user_id)
+        return result
+
+    async def load(self, pool: AsyncConnectionPool):
+        self.__init__()
+        async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                SELECT u.id, f.filters FROM users u
+                LEFT JOIN custom_feeds f ON f.user_id = u.id AND f.feed_name = 'default_feed'
+                WHERE u.auto_notifications = TRUE
+            """)
+            async for row in cur:
+                self.set(row["id"], row["filters"])
+
+    async def reload_user(self, pool: AsyncConnectionPool, user_id: int):
+        async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                SELECT u.auto_notifications, f.filters FROM users u
+                LEFT JOIN custom_feeds f ON f.user_id = u.id AND f.feed_name = 'default_feed'
+                WHERE u.id = %s
+            """, (user_id,))
+            row = await cur.fetchone()
+        if row and row["auto_notifications"]:
+            self.set(user_id, row["filters"])
+        else:
+            self.remove(user_id)
+
+class RateLimiter:
+    """Рівномірно розподіляє виклики: не частіше за rate на секунду для всіх воркерів разом."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        # Після 429 від Telegram зсуваємо всі наступні слоти
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+class PushSender:
+    def __init__(self, bot: Bot, get_pool: Callable[[], Awaitable[AsyncConnectionPool]], index: SubscriptionIndex,
+                 rate: float, workers: int, queue_size: int):
+        self.bot = bot
+        self.get_pool = get_pool
+        self.index = index
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._viewed: List[Tuple[int, int, Any]] = []
+
+    async def enqueue(self, user_id: int, news: Dict[str, Any], text: str):
+        await self.queue.put((user_id, news["id"], news["published_at"], text))
+
+    async def _send(self, user_id: int, text: str) -> bool:
+        while True:
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(user_id, text, disable_web_page_preview=True)
+                metrics.count_push("sent")
+                return True
+            except TelegramRetryAfter as e:
+                metrics.count_push("retry_after")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                # Користувач заблокував бота: більше не надсилаємо йому сповіщень
+                metrics.count_push("forbidden")
+                self.index.remove(user_id)
+                await self._disable(user_id)
+                return False
+            except Exception as e:
+                metrics.count_push("error")
+                logger.error(f"Не вдалося надіслати сповіщення користувачу {user_id}: {e}")
+                return False
+
+    async def _disable(self, user_id: int):
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                await conn.execute("UPDATE users SET auto_notifications = FALSE WHERE id = %s", (user_id,))
+        except Exception as e:
+            logger.error(f"Не вдалося вимкнути автосповіщення користувачу {user_id}: {e}")
+
+    async def flush_views(self):
+        """Позначає надіслані новини переглянутими одним запитом, щоб дайджест їх не повторював."""
+        if not self._viewed:
+            return
+        viewed, self._viewed = self._viewed, []
+        user_ids, news_ids, published = zip(*viewed)
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                await conn.execute("""
+                    INSERT INTO user_news_views (user_id, news_id, news_published_at)
+                    SELECT * FROM unnest(%s::bigint[], %s::int[], %s::timestamptz[])
+                    ON CONFLICT (user_id, news_id, news_published_at) DO NOTHING
+                """, (list(user_ids), list(news_ids), list(published)))
+            stats_rollup.rollup.incr("views", amount=len(viewed))
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти перегляди надісланих сповіщень: {e}")
+
+    async def _worker(self):
+        while True:
+            user_id, news_id, published_at, text = await self.queue.get()
+            try:
+                if await self._send(user_id, text):
+                    self._viewed.append((user_id, news_id, published_at))
+                if len(self._viewed) >= VIEWS_BATCH_SIZE or (self.queue.empty() and self._viewed):
+                    await self.flush_views()
+            finally:
+                self.queue.task_done()
+
+    async def run(self):
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+def format_push(news: Dict[str, Any]) -> str:
+    summary = news["ai_summary"] or news["content"][:200] + "..."
+    text = f"🔔 <b>{news['title']}</b>\n{summary}"
+    if news["source_url"]:
+        text += f"\n🔗 {hlink('Читати', news['source_url'])}"
+    return text
+
+class NewsListener:
+    """Слухає канали на окремому з'єднанні; запити до таблиць робить через пул, не займаючи це з'єднання."""
+
+    def __init__(self, conninfo: str, get_pool: Callable[[], Awaitable[AsyncConnectionPool]], index: SubscriptionIndex, sender: PushSender):
+        self.conninfo = conninfo
+        self.get_pool = get_pool
+        self.index = index
+        self.sender = sender
+
+    async def _on_news(self, payload: Dict[str, Any]):
+        user_ids = self.index.match(payload.get("source_id"), payload.get("topics") or [])
+        if not user_ids:
+            return
+        pool = await self.get_pool()
+        async with pool.connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("SELECT id, title, content, source_url, published_at, ai_summary FROM news WHERE id = %s AND moderation_status = 'approved'",
+                              (payload["id"],))
+            news = await cur.fetchone()
+        if not news:
+            return
+        text = format_push(news)
+        for user_id in user_ids:
+            await self.sender.enqueue(user_id, news, text)
+        logger.info(f"Новину {news['id']} поставлено в чергу сповіщень для {len(user_ids)} користувачів.")
+
+    async def _listen(self):
+        async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True) as conn:
+            await conn.execute(f"LISTEN {NEWS_CHANNEL}")
+            await conn.execute(f"LISTEN {SUBSCRIPTION_CHANNEL}")
+            # Індекс будуємо після LISTEN, щоб не пропустити зміни, зроблені під час завантаження
+            await self.index.load(await self.get_pool())
+            logger.info(f"Слухач сповіщень запущено, підписників: {len(self.index)}.")
+            async for notify in conn.notifies():
+                try:
+                    if notify.channel == NEWS_CHANNEL:
+                        await self._on_news(json.loads(notify.payload))
+                    else:
+                        await self.index.reload_user(await self.get_pool(), int(notify.payload))
+                except Exception as e:
+                    logger.error(f"Помилка обробки сповіщення {notify.channel}: {e}")
+
+    async def run(self):
+        delay = 1
+        while True:
+            try:
+                await self._listen()
+                delay = 1
+            except Exception as e:
+                logger.error(f"З'єднання слухача сповіщень втрачено: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+listener: Optional[NewsListener] = None
+
+def setup(bot: Bot, get_pool: Callable[[], Awaitable[AsyncConnectionPool]], conninfo: str):
+    global listener
+    index = SubscriptionIndex()
+    sender = PushSender(bot, get_pool, index, PUSH_RATE_PER_SECOND, PUSH_SENDER_WORKERS, PUSH_QUEUE_SIZE)
+    listener = NewsListener(conninfo, get_pool, index, sender)
+
+async def run():
+    await asyncio.gather(listener.sender.run(), listener.run())
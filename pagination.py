@@ -0,0 +1,59 @@
+"""Курсорна (keyset) пагінація та швидкі наближені лічильники для адмінського API.
+
+Сторінка задається курсором after="<мітка часу>,<id>" останнього рядка попередньої сторінки, тож запит
+читає з індексу лише limit рядків замість того, щоб пропускати OFFSET попередніх. Загальна кількість
+рядків береться з pg_class.reltuples (оцінка, яку оновлюють autovacuum/ANALYZE) і для партиційованих
+таблиць підсумовується по партиціях; точний COUNT(*) виконується лише на вимогу (exact=true) або для
+малих таблиць, де він і так дешевий.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import psycopg
+
+EXACT_COUNT_BELOW = 10_000 # Таблиці з меншою оцінкою рахуємо точно: COUNT(*) по них дешевий
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(moment: datetime, row_id: int) -> str:
+    # UTC із суфіксом Z: у курсорі немає "+", який у query string перетворився б на пробіл
+    return f"{moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')},{row_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    moment, _, row_id = cursor.strip().rpartition(",")
+    try:
+        # Незакодований "+" зміщення часового поясу приходить як пробіл
+        return datetime.fromisoformat(moment.replace(" ", "+")), int(row_id)
+    except ValueError:
+        raise InvalidCursor(f"Некоректний курсор: {cursor!r}. Очікується формат <ISO-час>,<id>.") from None
+
+def next_cursor(rows: list, limit: int, time_column: str) -> Optional[str]:
+    """Курсор наступної сторінки або None, якщо сторінка неповна (далі рядків немає)."""
+    if len(rows) < limit or not rows or rows[-1][time_column] is None:
+        return None
+    return encode_cursor(rows[-1][time_column], rows[-1]["id"])
+
+def keyset_clause(time_column: str, after: Optional[str]) -> Tuple[str, tuple]:
+    """Умова WHERE для сторінки після курсора при сортуванні ORDER BY time_column DESC, id DESC."""
+    if not after:
+        return "TRUE", ()
+    return f"({time_column}, id) < (%s, %s)", decode_cursor(after)
+
+async def approximate_count(cur: psycopg.AsyncCursor, table: str) -> int:
+    # Для партиційованої таблиці reltuples батьківської дорівнює -1 (або 0), тож сумуємо по її партиціях
+    await cur.execute("""
+        SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM pg_class c
+        WHERE c.oid = %s::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+    """, (table, table))
+    return (await cur.fetchone())[0]
+
+async def count_rows(conn: psycopg.AsyncConnection, table: str, exact: bool = False) -> Dict[str, Any]:
+    """Кількість рядків таблиці: {"count": ..., "exact": ...}."""
+    async with conn.cursor() as cur:
+        if not exact:
+            estimate = await approximate_count(cur, table)
+            if estimate >= EXACT_COUNT_BELOW:
+                return {"count": estimate, "exact": False}
+        await cur.execute(f"SELECT COUNT(*) FROM {table}")
+        return {"count": (await cur.fetchone())[0], "exact": True}
@@ -2,12 +2,12 @@
 
 # Цей скрипт виконується при кожному запуску/перезапуску сервісу на Render
 
-echo "Застосування схеми до бази даних..."
-# Застосовуємо схему. Прапорець -X запобігає виводу зайвих повідомлень.
-# Команда виконається успішно, навіть якщо таблиці вже існують, завдяки "IF NOT EXISTS" у вашому .sql файлі.
-# Це також додасть відсутні стовпці до існуючих таблиць.
-psql $DATABASE_URL -f schema.sql -X
+echo "Застосування міграцій бази даних..."
+# Застосовуються лише нові міграції з каталогу migrations/ (під advisory lock).
+# Якщо схема вже актуальна, скрипт завершується після одного SELECT без жодного DDL.
+python migrate.py || exit 1
 
 echo "Запуск веб-сервера Uvicorn..."
 # Запускаємо веб-сервер на порту, який надає Render (зазвичай 10000)
-uvicorn bot:app --host 0.0.0.0 --port ${PORT:-10000}
+# Журнал доступу uvicorn вимкнено: він синхронно пише рядок на кожен вебхук (див. LOG_LEVEL/LOG_FORMAT у log_config.py)
+uvicorn bot:app --host 0.0.0.0 --port ${PORT:-10000} --no-access-log
@@ -0,0 +1,264 @@
+"""Інкрементальні зведення статистики для адмінської панелі.
+
+Події (новий користувач, новина за джерелом, перегляди, запити до AI) рахуються в пам'яті за годинними
+та денними інтервалами (UTC), а StatsRollup.sync_task раз на STATS_FLUSH_INTERVAL секунд одним запитом на
+таблицю додає прирости до stats_rollup і stats_totals. Унікальних активних користувачів рахує
+HyperLogLog: скетч на інтервал займає 2^STATS_HLL_PRECISION регістрів, а скетчі кількох днів
+об'єднуються поелементним максимумом (у БД — так само в upsert), тож кількість активних за тиждень
+дорівнює оцінці об'єднання семи денних скетчів.
+
+Ендпоінт статистики читає кілька рядків stats_totals і сім скетчів замість повних COUNT(*). Періодичне
+завдання stats.reconcile перераховує загальні кількості точно (їх змінюють і видалення, і ретеншн
+партицій) та доливає в скетчі активних користувачів за users.last_active — об'єднання скетчів
+ідемпотентне, тож повторне додавання тих самих id нічого не псує.
+
+Перерахунок записує точний COUNT(*) і момент його знімка (reconciled_at), а прирости загальних кількостей
+зберігаються в пам'яті разом із секундою події. Під час запису прирости, старші за reconciled_at, уже
+враховані в COUNT(*) (зокрема ще не записані на інших екземплярах), тож відкидаються, а не додаються
+вдруге. Залишкова похибка — події, що припали на сам перерахунок або на розбіжність годинників екземплярів
+і сервера БД; її знову прибере наступний перерахунок.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import jobs
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "10")) # Як часто записувати накопичені лічильники в БД, секунд
+STATS_HLL_PRECISION = int(os.getenv("STATS_HLL_PRECISION", "11")) # 2^p регістрів на скетч; похибка ~1.04/sqrt(2^p) (2.3% при p=11)
+STATS_HOURLY_RETENTION_DAYS = int(os.getenv("STATS_HOURLY_RETENTION_DAYS", "14")) # Скільки днів зберігати годинні зведення
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", str(6 * 60 * 60))) # Як часто точно перераховувати загальні кількості, секунд
+
+HOUR = "hour"
+DAY = "day"
+GRANULARITY_SECONDS = {HOUR: 3600, DAY: 86400}
+
+ACTIVE_USERS = "active_users" # Метрика-скетч: унікальні активні користувачі
+ACTIVE_WINDOW_DAYS = 7
+TOTAL_METRICS = {"new_users": "users", "news": "news"} # Подія -> загальна кількість у stats_totals, яку вона збільшує
+RECONCILE_TABLES = ("users", "news", "reports")
+
+_MASK64 = (1 << 64) - 1
+
+def _hash64(value: int) -> int:
+    # splitmix64: рівномірно розподіляє послідовні id по всіх 64 бітах
+    z = (value + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+class HyperLogLog:
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int, registers: Optional[List[int]] = None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value: int):
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, registers):
+        if len(registers) != len(self.registers):
+            # Скетч, записаний з іншою STATS_HLL_PRECISION, не поєднується з поточними
+            return
+        self.registers = bytearray(map(max, self.registers, registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Лінійний підрахунок точніший для малих множин
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+def _bucket(now: float, granularity: str) -> int:
+    size = GRANULARITY_SECONDS[granularity]
+    return int(now // size) * size
+
+def _as_datetime(bucket: int) -> datetime:
+    return datetime.fromtimestamp(bucket, timezone.utc)
+
+class StatsRollup:
+    def __init__(self, precision: int):
+        self.precision = precision
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self._counts: Dict[Tuple[str, str, int, str], int] = defaultdict(int)
+        self._totals: Dict[Tuple[str, int], int] = defaultdict(int) # (загальна кількість, секунда події) -> приріст
+        self._sketches: Dict[Tuple[str, str, int], HyperLogLog] = {}
+
+    def incr(self, metric: str, dimension: Any = "", amount: int = 1):
+        now = time.time()
+        dimension = "" if dimension is None else str(dimension)
+        for granularity in (HOUR, DAY):
+            self._counts[(metric, granularity, _bucket(now, granularity), dimension)] += amount
+        if metric in TOTAL_METRICS:
+            self._totals[(TOTAL_METRICS[metric], int(now))] += amount
+
+    def adjust_total(self, total: str, amount: int):
+        """Змінює загальну кількість без події в часовому ряді (наприклад, при видаленні новини)."""
+        self._totals[(total, int(time.time()))] += amount
+
+    def observe_unique(self, metric: str, value: int):
+        now = time.time()
+        for granularity in (HOUR, DAY):
+            key = (metric, granularity, _bucket(now, granularity))
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog(self.precision)
+            sketch.add(value)
+
+    async def flush(self):
+        if not (self._counts or self._totals or self._sketches):
+            return
+        counts, self._counts = self._counts, defaultdict(int)
+        totals, self._totals = self._totals, defaultdict(int)
+        sketches, self._sketches = self._sketches, {}
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    if counts:
+                        await cur.execute("""
+                            INSERT INTO stats_rollup (metric, granularity, bucket, dimension, value)
+                            SELECT * FROM unnest(%s::text[], %s::text[], %s::timestamptz[], %s::text[], %s::bigint[])
+                            ON CONFLICT (metric, granularity, bucket, dimension) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value
+                        """, ([k[0] for k in counts], [k[1] for k in counts], [_as_datetime(k[2]) for k in counts],
+                              [k[3] for k in counts], list(counts.values())))
+                    if totals:
+                        # Прирости, старші за останній перерахунок, уже враховані в його COUNT(*). Блокування рядків
+                        # чекає на перерахунок, що саме йде, тож наступний запит бачить уже новий reconciled_at
+                        await cur.execute("SELECT 1 FROM stats_totals WHERE metric = ANY(%s) FOR UPDATE", (list({k[0] for k in totals}),))
+                        await cur.execute("""
+                            INSERT INTO stats_totals (metric, value)
+                            SELECT d.metric, COALESCE(SUM(d.value) FILTER (WHERE t.reconciled_at IS NULL OR d.at >= t.reconciled_at), 0)
+                            FROM unnest(%s::text[], %s::bigint[], %s::timestamptz[]) AS d(metric, value, at)
+                            LEFT JOIN stats_totals t ON t.metric = d.metric
+                            GROUP BY d.metric
+                            ON CONFLICT (metric) DO UPDATE SET value = stats_totals.value + EXCLUDED.value
+                        """, ([k[0] for k in totals], list(totals.values()), [_as_datetime(k[1]) for k in totals]))
+                    if sketches:
+                        await self._merge_sketches(cur, sketches)
+        except Exception:
+            # Прирости не втрачаємо: повернемо їх до наступної синхронізації
+            for key, value in counts.items():
+                self._counts[key] += value
+            for key, value in totals.items():
+                self._totals[key] += value
+            for key, sketch in sketches.items():
+                self._sketches.setdefault(key, HyperLogLog(self.precision)).merge(sketch.registers)
+            raise
+
+    @staticmethod
+    async def _merge_sketches(cur, sketches: Dict[Tuple[str, str, int], HyperLogLog]):
+        # Масиви різної довжини не об'єднуємо в один unnest: кожен скетч — окремий рядок executemany
+        await cur.executemany("""
+            INSERT INTO stats_sketches (metric, granularity, bucket, registers) VALUES (%s, %s, %s, %s::smallint[])
+            ON CONFLICT (metric, granularity, bucket) DO UPDATE
+            SET registers = ARRAY(SELECT GREATEST(a, b) FROM unnest(stats_sketches.registers, EXCLUDED.registers) AS r(a, b))
+        """, [(metric, granularity, _as_datetime(bucket), list(sketch.registers))
+              for (metric, granularity, bucket), sketch in sketches.items()])
+
+    async def summary(self) -> Dict[str, Any]:
+        """Загальні кількості та активні користувачі за ACTIVE_WINDOW_DAYS днів, враховуючи ще не записані прирости."""
+        today = _bucket(time.time(), DAY)
+        since = today - (ACTIVE_WINDOW_DAYS - 1) * GRANULARITY_SECONDS[DAY]
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("SELECT metric, value, reconciled_at FROM stats_totals")
+                totals = {row["metric"]: row for row in await cur.fetchall()}
+                await cur.execute("SELECT registers FROM stats_sketches WHERE metric = %s AND granularity = %s AND bucket >= %s",
+                                  (ACTIVE_USERS, DAY, _as_datetime(since)))
+                stored = await cur.fetchall()
+        active = HyperLogLog(self.precision)
+        for row in stored:
+            active.merge(row["registers"])
+        for (metric, granularity, bucket), sketch in self._sketches.items():
+            if metric == ACTIVE_USERS and granularity == DAY and bucket >= since:
+                active.merge(sketch.registers)
+        pending: Dict[str, int] = defaultdict(int)
+        for (name, _), value in self._totals.items():
+            pending[name] += value
+        result = {name: (totals[name]["value"] if name in totals else 0) + pending[name] for name in RECONCILE_TABLES}
+        reconciled = [row["reconciled_at"] for row in totals.values() if row["reconciled_at"]]
+        result["active_users"] = active.estimate()
+        result["reconciled_at"] = min(reconciled) if reconciled else None
+        return result
+
+    async def series(self, metric: str, granularity: str, since: datetime) -> List[Dict[str, Any]]:
+        """Часовий ряд метрики з БД; для скетчів — оцінка кількості унікальних за кожен інтервал."""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                if metric == ACTIVE_USERS:
+                    await cur.execute("SELECT bucket, registers FROM stats_sketches WHERE metric = %s AND granularity = %s AND bucket >= %s ORDER BY bucket",
+                                      (metric, granularity, since))
+                    return [{"bucket": row["bucket"], "dimension": "", "value": HyperLogLog(self.precision, row["registers"]).estimate()}
+                            for row in await cur.fetchall()]
+                await cur.execute("""
+                    SELECT bucket, dimension, value FROM stats_rollup
+                    WHERE metric = %s AND granularity = %s AND bucket >= %s ORDER BY bucket, dimension
+                """, (metric, granularity, since))
+                return await cur.fetchall()
+
+    async def reconcile(self, payload: Optional[Dict[str, Any]] = None):
+        """Точно перераховує загальні кількості, доливає скетчі активних з last_active і видаляє старі годинні зведення.
+
+        reconciled_at — час початку запиту з COUNT(*) (statement_timestamp), тобто момент його знімка: прирости
+        з подій до нього flush відкине.
+        """
+        await self.flush()
+        now = time.time()
+        since = _bucket(now, DAY) - (ACTIVE_WINDOW_DAYS - 1) * GRANULARITY_SECONDS[DAY]
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            # Окрема транзакція на кожну кількість: рядок stats_totals не лишається заблокованим на весь перерахунок
+            for table in RECONCILE_TABLES:
+                async with conn.transaction():
+                    await conn.execute(f"""
+                        INSERT INTO stats_totals (metric, value, reconciled_at) SELECT %s, COUNT(*), statement_timestamp() FROM {table}
+                        ON CONFLICT (metric) DO UPDATE SET value = EXCLUDED.value, reconciled_at = EXCLUDED.reconciled_at
+                    """, (table,))
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT id, EXTRACT(EPOCH FROM last_active) FROM users WHERE last_active >= %s", (_as_datetime(since),))
+                sketches: Dict[Tuple[str, str, int], HyperLogLog] = {}
+                for user_id, last_active in await cur.fetchall():
+                    key = (ACTIVE_USERS, DAY, _bucket(float(last_active), DAY))
+                    sketches.setdefault(key, HyperLogLog(self.precision)).add(user_id)
+                if sketches:
+                    await self._merge_sketches(cur, sketches)
+                await cur.execute("DELETE FROM stats_rollup WHERE granularity = %s AND bucket < now() - make_interval(days => %s)",
+                                  (HOUR, STATS_HOURLY_RETENTION_DAYS))
+                await cur.execute("DELETE FROM stats_sketches WHERE granularity = %s AND bucket < now() - make_interval(days => %s)",
+                                  (HOUR, STATS_HOURLY_RETENTION_DAYS))
+
+    async def sync_task(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Помилка запису зведень статистики: {e}")
+
+rollup = StatsRollup(STATS_HLL_PRECISION)
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]]):
+    rollup.get_pool = get_pool
+    jobs.queue.handler("stats.reconcile", priority=150, every=STATS_RECONCILE_INTERVAL)(rollup.reconcile)
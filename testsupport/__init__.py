@@ -0,0 +1,12 @@
+"""Локальні заглушки Telegram Bot API та Gemini для офлайн-тестів продуктивності.
+
+Бот спрямовується на них змінними середовища TELEGRAM_API_URL та GEMINI_API_URL.
+Окремий запуск обох заглушок: python -m testsupport --help
+"""
+from testsupport.gemini_stub import GeminiStub
+from testsupport.latency import LatencyDistribution
+from testsupport.server import FaultInjector, StubServer, running, start_stub
+from testsupport.telegram_stub import FloodControl, TelegramStub
+
+__all__ = ["FaultInjector", "FloodControl", "GeminiStub", "LatencyDistribution", "StubServer",
+           "TelegramStub", "running", "start_stub"]
@@ -0,0 +1,3 @@
+from testsupport.cli import main
+
+main()
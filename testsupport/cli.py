@@ -0,0 +1,56 @@
+"""Параметри командного рядка заглушок та їх запуск як окремих серверів.
+
+    python -m testsupport --gemini-latency lognormal:800,0.5 --telegram-flood-per-chat 1
+"""
+import argparse
+import asyncio
+from typing import List, Optional, Tuple
+
+from testsupport.gemini_stub import GeminiStub
+from testsupport.latency import LatencyDistribution
+from testsupport.server import FaultInjector, start_stub
+from testsupport.telegram_stub import FloodControl, TelegramStub
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Параметри заглушок, спільні для python -m testsupport та скриптів у benchmarks/."""
+    parser.add_argument("--telegram-latency", type=LatencyDistribution.parse, default="normal:30,10", help="Розподіл затримки Bot API, мс")
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0, help="Частка відповідей Bot API з 429")
+    parser.add_argument("--telegram-flood-per-chat", type=int, help="Ліміт повідомлень на секунду в один чат")
+    parser.add_argument("--telegram-flood-global", type=int, help="Загальний ліміт повідомлень на секунду")
+    parser.add_argument("--gemini-latency", type=LatencyDistribution.parse, default="lognormal:800,0.5", help="Розподіл затримки Gemini, мс")
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="Частка відповідей Gemini з 429")
+    parser.add_argument("--gemini-5xx-rate", type=float, default=0.0, help="Частка відповідей Gemini з 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after у відповідях 429, секунд")
+
+def build_stubs(args: argparse.Namespace) -> Tuple[TelegramStub, GeminiStub]:
+    telegram = TelegramStub(latency=args.telegram_latency,
+                            faults=FaultInjector(rate_429=args.telegram_429_rate, retry_after=args.retry_after),
+                            flood=FloodControl(per_chat=args.telegram_flood_per_chat, global_limit=args.telegram_flood_global))
+    gemini = GeminiStub(latency=args.gemini_latency,
+                        faults=FaultInjector(rate_429=args.gemini_429_rate, rate_5xx=args.gemini_5xx_rate, retry_after=args.retry_after),
+                        chunk_latency=LatencyDistribution("exponential", 50))
+    return telegram, gemini
+
+async def serve(args: argparse.Namespace):
+    telegram, gemini = build_stubs(args)
+    telegram_server = await start_stub(telegram.make_app(), args.host, args.telegram_port)
+    gemini_server = await start_stub(gemini.make_app(), args.host, args.gemini_port)
+    print("Заглушки запущено. Для бота:")
+    print(f"  TELEGRAM_API_URL={telegram_server.url}")
+    print(f"  GEMINI_API_URL={gemini_server.url}/v1beta/models/gemini-2.0-flash-lite:generateContent")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await telegram_server.close()
+        await gemini_server.close()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m testsupport", description="Заглушки Telegram Bot API та Gemini.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--gemini-port", type=int, default=8082)
+    add_stub_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
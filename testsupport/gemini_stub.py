@@ -0,0 +1,95 @@
+"""Заглушка Gemini API (generateContent та streamGenerateContent).
+
+Відповідає на POST .../models/{model}:generateContent у форматі Gemini. streamGenerateContent віддає
+відповідь частинами: з ?alt=sse — як server-sent events, без нього — як JSON-масив, що надходить поступово.
+Затримка до першого байта та між частинами задаються розподілами; 429 повертається у форматі
+RESOURCE_EXHAUSTED з RetryInfo. GET /_stats повертає лічильники запитів.
+"""
+import json
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from testsupport.latency import LatencyDistribution
+from testsupport.server import FaultInjector, sleep_for
+
+DEFAULT_RESPONSE_TEXT = (
+    "Заголовок тестової новини\n\n"
+    "Це відповідь заглушки Gemini для офлайн-тестів продуктивності. Вона має структуру справжньої відповіді, "
+    "тож бот обробляє її так само, як відповідь реальної моделі."
+)
+
+class GeminiStub:
+    def __init__(self, latency: Optional[LatencyDistribution] = None, faults: Optional[FaultInjector] = None,
+                 response_text: str = DEFAULT_RESPONSE_TEXT, stream_chunks: int = 4,
+                 chunk_latency: Optional[LatencyDistribution] = None):
+        self.latency = latency
+        self.faults = faults or FaultInjector()
+        self.response_text = response_text
+        self.stream_chunks = max(1, stream_chunks)
+        self.chunk_latency = chunk_latency
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def _candidate(self, text: str, finished: bool) -> Dict[str, Any]:
+        candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        return {"candidates": [candidate]}
+
+    def _chunks(self) -> List[str]:
+        size = -(-len(self.response_text) // self.stream_chunks)
+        return [self.response_text[i:i + size] for i in range(0, len(self.response_text), size)] or [""]
+
+    def _error(self, code: int) -> web.Response:
+        if code == 429:
+            body = {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED",
+                              "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.faults.retry_after}s"}]}}
+        else:
+            body = {"error": {"code": code, "message": "Internal error encountered.", "status": "INTERNAL"}}
+        return web.json_response(body, status=code)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        path = request.match_info["tail"]
+        streaming = path.endswith(":streamGenerateContent")
+        if not streaming and not path.endswith(":generateContent"):
+            raise web.HTTPNotFound()
+        self.calls["stream" if streaming else "generate"] += 1
+        await request.read()
+        await sleep_for(self.latency)
+
+        fault = self.faults.draw()
+        if fault:
+            self.errors[str(fault)] += 1
+            return self._error(fault)
+        if not streaming:
+            return web.json_response(self._candidate(self.response_text, finished=True))
+
+        sse = request.query.get("alt") == "sse"
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream" if sse else "application/json"})
+        await response.prepare(request)
+        chunks = self._chunks()
+        if not sse:
+            await response.write(b"[")
+        for i, chunk in enumerate(chunks):
+            if i:
+                await sleep_for(self.chunk_latency)
+            payload = json.dumps(self._candidate(chunk, finished=i == len(chunks) - 1), ensure_ascii=False)
+            if sse:
+                await response.write(f"data: {payload}\r\n\r\n".encode("utf-8"))
+            else:
+                await response.write(((",\r\n" if i else "") + payload).encode("utf-8"))
+        if not sse:
+            await response.write(b"]")
+        await response.write_eof()
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(self.calls), "errors": dict(self.errors)})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/{tail:.*}", self.handle)
+        return app
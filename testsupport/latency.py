@@ -0,0 +1,54 @@
+"""Розподіли затримки відповіді для заглушок API.
+
+Розподіл задається рядком "тип:параметри", наприклад:
+    "50"                -> фіксовані 50 мс
+    "fixed:50"          -> фіксовані 50 мс
+    "normal:800,300"    -> нормальний, середнє 800 мс, відхилення 300 мс (від'ємні значення обрізаються до 0)
+    "exponential:200"   -> експоненційний із середнім 200 мс
+    "lognormal:800,0.5" -> логнормальний з медіаною 800 мс і sigma 0.5 (довгий хвіст, як у LLM-запитів)
+    "uniform:100,500"   -> рівномірний від 100 до 500 мс
+"""
+import math
+import random
+from typing import Optional
+
+KINDS = ("fixed", "normal", "exponential", "lognormal", "uniform")
+
+class LatencyDistribution:
+    def __init__(self, kind: str = "fixed", a: float = 0.0, b: float = 0.0, rng: Optional[random.Random] = None):
+        if kind not in KINDS:
+            raise ValueError(f"Невідомий тип розподілу: {kind}. Доступні: {', '.join(KINDS)}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec: str, rng: Optional[random.Random] = None) -> "LatencyDistribution":
+        kind, _, params = spec.partition(":")
+        if not params:
+            kind, params = "fixed", kind
+        values = [float(v) for v in params.split(",") if v.strip()]
+        if not values:
+            raise ValueError(f"Некоректний розподіл затримки: {spec!r}")
+        return cls(kind.strip().lower(), values[0], values[1] if len(values) > 1 else 0.0, rng=rng)
+
+    def sample_ms(self) -> float:
+        if self.kind == "fixed":
+            value = self.a
+        elif self.kind == "normal":
+            value = self._rng.gauss(self.a, self.b)
+        elif self.kind == "exponential":
+            value = self._rng.expovariate(1 / self.a) if self.a > 0 else 0.0
+        elif self.kind == "lognormal":
+            value = self._rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        else:
+            value = self._rng.uniform(self.a, self.b)
+        return max(0.0, value)
+
+    def sample(self) -> float:
+        """Затримка в секундах (для asyncio.sleep)."""
+        return self.sample_ms() / 1000
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{self.a:g},{self.b:g}" if self.kind in ("normal", "lognormal", "uniform") else f"{self.kind}:{self.a:g}"
@@ -0,0 +1,60 @@
+"""Спільне для заглушок: запуск aiohttp-застосунку на вільному порту та випадкові збої."""
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aiohttp import web
+
+from testsupport.latency import LatencyDistribution
+
+class FaultInjector:
+    """Повертає код помилки, яку слід віддати замість відповіді: 429 з імовірністю rate_429, 500 з імовірністю rate_5xx."""
+
+    def __init__(self, rate_429: float = 0.0, rate_5xx: float = 0.0, retry_after: int = 1, rng: Optional[random.Random] = None):
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self._rng = rng or random.Random()
+
+    def draw(self) -> Optional[int]:
+        if not self.rate_429 and not self.rate_5xx:
+            return None
+        roll = self._rng.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_5xx:
+            return 500
+        return None
+
+async def sleep_for(latency: Optional[LatencyDistribution]):
+    if latency is None:
+        return
+    delay = latency.sample()
+    if delay:
+        await asyncio.sleep(delay)
+
+class StubServer:
+    def __init__(self, runner: web.AppRunner, url: str):
+        self.runner = runner
+        self.url = url
+
+    async def close(self):
+        await self.runner.cleanup()
+
+async def start_stub(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """Запускає застосунок; port=0 — будь-який вільний порт (адреса доступна в StubServer.url)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return StubServer(runner, f"http://{host}:{bound_port}")
+
+@asynccontextmanager
+async def running(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> AsyncIterator[StubServer]:
+    server = await start_stub(app, host, port)
+    try:
+        yield server
+    finally:
+        await server.close()
@@ -0,0 +1,109 @@
+"""Заглушка Telegram Bot API.
+
+Приймає запити у форматі {base}/bot{token}/{method} (як aiogram з TelegramAPIServer.from_base) і
+відповідає правдоподібними об'єктами: send*/edit* повертають Message, getMe — бота, решта методів — True.
+Можна задати затримку, випадкові 429/500 та ліміти частоти на кшталт справжніх (повідомлень на секунду
+в один чат і загалом): при перевищенні повертається 429 з parameters.retry_after, тобто TelegramRetryAfter в aiogram.
+GET /_stats повертає лічильники викликів за методами.
+"""
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Deque, Dict, Optional
+
+from aiohttp import web
+
+from testsupport.latency import LatencyDistribution
+from testsupport.server import FaultInjector, sleep_for
+
+STUB_BOT_ID = 123456
+# Методи, що надсилають або змінюють повідомлення; саме на них Telegram накладає ліміти частоти
+MESSAGE_METHODS = ("send", "edit", "copy", "forward")
+
+class FloodControl:
+    """Ковзне вікно в одну секунду: per_chat повідомлень на чат і global_limit повідомлень загалом."""
+
+    def __init__(self, per_chat: Optional[int] = None, global_limit: Optional[int] = None):
+        self.per_chat = per_chat
+        self.global_limit = global_limit
+        self._chat_sent: Dict[int, Deque[float]] = defaultdict(deque)
+        self._global_sent: Deque[float] = deque()
+
+    @staticmethod
+    def _over_limit(window: Deque[float], limit: Optional[int], now: float) -> bool:
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        return limit is not None and len(window) >= limit
+
+    def check(self, chat_id: int) -> Optional[int]:
+        """None, якщо повідомлення можна надіслати; інакше — retry_after у секундах."""
+        if self.per_chat is None and self.global_limit is None:
+            return None
+        now = time.monotonic()
+        chat_window = self._chat_sent[chat_id]
+        if self._over_limit(chat_window, self.per_chat, now) or self._over_limit(self._global_sent, self.global_limit, now):
+            return 1
+        chat_window.append(now)
+        self._global_sent.append(now)
+        return None
+
+class TelegramStub:
+    def __init__(self, latency: Optional[LatencyDistribution] = None, faults: Optional[FaultInjector] = None,
+                 flood: Optional[FloodControl] = None):
+        self.latency = latency
+        self.faults = faults or FaultInjector()
+        self.flood = flood or FloodControl()
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._message_id = 0
+
+    @staticmethod
+    def _error(code: int, description: str, retry_after: Optional[int] = None) -> web.Response:
+        body: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+        if retry_after is not None:
+            body["parameters"] = {"retry_after": retry_after}
+        return web.json_response(body, status=code)
+
+    def _result(self, method: str, payload: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return {"id": STUB_BOT_ID, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        if method == "getwebhookinfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method.startswith(MESSAGE_METHODS) and method != "sendchataction":
+            self._message_id += 1
+            return {"message_id": self._message_id, "date": int(time.time()),
+                    "chat": {"id": int(payload.get("chat_id") or 0), "type": "private"},
+                    "from": {"id": STUB_BOT_ID, "is_bot": True, "first_name": "Stub"},
+                    "text": payload.get("text", "")}
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            payload = await request.json()
+        else:
+            payload = dict(await request.post())
+        await sleep_for(self.latency)
+
+        fault = self.faults.draw()
+        if fault == 429:
+            self.errors["429"] += 1
+            return self._error(429, f"Too Many Requests: retry after {self.faults.retry_after}", self.faults.retry_after)
+        if fault:
+            self.errors[str(fault)] += 1
+            return self._error(fault, "Internal Server Error")
+        if method.startswith(MESSAGE_METHODS) and method != "sendchataction":
+            retry_after = self.flood.check(int(payload.get("chat_id") or 0))
+            if retry_after:
+                self.errors["flood"] += 1
+                return self._error(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+        return web.json_response({"ok": True, "result": self._result(method, payload)})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(self.calls), "errors": dict(self.errors)})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/_stats", self.stats)
+        return app
@@ -0,0 +1,276 @@
+"""Локальна модель тем новин: хешовані TF-IDF ознаки й one-vs-rest логістична регресія на NumPy.
+
+Навчається на news.ai_classified_topics, які вже розмітив Gemini (або адміністратор); власні передбачення
+моделі (topics_source = 'local') у навчання не потрапляють, щоб вона не вчилася сама в себе. Слова й
+біграми хешуються (crc32, однаковий у всіх процесах) у 2^TOPIC_MODEL_FEATURE_BITS ознак, тож словник не
+зберігається, а передбачення — це сума кількох сотень рядків матриці ваг.
+
+Кожен екземпляр бота перенавчає модель раз на TOPIC_MODEL_RETRAIN_INTERVAL секунд в окремому процесі
+(ProcessPoolExecutor), не блокуючи цикл подій, і атомарно підміняє її. 10% прикладів відкладаються для
+перевірки: модель використовується, лише якщо її впевнені відповіді на відкладених прикладах точні хоча б
+на TOPIC_MODEL_MIN_PRECISION. Невпевнена модель повертає None, і тоді, як і раніше, питаємо Gemini.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import stats_rollup
+
+logger = logging.getLogger(__name__)
+
+TOPIC_MODEL_ENABLED = os.getenv("TOPIC_MODEL_ENABLED", "1").lower() not in ("0", "false", "no") # Відповідати локальною моделлю тем замість Gemini, коли вона впевнена
+TOPIC_MODEL_RETRAIN_INTERVAL = int(os.getenv("TOPIC_MODEL_RETRAIN_INTERVAL", "21600")) # Як часто перенавчати модель, секунд
+TOPIC_MODEL_FEATURE_BITS = int(os.getenv("TOPIC_MODEL_FEATURE_BITS", "16")) # Кількість хешованих ознак — 2^bits
+TOPIC_MODEL_MAX_LABELS = int(os.getenv("TOPIC_MODEL_MAX_LABELS", "64")) # Скільки найчастіших тем модель розрізняє
+TOPIC_MODEL_MIN_LABEL_EXAMPLES = int(os.getenv("TOPIC_MODEL_MIN_LABEL_EXAMPLES", "20")) # Рідші теми модель не вчить
+TOPIC_MODEL_MIN_EXAMPLES = int(os.getenv("TOPIC_MODEL_MIN_EXAMPLES", "300")) # Менше розмічених новин — модель не навчається
+TOPIC_MODEL_MAX_EXAMPLES = int(os.getenv("TOPIC_MODEL_MAX_EXAMPLES", "20000")) # Скільки найсвіжіших новин брати для навчання
+TOPIC_MODEL_CONFIDENCE = float(os.getenv("TOPIC_MODEL_CONFIDENCE", "0.8")) # Ймовірність, з якої відповідь моделі вважається впевненою
+TOPIC_MODEL_MIN_PRECISION = float(os.getenv("TOPIC_MODEL_MIN_PRECISION", "0.85")) # Мінімальна точність впевнених відповідей на відкладених прикладах
+
+TOKEN_RE = re.compile(r"\w{2,}", re.UNICODE)
+MAX_TEXT_LENGTH = 2000
+MAX_TOPICS = 5
+EPOCHS = 5
+BATCH_SIZE = 256
+LEARNING_RATE = 0.5
+BIAS_LEARNING_RATE = 0.05
+HOLDOUT_SHARE = 0.1
+
+def normalize_topic(topic: str) -> str:
+    return topic.strip().strip(".").lower()
+
+def hashed_counts(text: str, bits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Унікальні індекси ознак (слова й біграми) та їхні кількості."""
+    tokens = TOKEN_RE.findall(text[:MAX_TEXT_LENGTH].lower())
+    tokens += [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    mask = (1 << bits) - 1
+    hashed = np.fromiter((zlib.crc32(token.encode("utf-8")) & mask for token in tokens), dtype=np.int64, count=len(tokens))
+    return np.unique(hashed, return_counts=True)
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+class TopicModel:
+    def __init__(self, labels: List[str], idf: np.ndarray, weights: np.ndarray, bias: np.ndarray, bits: int):
+        self.labels = labels
+        self.label_index = {normalize_topic(label): i for i, label in enumerate(labels)}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.bits = bits
+        self.examples = 0
+        self.precision = 0.0
+        self.coverage = 0.0
+
+    def features(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        indices, counts = hashed_counts(text, self.bits)
+        values = np.log1p(counts) * self.idf[indices]
+        norm = np.linalg.norm(values)
+        return indices, (values / norm if norm else values).astype(np.float32)
+
+    def probabilities(self, text: str) -> np.ndarray:
+        indices, values = self.features(text)
+        return _sigmoid(values @ self.weights[indices] + self.bias)
+
+    def classify(self, text: str, confidence: float) -> Optional[List[str]]:
+        """До MAX_TOPICS тем, якщо модель упевнена хоча б в одній; інакше None."""
+        probs = self.probabilities(text)
+        order = np.argsort(probs)[::-1][:MAX_TOPICS]
+        if probs[order[0]] < confidence:
+            return None
+        return [self.labels[i] for i in order if probs[i] >= 0.5]
+
+    def is_interesting(self, text: str, interests: Iterable[str], confidence: float) -> Optional[bool]:
+        """True/False, якщо модель упевнена щодо тем інтересів; None — інтереси їй невідомі або вона вагається."""
+        known = [self.label_index.get(normalize_topic(topic)) for topic in interests]
+        if not known or None in known:
+            return None
+        probs = self.probabilities(text)[known]
+        if probs.max() >= confidence:
+            return True
+        if probs.max() <= 1 - confidence:
+            return False
+        return None
+
+def _matrix(rows: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Розріджена (CSR) матриця пачки: індекси ознак, значення, номер рядка кожного елемента й початки рядків."""
+    lengths = np.array([len(row[0]) for row in rows])
+    indices = np.concatenate([row[0] for row in rows])
+    values = np.concatenate([row[1] for row in rows])
+    row_ids = np.repeat(np.arange(len(rows)), lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return indices, values, row_ids, starts
+
+def _scores(weights: np.ndarray, bias: np.ndarray, indices: np.ndarray, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    # Порожніх рядків немає (їх відкинуто під час підготовки), тож reduceat підсумовує кожен рядок
+    return np.add.reduceat(values[:, None] * weights[indices], starts) + bias
+
+def train(examples: List[Tuple[str, List[str]]], bits: int, max_labels: int, min_label_examples: int,
+          confidence: float, seed: int = 0) -> Optional[TopicModel]:
+    """Навчає модель на парах (текст, теми); виконується в окремому процесі. None — замало даних."""
+    rng = np.random.default_rng(seed)
+    spellings: Dict[str, Counter] = {}
+    for _, topics in examples:
+        for topic in topics:
+            spellings.setdefault(normalize_topic(topic), Counter())[topic.strip()] += 1
+    frequent = sorted((key for key, forms in spellings.items() if key and sum(forms.values()) >= min_label_examples),
+                      key=lambda key: -sum(spellings[key].values()))[:max_labels]
+    if not frequent:
+        return None
+    label_index = {key: i for i, key in enumerate(frequent)}
+    # Тема показується в найчастішому написанні з розмітки
+    labels = [spellings[key].most_common(1)[0][0] for key in frequent]
+
+    counts, targets = [], []
+    for text, topics in examples:
+        indices, tf = hashed_counts(text, bits)
+        if len(indices) == 0:
+            continue
+        target = np.zeros(len(labels), dtype=np.float32)
+        for topic in topics:
+            if normalize_topic(topic) in label_index:
+                target[label_index[normalize_topic(topic)]] = 1
+        counts.append((indices, tf))
+        targets.append(target)
+    n = len(counts)
+    if n < 2:
+        return None
+    y = np.stack(targets)
+
+    df = np.bincount(np.concatenate([indices for indices, _ in counts]), minlength=1 << bits)
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    rows = []
+    for indices, tf in counts:
+        values = np.log1p(tf) * idf[indices]
+        rows.append((indices, (values / np.linalg.norm(values)).astype(np.float32)))
+
+    order = rng.permutation(n)
+    holdout = order[:max(1, int(n * HOLDOUT_SHARE))]
+    train_rows = order[len(holdout):]
+
+    # Зсув ініціалізуємо апріорною частотою теми: рідкі теми одразу мають низьку ймовірність
+    prior = np.clip(y[train_rows].mean(axis=0), 1e-4, 1 - 1e-4)
+    bias = np.log(prior / (1 - prior)).astype(np.float32)
+    weights = np.zeros((1 << bits, len(labels)), dtype=np.float32)
+    squared = np.full_like(weights, 1e-8) # Накопичені квадрати градієнтів (AdaGrad)
+    for _ in range(EPOCHS):
+        rng.shuffle(train_rows)
+        for start in range(0, len(train_rows), BATCH_SIZE):
+            batch = train_rows[start:start + BATCH_SIZE]
+            indices, values, row_ids, starts = _matrix([rows[i] for i in batch])
+            errors = _sigmoid(_scores(weights, bias, indices, values, starts)) - y[batch]
+            # Градієнт лише для ознак, що трапились у пачці: сортуємо внески за ознакою й підсумовуємо групи
+            order = np.argsort(indices, kind="stable")
+            sorted_indices = indices[order]
+            group_starts = np.flatnonzero(np.concatenate(([True], sorted_indices[1:] != sorted_indices[:-1])))
+            touched = sorted_indices[group_starts]
+            gradient = np.add.reduceat((values[:, None] * errors[row_ids])[order], group_starts) / len(batch)
+            squared[touched] += gradient ** 2
+            weights[touched] -= LEARNING_RATE * gradient / np.sqrt(squared[touched])
+            bias -= BIAS_LEARNING_RATE * errors.mean(axis=0)
+
+    model = TopicModel(labels, idf, weights, bias, bits)
+    model.examples = len(train_rows)
+    indices, values, _, starts = _matrix([rows[i] for i in holdout])
+    probs = _sigmoid(_scores(weights, bias, indices, values, starts))
+    top = probs.argmax(axis=1)
+    confident = probs[np.arange(len(holdout)), top] >= confidence
+    model.coverage = float(confident.mean())
+    if confident.any():
+        model.precision = float(y[holdout[confident], top[confident]].mean())
+    return model
+
+class TopicModelService:
+    def __init__(self, enabled: bool, retrain_interval: int, confidence: float, min_precision: float):
+        self.enabled = enabled
+        self.retrain_interval = retrain_interval
+        self.confidence = confidence
+        self.min_precision = min_precision
+        self.get_pool: Optional[Callable[[], Awaitable[AsyncConnectionPool]]] = None
+        self.window_sql = "TRUE"
+        self.model: Optional[TopicModel] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def classify(self, text: str) -> Optional[List[str]]:
+        if not self.enabled or self.model is None:
+            return None
+        topics = self.model.classify(text, self.confidence)
+        stats_rollup.rollup.incr("topic_model", "classify_local" if topics else "classify_fallback")
+        return topics
+
+    def is_interesting(self, text: str, interests: List[str]) -> Optional[bool]:
+        if not self.enabled or self.model is None:
+            return None
+        verdict = self.model.is_interesting(text, interests, self.confidence)
+        stats_rollup.rollup.incr("topic_model", "filter_fallback" if verdict is None else "filter_local")
+        return verdict
+
+    async def _examples(self) -> List[Tuple[str, List[str]]]:
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                # Передбачення самої моделі (topics_source = 'local') не є розміткою
+                await cur.execute(f"""
+                    SELECT title, LEFT(content, {MAX_TEXT_LENGTH}) AS content, ai_classified_topics FROM news
+                    WHERE ai_classified_topics IS NOT NULL AND topics_source IS DISTINCT FROM 'local' AND {self.window_sql}
+                    ORDER BY published_at DESC LIMIT %s
+                """, (TOPIC_MODEL_MAX_EXAMPLES,))
+                rows = await cur.fetchall()
+        return [(f"{row['title']}\n{row['content']}", [str(topic) for topic in row['ai_classified_topics']])
+                for row in rows if isinstance(row['ai_classified_topics'], list) and row['ai_classified_topics']]
+
+    async def retrain(self):
+        examples = await self._examples()
+        if len(examples) < TOPIC_MODEL_MIN_EXAMPLES:
+            logger.info(f"Модель тем не навчається: {len(examples)} розмічених новин (потрібно {TOPIC_MODEL_MIN_EXAMPLES}).")
+            return
+        if self._executor is None:
+            # spawn: дочірній процес не успадковує цикл подій і з'єднання батьківського
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        started = time.perf_counter()
+        model = await asyncio.get_running_loop().run_in_executor(
+            self._executor, train, examples, TOPIC_MODEL_FEATURE_BITS, TOPIC_MODEL_MAX_LABELS,
+            TOPIC_MODEL_MIN_LABEL_EXAMPLES, self.confidence)
+        if model is None:
+            logger.info("Модель тем не навчено: немає тем із достатньою кількістю прикладів.")
+            return
+        summary = (f"{len(model.labels)} тем, {model.examples} прикладів, точність {model.precision:.2f} "
+                   f"при покритті {model.coverage:.2f}, {time.perf_counter() - started:.1f} с")
+        if model.precision < self.min_precision:
+            # Стара модель теж не відповідає новим даним достатньо добре, тож до кращого навчання — лише Gemini
+            self.model = None
+            logger.warning(f"Модель тем недостатньо точна, використовується лише Gemini: {summary}.")
+            return
+        self.model = model
+        logger.info(f"Модель тем оновлено: {summary}.")
+
+    async def train_task(self):
+        while True:
+            try:
+                await self.retrain()
+            except Exception as e:
+                logger.error(f"Помилка навчання моделі тем: {e}")
+            await asyncio.sleep(self.retrain_interval)
+
+    def stop(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+service = TopicModelService(TOPIC_MODEL_ENABLED, TOPIC_MODEL_RETRAIN_INTERVAL, TOPIC_MODEL_CONFIDENCE, TOPIC_MODEL_MIN_PRECISION)
+
+def setup(get_pool: Callable[[], Awaitable[AsyncConnectionPool]], window_sql: str):
+    service.get_pool = get_pool
+    service.window_sql = window_sql